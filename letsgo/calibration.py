@@ -0,0 +1,110 @@
+"""
+Persistent records of how fast each train has been seen to go
+
+Each train's observations are kept in a fixed-size ring of records in a NumPy array
+file, memory-mapped so that recording an observation is just a write to memory. Files
+are only opened when a train's observations are first needed, and are used to warm-start
+the train's speed model, so it doesn't have to start from scratch each session.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import urllib.parse
+from typing import Dict, Union
+
+import numpy as np
+
+__all__ = ["CALIBRATION_DTYPE", "CalibrationRing", "CalibrationStore"]
+
+CALIBRATION_DTYPE = np.dtype(
+    [
+        ("sequence", "<u8"),  # Zero for an empty slot
+        ("when", "<f8"),
+        ("speed", "<f4"),
+        ("motor_speed", "<f4"),
+        ("battery_level", "<f4"),
+        ("battery_level_available", "<f4"),
+        ("lights_on", "<f4"),
+    ]
+)
+
+
+class CalibrationRing:
+    """The most recent observations of a train, oldest overwritten first"""
+
+    def __init__(self, path: Union[str, os.PathLike], capacity: int):
+        if os.path.exists(path):
+            self.records = np.lib.format.open_memmap(path, mode="r+")
+            if self.records.dtype != CALIBRATION_DTYPE:
+                raise ValueError(f"{path} doesn't contain calibration records")
+        else:
+            self.records = np.lib.format.open_memmap(
+                path, mode="w+", dtype=CALIBRATION_DTYPE, shape=(capacity,)
+            )
+        self._lock = threading.Lock()
+        self._sequence = int(self.records["sequence"].max(initial=0))
+
+    @property
+    def capacity(self) -> int:
+        return len(self.records)
+
+    def append(
+        self,
+        when: float,
+        speed: float,
+        motor_speed: float,
+        battery_level: float,
+        battery_level_available: float,
+        lights_on: float,
+    ):
+        with self._lock:
+            self._sequence += 1
+            self.records[self._sequence % self.capacity] = (
+                self._sequence,
+                when,
+                speed,
+                motor_speed,
+                battery_level,
+                battery_level_available,
+                lights_on,
+            )
+
+    def observations(self) -> np.ndarray:
+        """Returns a copy of the observations, oldest first"""
+        with self._lock:
+            records = self.records[self.records["sequence"] > 0]
+            return np.sort(records, order="sequence")
+
+    def __len__(self):
+        return min(self._sequence, self.capacity)
+
+    def flush(self):
+        self.records.flush()
+
+
+class CalibrationStore:
+    """Calibration rings for any number of trains, one file each in a directory"""
+
+    def __init__(self, directory: Union[str, os.PathLike], capacity: int = 4096):
+        self.directory = directory
+        self.capacity = capacity
+        """How many observations to keep for each new train"""
+        self._rings: Dict[str, CalibrationRing] = {}
+        self._lock = threading.Lock()
+
+    def ring(self, train_id: str) -> CalibrationRing:
+        with self._lock:
+            if train_id not in self._rings:
+                os.makedirs(self.directory, exist_ok=True)
+                filename = urllib.parse.quote(train_id, safe="") + ".npy"
+                self._rings[train_id] = CalibrationRing(
+                    os.path.join(self.directory, filename), self.capacity
+                )
+            return self._rings[train_id]
+
+    def flush(self):
+        with self._lock:
+            for ring in self._rings.values():
+                ring.flush()
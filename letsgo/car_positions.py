@@ -0,0 +1,169 @@
+"""
+Where each of a train's bogeys and magnets are, kept up to date as it moves
+
+Working out where a point some way behind the front of a train is means walking a track
+point back along the track, piece by piece. Rather than doing that for every bogey and
+magnet whenever they're needed, their positions are kept as segments of the compiled
+track graph (see `letsgo.track_graph`) and offsets along them. These are moved along by
+however far the train's odometer says it has gone since they were last asked for, as
+`letsgo.magnet_index` does for magnets, and only walked back from the front again when
+the train is repositioned, reverses, or the track changes.
+
+World poses, for drawing, are worked out from those when asked for, and kept until the
+train moves or the layout changes.
+"""
+
+from __future__ import annotations
+
+import math
+from typing import List, Optional, Tuple, TYPE_CHECKING
+
+import numpy as np
+
+from letsgo.track_graph import Segment, TrackGraph
+from letsgo.track_point import EndOfTheLine
+
+if TYPE_CHECKING:
+    from letsgo.train import Train
+
+__all__ = ["CarPositions"]
+
+Location = Optional[Tuple[Segment, float]]
+
+
+class CarPositions:
+    def __init__(self, train: Train):
+        self.train = train
+        self.graph: Optional[TrackGraph] = None
+        self.car_bogeys: List[slice] = []
+        """Which of the bogeys belong to each car, front to rear"""
+        self.magnet_cars: List[int] = []
+        """Which car each magnet belongs to"""
+        self.behind: List[float] = []
+        """How far each bogey, then each magnet, is behind the front of the train"""
+        self.segments: List[Optional[Segment]] = []
+        """The segment each bogey and magnet is on, or None if it isn't known"""
+        self.offsets: List[float] = []
+        self._bogey_count = 0
+        self._odometer = 0.0
+        self._poses: Optional[np.ndarray] = None
+        self._poses_epoch: Optional[int] = None
+        self.reset()
+
+    def reset(self):
+        """Works out where bogeys and magnets are on cars again, e.g. if the cars
+        change, and where they are on the track when next asked"""
+        behind: List[float] = []
+        self.car_bogeys, self.magnet_cars = [], []
+        for i, car_offset in enumerate(self.train.car_offsets()):
+            car = self.train.cars[i]
+            start = len(behind)
+            behind.extend(
+                car_offset + bogey_offset for bogey_offset in car.bogey_offsets
+            )
+            self.car_bogeys.append(slice(start, len(behind)))
+        self._bogey_count = len(behind)
+        for car_index, magnet_offset in self.train.magnet_offsets():
+            self.magnet_cars.append(car_index)
+            behind.append(magnet_offset)
+        self.behind = behind
+        self.graph = None
+
+    def invalidate(self):
+        """Forgets where bogeys and magnets are on the track, e.g. if the train has
+        been put somewhere else"""
+        self.graph = None
+
+    def _current_graph(self) -> TrackGraph:
+        if self.train.layout is not None:
+            return self.train.layout.track_graph
+        return self.graph or self.train.position._track_graph()
+
+    def _sync(self) -> bool:
+        """Brings locations up to date, returning whether the train is on the track"""
+        # Not Train.position, which would have a kinematics engine work it out
+        if self.train._position is None:
+            return False
+        graph = self._current_graph()
+        odometer = self.train.odometer
+        if (
+            self.graph is not graph
+            or odometer < self._odometer
+            or None in self.segments
+        ):
+            self._place(graph)
+        elif odometer > self._odometer:
+            self._advance(odometer - self._odometer)
+        self._odometer = odometer
+        return True
+
+    def _place(self, graph: TrackGraph):
+        self.graph = graph
+        position = self.train.position
+        self.segments, self.offsets = [], []
+        for behind in self.behind:
+            try:
+                segment, offset = graph.locate(position - behind)
+            except (EndOfTheLine, KeyError):
+                segment, offset = None, 0.0
+            self.segments.append(segment)
+            self.offsets.append(offset)
+        self._poses = None
+
+    def _advance(self, distance: float):
+        """Moves locations along, following the current state of points"""
+        for i, segment in enumerate(self.segments):
+            offset = self.offsets[i] + distance
+            while segment and offset > segment.length:
+                offset -= segment.length
+                for successor in segment.successors:
+                    if successor.available:
+                        segment = successor
+                        break
+                else:
+                    segment = None
+            self.segments[i], self.offsets[i] = segment, offset
+        self._poses = None
+
+    def _locations(self, start: int, stop: int) -> List[Location]:
+        return [
+            (segment, offset) if segment else None
+            for segment, offset in zip(
+                self.segments[start:stop], self.offsets[start:stop]
+            )
+        ]
+
+    def bogey_locations(self) -> List[Location]:
+        """Where each bogey is on the track graph, or None if it isn't known"""
+        if not self._sync():
+            return [None] * self._bogey_count
+        return self._locations(0, self._bogey_count)
+
+    def magnet_locations(self) -> List[Tuple[int, Location]]:
+        """The car each magnet belongs to, and where it is on the track graph"""
+        if not self._sync():
+            return [(car_index, None) for car_index in self.magnet_cars]
+        locations = self._locations(self._bogey_count, len(self.behind))
+        return list(zip(self.magnet_cars, locations))
+
+    def bogey_poses(self) -> np.ndarray:
+        """Each bogey's x, y and angle in the world, as rows, with NaNs where not known"""
+        if not self._sync():
+            return np.full((self._bogey_count, 3), math.nan)
+        epoch = self.train.layout.epoch if self.train.layout is not None else None
+        if self._poses is None or self._poses_epoch != epoch:
+            poses = np.full((self._bogey_count, 3), math.nan)
+            for i, location in enumerate(self.bogey_locations()):
+                if location is None:
+                    continue
+                segment, offset = location
+                (piece, in_anchor, out_anchor), offset = segment.traversal_at(offset)
+                if piece.position:
+                    poses[i] = tuple(
+                        piece.position
+                        + piece.point_position(
+                            in_anchor=in_anchor, out_anchor=out_anchor, offset=offset
+                        )
+                    )
+            self._poses, self._poses_epoch = poses, epoch
+        return self._poses
@@ -5,6 +5,7 @@ from pkg_resources import iter_entry_points
 from .base import *
 from .maestro import *
 from .powered_up import *
+from .simulated import *
 
 
 controller_classes: Dict[str, Type[Controller]] = {
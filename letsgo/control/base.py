@@ -1,9 +1,12 @@
 from __future__ import annotations
 
+import asyncio
+import math
 from typing import Any, Dict, Optional
 
 from letsgo import signals
 from letsgo.registry_meta import WithRegistry
+from .event_queue import SensorEventQueue
 
 __all__ = ["Controller", "SensorController", "TrainController"]
 
@@ -53,14 +56,43 @@ class Controller(WithRegistry):
             self._device_present = present
             signals.controller_presence_changed.send(self, present=present)
 
-    def start(self):
-        raise NotImplemented
+    async def start(self):
+        """Prepares to run, before the first run and before each restart"""
 
-    def stop(self):
-        raise NotImplemented
+    async def run(self):
+        """Talks to the device until cancelled
+
+        Raising an exception (e.g. if the device goes away) will cause the controller
+        to be stopped and then restarted after a delay.
+        """
+        await asyncio.get_event_loop().create_future()
+
+    async def stop(self):
+        """Cleans up after running, whether it finished, failed or was cancelled"""
 
 
 class SensorController(Controller):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sensor_events = SensorEventQueue()
+        """Sensor activity read by this controller's thread, for the layout to handle"""
+
+    def report_sensor_activity(self, sensor, activated: bool, when: float):
+        """Queues a change in a sensor's state, to be handled on the layout's thread"""
+        self.sensor_events.put(sensor, activated, when)
+
+    def magnet_expected_in(self, sensors, now: float) -> float:
+        """How soon, in seconds, a magnet is expected at any of some sensors, as of the
+        layout's last tick"""
+        magnet_arrivals = self.layout.magnet_arrivals if self.layout else {}
+        return (
+            min(
+                (magnet_arrivals.get(sensor, math.inf) for sensor in sensors),
+                default=math.inf,
+            )
+            - now
+        )
+
     def register_sensor(self, sensor, *, index: int, **params):
         raise NotImplemented
 
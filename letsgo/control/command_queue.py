@@ -0,0 +1,157 @@
+"""
+Coalescing, rate-limited queues of commands to devices
+
+Commands are keyed by kind (e.g. "motor" or "lights"), and only the latest value of
+each kind is kept until it can be sent. Values that barely differ from what was last
+sent are dropped, and each device is sent at most `max_rate` commands a second, except
+for urgent commands (e.g. stopping), which go to the front of the queue and are sent
+straight away.
+"""
+
+from __future__ import annotations
+
+import logging
+import math
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+__all__ = ["CommandQueue", "CommandDispatcher"]
+
+logger = logging.getLogger(__name__)
+
+_sentinel = object()
+
+Command = Tuple[str, Any]
+
+
+class CommandQueue:
+    def __init__(
+        self,
+        send: Callable[[str, Any], None],
+        *,
+        max_rate: float = 10.0,
+        min_change: float = 0.02,
+        condition: Optional[threading.Condition] = None,
+    ):
+        self.send = send
+        self.min_interval = 1 / max_rate
+        self.min_change = min_change
+        self.condition = condition or threading.Condition()
+        self._pending: Dict[str, Any] = {}
+        self._urgent: Set[str] = set()
+        self._sent: Dict[str, Any] = {}
+        self._last_send_time = -math.inf
+
+    def put(self, kind: str, value: Any, urgent: bool = False):
+        with self.condition:
+            sent = self._sent.get(kind, _sentinel)
+            if (
+                not urgent
+                and sent is not _sentinel
+                and self._is_negligible(sent, value)
+            ):
+                # Whatever was pending has been superseded by something we've already sent
+                self._pending.pop(kind, None)
+                self._urgent.discard(kind)
+                return
+            self._pending[kind] = value
+            if urgent:
+                self._urgent.add(kind)
+            else:
+                self._urgent.discard(kind)
+            self.condition.notify_all()
+
+    def _is_negligible(self, sent: Any, value: Any) -> bool:
+        if value == sent:
+            return True
+        try:
+            return abs(value - sent) < self.min_change
+        except TypeError:
+            return False
+
+    def next_ready(self, now: float) -> Optional[float]:
+        """Returns when the next command can be sent, or None if there isn't one"""
+        if not self._pending:
+            return None
+        elif self._urgent:
+            return now
+        return max(now, self._last_send_time + self.min_interval)
+
+    def pop_ready(self, now: float) -> Optional[Command]:
+        """Removes and returns a command, if one can be sent now"""
+        if self._urgent:
+            kind = self._urgent.pop()
+        elif self._pending and now >= self._last_send_time + self.min_interval:
+            kind = next(iter(self._pending))
+        else:
+            return None
+        value = self._pending.pop(kind)
+        self._sent[kind] = value
+        self._last_send_time = now
+        return kind, value
+
+    def __len__(self):
+        return len(self._pending)
+
+
+class CommandDispatcher:
+    """Sends commands from any number of queues, on a single thread"""
+
+    def __init__(self, name: str = "command-dispatcher"):
+        self.condition = threading.Condition()
+        self.queues: List[CommandQueue] = []
+        self._running = False
+        self._name = name
+        self._thread: Optional[threading.Thread] = None
+
+    def add_queue(self, send: Callable[[str, Any], None], **kwargs) -> CommandQueue:
+        queue = CommandQueue(send, condition=self.condition, **kwargs)
+        with self.condition:
+            self.queues.append(queue)
+        return queue
+
+    def remove_queue(self, queue: CommandQueue):
+        with self.condition:
+            self.queues.remove(queue)
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self.condition:
+            self._running = False
+            self.condition.notify_all()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            with self.condition:
+                if not self._running:
+                    return
+                now = time.monotonic()
+                ready = []
+                for queue in self.queues:
+                    command = queue.pop_ready(now)
+                    if command:
+                        ready.append((queue, command))
+                if not ready:
+                    next_times = [
+                        t
+                        for t in (queue.next_ready(now) for queue in self.queues)
+                        if t is not None
+                    ]
+                    self.condition.wait(
+                        timeout=min(next_times) - now if next_times else None
+                    )
+                    continue
+            # Send outside the lock, so commands can be queued in the meantime
+            for queue, (kind, value) in ready:
+                try:
+                    queue.send(kind, value)
+                except Exception:
+                    logger.exception("Failed to send %s command %r", kind, value)
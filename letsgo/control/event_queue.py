@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+from typing import List, NamedTuple, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from letsgo.sensor import Sensor
+
+__all__ = ["SensorEvent", "SensorEventQueue"]
+
+
+class SensorEvent(NamedTuple):
+    sensor: Sensor
+    activated: bool
+    when: float
+    """When the device was read, rather than when the event was handled"""
+
+
+class SensorEventQueue:
+    """A lock-free queue of sensor events, from one controller thread to the layout.
+
+    There must only be one producer (calling `put`) and one consumer (calling `drain`).
+    The producer only ever writes the tail index and the consumer the head index, and
+    each is only advanced after the slots it covers have been written, so neither side
+    has to wait for the other. If the queue fills up, new events are dropped and
+    counted.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        if capacity <= 0 or capacity & (capacity - 1):
+            raise ValueError("capacity must be a power of two")
+        self._buffer: List[Optional[SensorEvent]] = [None] * capacity
+        self._mask = capacity - 1
+        self._head = 0
+        """The index of the next event to read. Only written by the consumer."""
+        self._tail = 0
+        """The index of the next event to write. Only written by the producer."""
+        self.dropped = 0
+
+    def put(self, sensor: Sensor, activated: bool, when: float) -> bool:
+        tail = self._tail
+        if tail - self._head > self._mask:
+            self.dropped += 1
+            return False
+        self._buffer[tail & self._mask] = SensorEvent(sensor, activated, when)
+        self._tail = tail + 1
+        return True
+
+    def drain(self, maximum: Optional[int] = None) -> List[SensorEvent]:
+        """Removes and returns the events queued so far, oldest first"""
+        head, tail = self._head, self._tail
+        if maximum is not None:
+            tail = min(tail, head + maximum)
+        events = []
+        for i in range(head, tail):
+            events.append(self._buffer[i & self._mask])
+            self._buffer[i & self._mask] = None
+        self._head = tail
+        return events  # type: ignore
+
+    def __len__(self):
+        return self._tail - self._head
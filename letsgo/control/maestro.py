@@ -1,14 +1,15 @@
 from __future__ import annotations
 
-import threading
+import asyncio
 import time
 from typing import Dict, List, Optional, TYPE_CHECKING, Tuple
 
-import usb
+import numpy as np
 
 from maestro import Maestro
 from maestro.enums import ChannelMode
 from .base import BinaryControl, Controllable, SensorController
+from .polling import AdaptiveInterval, EdgeDetector
 
 if TYPE_CHECKING:
     from ..sensor import Sensor
@@ -22,7 +23,7 @@ class MaestroChannelDefinition:
         *,
         binary_control: BinaryControl = None,
         sensor: Sensor = None,
-        normally_high: bool = True
+        normally_high: bool = True,
     ):
         # One or the other
         assert (binary_control and not sensor) or (sensor and not binary_control)
@@ -51,12 +52,15 @@ class MaestroChannelDefinition:
 class MaestroController(SensorController):
     label = "Maestro servo controller"
 
+    debounce = 0.01
+    """How long, in seconds, to leave an input to settle after it changes"""
+
     def __init__(
         self,
         *,
         channels: Dict[int, MaestroChannelDefinition] = None,
         serial_number: str = None,
-        **kwargs
+        **kwargs,
     ):
         super().__init__(**kwargs)
         self.maestro: Optional[Maestro] = None
@@ -65,8 +69,10 @@ class MaestroController(SensorController):
         self.pending_channel_definitions: List[
             Tuple[int, Optional[MaestroChannelDefinition]]
         ] = list(self.channels.items())
-        self._running = threading.Event()
-        self._thread = threading.Thread(target=self._process)
+        self._poll_interval = AdaptiveInterval()
+        self._inputs: Optional[List[Tuple[int, MaestroChannelDefinition]]] = None
+        self._edge_detector: Optional[EdgeDetector] = None
+        self._normally_high: Optional[np.ndarray] = None
 
     @property
     def channel_count(self) -> Optional[int]:
@@ -77,6 +83,7 @@ class MaestroController(SensorController):
             raise ValueError("Cannot assign channels when not connected")
         if not (0 <= index < self.channel_count):
             raise ValueError("Channel index out of range")
+        self._inputs = None
         if channel:
             self.channels[index] = channel
             self.pending_channel_definitions.append((index, channel))
@@ -86,47 +93,68 @@ class MaestroController(SensorController):
             self.pending_channel_definitions.append((index, None))
             del self.channels[index]
 
-    def start(self):
-        self._running.set()
-        self._thread.start()
-
-    def stop(self):
-        self._running.clear()
-        self._thread.join()
-
-    def _process(self):
-        while self._running.is_set():
-            try:
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            if not self.maestro:
+                # USB calls block, so are made on the event loop's executor
+                self.maestro = await loop.run_in_executor(None, self._find_maestro)
                 if not self.maestro:
-                    if self.serial_number:
-                        self.maestro = Maestro.get_by_serial_number(self.serial_number)
-                    else:
-                        self.maestro = Maestro.get_one()
-                    if not self.maestro:
-                        time.sleep(1)
-                        continue
-                    self.serial_number = self.maestro.serial_number
-                    self.device_present = True
-
-                    for index, channel_definition in self.channels.items():
-                        self.maestro[index].mode = channel_definition.mode
-
-                self.maestro.refresh_values()
-                for i, channel_definition in self.channels.items():
-                    channel = self.maestro[i]
-                    if channel.mode != ChannelMode.Input:
-                        continue
-                    is_high = channel.value > 0.5
-                    channel_definition.subject.activated = (
-                        channel_definition.normally_high != is_high
-                    )
-                time.sleep(0.02)
-            except usb.core.USBError as e:
-                if e.errno == 19:  # No such device (it may have been disconnected)
-                    self.maestro = None
-                    self.device_present = False
-                else:
-                    raise
+                    await asyncio.sleep(1)
+                    continue
+                self.serial_number = self.maestro.serial_number
+                self.device_present = True
+
+                for index, channel_definition in self.channels.items():
+                    self.maestro[index].mode = channel_definition.mode
+
+            started = loop.time()
+            await loop.run_in_executor(None, self.maestro.refresh_values)
+            when = time.time()
+            if self._inputs is None:
+                self._update_inputs()
+            activated = self._normally_high != np.fromiter(
+                (self.maestro[i].value > 0.5 for i, _ in self._inputs),
+                dtype=bool,
+                count=len(self._inputs),
+            )
+            edges = self._edge_detector.update(activated, when)
+            for j, is_activated in edges:
+                self.report_sensor_activity(
+                    self._inputs[j][1].sensor, is_activated, when
+                )
+            expected_in = self.magnet_expected_in(
+                (definition.sensor for _, definition in self._inputs), time.time()
+            )
+            interval = self._poll_interval.update(bool(edges), expected_in)
+            await asyncio.sleep(max(0.0, interval - (loop.time() - started)))
+
+    async def stop(self):
+        # Start again from scratch, e.g. if the device was unplugged
+        self.maestro = None
+        self._inputs = None
+        self.device_present = False
+
+    def _find_maestro(self) -> Optional[Maestro]:
+        if self.serial_number:
+            return Maestro.get_by_serial_number(self.serial_number)
+        else:
+            return Maestro.get_one()
+
+    def _update_inputs(self):
+        self._inputs = [
+            (i, channel_definition)
+            for i, channel_definition in sorted(self.channels.items())
+            if self.maestro[i].mode == ChannelMode.Input
+        ]
+        self._normally_high = np.array(
+            [definition.normally_high for _, definition in self._inputs], dtype=bool
+        )
+        self._edge_detector = EdgeDetector(len(self._inputs), debounce=self.debounce)
+        # Carry on from whatever has already been reported
+        self._edge_detector.states[:] = [
+            definition.sensor.activated for _, definition in self._inputs
+        ]
 
     def to_yaml(self) -> dict:
         return {
@@ -0,0 +1,68 @@
+"""
+Helpers for controllers that poll devices for their inputs
+"""
+
+from __future__ import annotations
+
+import math
+from typing import List, Tuple
+
+import numpy as np
+
+__all__ = ["EdgeDetector", "AdaptiveInterval"]
+
+
+class EdgeDetector:
+    """Turns a polled vector of binary inputs into debounced edges.
+
+    The whole vector is compared with the last reported states at once, so polls where
+    nothing changed cost a single comparison. A change is reported straight away (so
+    its timestamp is as accurate as possible), after which the channel is left alone
+    for `debounce` seconds to let it settle. If it has settled to a different state by
+    then, that is reported on the next poll.
+    """
+
+    def __init__(self, channel_count: int, debounce: float = 0.01):
+        self.debounce = debounce
+        self.states = np.zeros(channel_count, dtype=bool)
+        """The last reported state of each channel"""
+        self._last_reported = np.full(channel_count, -math.inf)
+
+    def update(self, states: np.ndarray, when: float) -> List[Tuple[int, bool]]:
+        """Returns (channel, state) for each channel that has changed"""
+        changed = np.flatnonzero(states != self.states)
+        if not len(changed):
+            return []
+        changed = changed[when - self._last_reported[changed] >= self.debounce]
+        self.states[changed] = states[changed]
+        self._last_reported[changed] = when
+        return [(int(i), bool(states[i])) for i in changed]
+
+
+class AdaptiveInterval:
+    """A polling interval that speeds up when there's activity, and backs off when idle
+
+    The interval never backs off beyond `maximum`, which should be shorter than the
+    shortest pulse to be caught, as activity can come when it isn't expected, e.g. from
+    a train whose position isn't known. If it's known when activity is next expected,
+    e.g. when a magnet is due at a sensor, the interval is at its shortest from `lead`
+    seconds beforehand, so that its first edge is timed as accurately as possible.
+    """
+
+    def __init__(
+        self,
+        minimum: float = 0.005,
+        maximum: float = 0.02,
+        backoff: float = 1.5,
+        lead: float = 0.05,
+    ):
+        self.minimum, self.maximum, self.backoff = minimum, maximum, backoff
+        self.lead = lead
+        self.current = minimum
+
+    def update(self, active: bool, expected_in: float = math.inf) -> float:
+        if active or expected_in <= self.lead:
+            self.current = self.minimum
+        else:
+            self.current = min(self.maximum, self.current * self.backoff)
+        return min(self.current, max(self.minimum, expected_in - self.lead))
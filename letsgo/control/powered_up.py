@@ -1,7 +1,7 @@
+import asyncio
 import logging
-import threading
 import typing
-from typing import Dict
+from typing import Any, Dict, Optional
 
 import blinker
 
@@ -11,6 +11,7 @@ from lego_wireless.enums import ColorNo
 from lego_wireless.hub import Hub
 from letsgo.train import Train
 from .base import TrainController
+from .command_queue import CommandDispatcher, CommandQueue
 
 logger = logging.getLogger(__name__)
 
@@ -35,6 +36,9 @@ class HubConfig:
         self.updated = blinker.Signal()
         self.hub = hub
 
+        self.commands: Optional[CommandQueue] = None
+        """Motor and light commands waiting to be sent to the hub"""
+
     @property
     def hub(self):
         return self._hub
@@ -117,6 +121,12 @@ class HubConfig:
             print("Resetting color")
             hub.rgb_light.set_rgb_color_no(self.color)
         self._connected = True
+        if self.train and self.commands is not None:
+            # Commands sent while disconnected were lost, but have been recorded as
+            # sent, so bring the hub up to date regardless
+            self.commands.put("motor", self.train.motor_speed, urgent=True)
+            if self.train.lights_on:
+                self.commands.put("lights", True, urgent=True)
         self.updated.send(self)
 
     def on_hub_disconnected(self, hub):
@@ -128,16 +138,30 @@ class HubConfig:
         self._battery_level = battery_level
         self.updated.send(self)
 
+    def send_command(self, kind: str, value: Any):
+        hub = self._hub
+        if not (hub and hub.connected):
+            return
+        if kind == "motor" and hub.train_motor:
+            hub.train_motor.set_speed(int(value * 100))
+        elif kind == "lights" and hub.led_light:
+            hub.led_light.set_brightness(100 if value else 0)
+
 
 class PoweredUpController(TrainController):
     label = "Powered UP"
 
+    max_command_rate = 10.0
+    """The most commands a second to send to each hub"""
+
+    min_motor_speed_change = 0.02
+    """Smaller changes in motor speed than this aren't sent"""
+
     def __init__(
         self, adapter_name="hci0", hubs: Dict[str, HubConfig] = None, **kwargs
     ):
         super().__init__(**kwargs)
         self.hub_manager = lego_wireless.HubManager(adapter_name)
-        self.hub_manager_thread = threading.Thread(target=self.hub_manager.run)
 
         self.hub_discovered = blinker.Signal()
         self.hub_connected = blinker.Signal()
@@ -147,7 +171,11 @@ class PoweredUpController(TrainController):
         # lego_wireless.signals.hub_connected.connect(self.on_hub_connected)
         # lego_wireless.signals.hub_disconnected.connect(self.on_hub_disconnected)
 
-        self.hubs: Dict[str, HubConfig] = hubs or {}
+        self.command_dispatcher = CommandDispatcher(name="powered-up-commands")
+
+        self.hubs: Dict[str, HubConfig] = {}
+        for mac_address, hub_config in (hubs or {}).items():
+            self._add_hub_config(mac_address, hub_config)
         self.pairings: Dict[Hub, Train] = {}
 
         self.discovered_mac_addresses: typing.Set[str] = set()
@@ -156,36 +184,61 @@ class PoweredUpController(TrainController):
         # self.train_hubs = {}
         # self.pair_with = []
 
-    def start(self):
-        try:
-            if self.hub_manager.is_adapter_powered:
-                logger.info("Starting Powered UP controller")
-                self.hub_manager.start_discovery()
-                self.hub_manager_thread.start()
-                self.device_present = True
-                for device in self.hub_manager.devices():
-                    pass
-            else:
-                logger.warning(
-                    "Attempted to start Powered UP controller, but Bluetooth adapter not powered"
-                )
-                # self.hub_manager.device_discovered(device)
-        except:
-            pass
-
-    def stop(self):
+    def _add_hub_config(self, mac_address: str, hub_config: HubConfig):
+        hub_config.commands = self.command_dispatcher.add_queue(
+            hub_config.send_command,
+            max_rate=self.max_command_rate,
+            min_change=self.min_motor_speed_change,
+        )
+        self.hubs[mac_address] = hub_config
+
+    async def start(self):
+        self.command_dispatcher.start()
+
+    async def run(self):
+        if not self.hub_manager.is_adapter_powered:
+            raise RuntimeError("Bluetooth adapter not powered")
+        logger.info("Starting Powered UP controller")
+        self.hub_manager.start_discovery()
+        self.device_present = True
+        # The hub manager runs its own (blocking) main loop for D-Bus, until stopped
+        await asyncio.get_event_loop().run_in_executor(None, self.hub_manager.run)
+
+    async def stop(self):
         logger.info("Stopping Powered Up controller")
         self.hub_manager.stop()
+        self.command_dispatcher.stop()
+        self.device_present = False
 
     def register_train(self, train, mac_address):
-        self.trains[mac_address.lower()] = train
+        mac_address = mac_address.lower()
+        if mac_address not in self.hubs:
+            self._add_hub_config(mac_address, HubConfig())
+        self.hubs[mac_address].train = train
         train.connected = False
 
+    def _hub_config_for_train(self, train: Train) -> Optional[HubConfig]:
+        for hub_config in self.hubs.values():
+            if hub_config.train == train:
+                return hub_config
+        return None
+
+    def set_train_motor_speed(self, train: Train, value: float):
+        hub_config = self._hub_config_for_train(train)
+        if hub_config and hub_config.commands is not None:
+            # Stopping jumps the queue
+            hub_config.commands.put("motor", value, urgent=value == 0)
+
+    def set_train_lights(self, train: Train, value: bool):
+        hub_config = self._hub_config_for_train(train)
+        if hub_config and hub_config.commands is not None:
+            hub_config.commands.put("lights", value)
+
     def on_hub_discovered(self, sender, hub):
         logger.info("Powered UP hub discovered: %r", hub)
         mac_address = hub.mac_address.lower()
         if mac_address not in self.hubs:
-            self.hubs[mac_address] = HubConfig(hub=hub)
+            self._add_hub_config(mac_address, HubConfig(hub=hub))
         else:
             self.hubs[mac_address].hub = hub
         if mac_address not in self.discovered_mac_addresses:
@@ -206,18 +259,6 @@ class PoweredUpController(TrainController):
     # def on_hub_battery_level(self, sender, battery_level):
     #     pass  # self.trains[sender.mac_address.lower()].battery_level = battery_level
 
-    # def set_train_lights(self, train: Train, value: bool):
-    #     hub = self.train_hubs.get(train)
-    #     if hub and hub.led_light:
-    #         hub.led_light.set_brightness(100 if value else 0)
-    #         return True
-
-    # def set_train_motor_speed(self, train: Train, value: float):
-    #     hub = self.train_hubs.get(train)
-    #     if hub and hub.train_motor:
-    #         hub.train_motor.set_speed(int(value * 100))
-    #         return True
-
     def to_yaml(self) -> dict:
         return {
             **super().to_yaml(),
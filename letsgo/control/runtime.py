@@ -0,0 +1,150 @@
+"""
+Runs controllers as tasks on a single, shared asyncio event loop
+
+Each controller is supervised: if it fails (e.g. because its USB device has gone away),
+it is stopped and restarted after a delay that backs off exponentially while it keeps
+failing. Shutting down cancels every controller and waits at most `shutdown_deadline`
+seconds for them to finish.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import logging
+import threading
+from typing import Any, Coroutine, Dict, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .base import Controller
+
+__all__ = ["ControllerRuntime"]
+
+logger = logging.getLogger(__name__)
+
+
+class ControllerRuntime:
+    initial_backoff = 0.5
+    """How long, in seconds, to wait before restarting a controller the first time"""
+
+    maximum_backoff = 30.0
+    """The longest to wait before restarting a controller that keeps failing"""
+
+    backoff_reset = 60.0
+    """How long a controller has to run before its backoff is reset"""
+
+    shutdown_deadline = 5.0
+    """How long, in seconds, to wait for controllers to stop"""
+
+    def __init__(self, name: str = "controllers"):
+        self.name = name
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._tasks: Dict[Any, asyncio.Task] = {}
+
+    @property
+    def running(self) -> bool:
+        return self.loop is not None
+
+    def start(self):
+        """Starts the event loop on its own thread"""
+        if self.loop:
+            raise AssertionError("Controller runtime already started")
+        self.loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self.loop.call_soon(ready.set)
+            self.loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name=self.name, daemon=True)
+        self._thread.start()
+        ready.wait()
+
+    def stop(self, deadline: Optional[float] = None):
+        """Stops all controllers and tasks, and then the event loop"""
+        if not self.loop:
+            return
+        loop, thread = self.loop, self._thread
+        self.call(self._shutdown(deadline))
+        loop.call_soon_threadsafe(loop.stop)
+        if thread:
+            thread.join()
+        loop.close()
+        self.loop, self._thread = None, None
+
+    def call(self, coro: Coroutine, timeout: Optional[float] = None):
+        """Runs a coroutine on the event loop from another thread, and returns its result"""
+        if not self.loop:
+            raise AssertionError("Controller runtime not started")
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def add_controller(self, controller: Controller):
+        self.spawn(controller, self._supervise(controller))
+
+    def remove_controller(
+        self, controller: Controller, deadline: Optional[float] = None
+    ):
+        self.call(self._cancel([controller], deadline))
+
+    def spawn(self, key, coro: Coroutine):
+        """Runs a coroutine as a task until it finishes, or it's cancelled on shutdown"""
+
+        async def create_task():
+            self._tasks[key] = asyncio.ensure_future(coro)
+            self._tasks[key].add_done_callback(
+                lambda task: self._tasks.pop(key, None)
+                if self._tasks.get(key) is task
+                else None
+            )
+
+        self.call(create_task())
+
+    async def _supervise(self, controller: Controller):
+        loop = asyncio.get_event_loop()
+        backoff = self.initial_backoff
+        while True:
+            started = loop.time()
+            try:
+                await controller.start()
+                await controller.run()
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                if loop.time() - started > self.backoff_reset:
+                    backoff = self.initial_backoff
+                logger.exception(
+                    "Controller %s failed; restarting in %.1fs", controller.id, backoff
+                )
+                controller.device_present = False
+            finally:
+                try:
+                    await controller.stop()
+                except Exception:
+                    logger.exception("Failed to stop controller %s", controller.id)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.maximum_backoff)
+
+    async def _cancel(self, keys, deadline: Optional[float]):
+        tasks = {self._tasks.pop(key): key for key in keys if key in self._tasks}
+        if not tasks:
+            return
+        for task in tasks:
+            task.cancel()
+        deadline = self.shutdown_deadline if deadline is None else deadline
+        _, pending = await asyncio.wait(tasks, timeout=deadline)
+        for task in pending:
+            key = tasks[task]
+            logger.warning(
+                "%s didn't stop within %.1fs", getattr(key, "id", key), deadline
+            )
+
+    async def _shutdown(self, deadline: Optional[float]):
+        await self._cancel(list(self._tasks), deadline)
@@ -0,0 +1,479 @@
+"""
+Stand-ins for hardware controllers, for load testing without any devices
+
+A TrackSimulator keeps its own idea of where each train really is, and moves them at
+the speed their motors would actually drive them, which won't quite match the layout's
+estimates. The simulated Maestro reads its inputs from which sensors have a magnet over
+them, and the simulated Powered UP hubs apply motor commands to the simulated trains
+after some latency, and drop out every so often.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+import weakref
+from typing import Callable, Dict, List, Optional, Tuple, TYPE_CHECKING
+
+import numpy as np
+
+from letsgo.magnet_index import MagnetIndex
+from letsgo.track_point import EndOfTheLine, TrackPoint
+from .base import SensorController, TrainController
+from .command_queue import CommandDispatcher, CommandQueue
+from .maestro import MaestroChannelDefinition
+from .polling import AdaptiveInterval, EdgeDetector
+
+if TYPE_CHECKING:
+    from letsgo.layout import Layout
+    from letsgo.sensor import Sensor
+    from letsgo.train import Train
+
+__all__ = [
+    "TrackSimulator",
+    "SimulatedMaestroController",
+    "SimulatedPoweredUpController",
+]
+
+logger = logging.getLogger(__name__)
+
+
+class SimulatedTrain:
+    """Where a train really is, and how fast it's really going
+
+    This stands in for the train in the simulator's own MagnetIndex.
+    """
+
+    def __init__(self, train: Train, top_speed: float):
+        self.train = train
+        self.position: Optional[TrackPoint] = (
+            train.position.copy(train=None) if train.position else None
+        )
+        self.top_speed = top_speed
+        """The speed at full power, in studs per second"""
+        self.motor_speed = 0.0
+
+    @property
+    def speed(self) -> float:
+        return self.motor_speed * self.top_speed
+
+    def magnet_offsets(self):
+        return self.train.magnet_offsets()
+
+
+class TrackSimulator:
+    """The true state of a layout's trains and sensors, shared by simulated controllers"""
+
+    step_interval = 0.005
+    """How often, in seconds, to move trains along when running on its own thread"""
+
+    sensor_range = 2.0
+    """How close a magnet has to be to a sensor, in studs, to activate it"""
+
+    speed_noise = 0.02
+    """The standard deviation of trains' speeds, relative to their nominal speed"""
+
+    _simulators: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def for_layout(cls, layout: Layout) -> TrackSimulator:
+        """Returns the simulator shared by all the simulated controllers of a layout"""
+        if layout not in cls._simulators:
+            cls._simulators[layout] = cls(layout)
+        return cls._simulators[layout]
+
+    def __init__(
+        self,
+        layout: Layout,
+        seed: Optional[int] = None,
+        realtime: bool = True,
+        tick_layout: bool = False,
+    ):
+        self.layout = layout
+        self.random = random.Random(seed)
+        self.realtime = realtime
+        """Whether to step on a thread in real time, or leave it to calls to `step`"""
+        self.tick_layout = tick_layout
+        """Whether to also tick the layout, for running without a UI"""
+        self.time = time.time() if realtime else 0.0
+        """The simulator's clock, in seconds, which sensor events are timestamped with
+
+        In real time this starts from the wall clock, like the UI's ticks, and
+        otherwise from zero, like the ticks the simulator sends to the layout itself.
+        """
+        self.trains: Dict[Train, SimulatedTrain] = {}
+        self.sensor_states: Dict[Sensor, bool] = {}
+        """Which sensors have a magnet over them. Replaced, not updated, each step."""
+        self._scheduled: List[Tuple[float, int, Callable[[], None]]] = []
+        self._counter = itertools.count()
+        self._lock = threading.RLock()
+        self._magnet_index: Optional[MagnetIndex] = None
+        self._users = 0
+        self._running = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add_train(self, train: Train, top_speed: float = 55.0) -> SimulatedTrain:
+        with self._lock:
+            if train not in self.trains:
+                # No two trains are quite the same
+                top_speed *= self.random.uniform(0.9, 1.1)
+                self.trains[train] = SimulatedTrain(train, top_speed)
+                if self._magnet_index:
+                    self._magnet_index.place_train(self.trains[train])  # type: ignore
+            return self.trains[train]
+
+    def remove_train(self, train: Train):
+        with self._lock:
+            simulated_train = self.trains.pop(train, None)
+            if simulated_train and self._magnet_index:
+                self._magnet_index.remove_train(simulated_train)  # type: ignore
+
+    def set_motor_speed(self, train: Train, motor_speed: float):
+        with self._lock:
+            if train in self.trains:
+                self.trains[train].motor_speed = motor_speed
+
+    def schedule(self, delay: float, callback: Callable[[], None]):
+        """Calls callback on the simulator's thread, after delay simulated seconds"""
+        with self._lock:
+            heapq.heappush(
+                self._scheduled, (self.time + delay, next(self._counter), callback)
+            )
+
+    def step(self, time_elapsed: float):
+        with self._lock:
+            self.time += time_elapsed
+            while self._scheduled and self._scheduled[0][0] <= self.time:
+                _, _, callback = heapq.heappop(self._scheduled)
+                try:
+                    callback()
+                except Exception:
+                    logger.exception("Scheduled simulator callback failed")
+
+            track_graph = self.layout.track_graph
+            if (
+                self._magnet_index is None
+                or self._magnet_index.graph is not track_graph
+            ):
+                self._magnet_index = MagnetIndex(track_graph)
+                for simulated_train in self.trains.values():
+                    self._magnet_index.place_train(simulated_train)  # type: ignore
+
+            for simulated_train in self.trains.values():
+                if not simulated_train.speed or not simulated_train.position:
+                    continue
+                distance = (
+                    simulated_train.speed
+                    * time_elapsed
+                    * max(0.0, self.random.gauss(1, self.speed_noise))
+                )
+                try:
+                    simulated_train.position += distance
+                except EndOfTheLine:
+                    logger.warning(
+                        "Simulated train %s ran off the end of the line",
+                        simulated_train.train.id,
+                    )
+                    simulated_train.motor_speed = 0
+                    continue
+                self._magnet_index.move_train(simulated_train, distance)  # type: ignore
+
+            self.sensor_states = {
+                sensor: bool(self._magnet_index.candidates(sensor, self.sensor_range))
+                for sensor in list(self.layout.sensors.values())
+            }
+
+        if self.tick_layout:
+            self.layout.tick(self, time=self.time, time_elapsed=time_elapsed)
+
+    def acquire(self):
+        """Starts stepping on a thread, if this is the first controller to need it"""
+        with self._lock:
+            self._users += 1
+            if self._users > 1 or not self.realtime:
+                return
+            self._running.set()
+            self._thread = threading.Thread(
+                target=self._run, name="track-simulator", daemon=True
+            )
+            self._thread.start()
+
+    def release(self):
+        with self._lock:
+            self._users -= 1
+            if self._users > 0:
+                return
+            self._running.clear()
+            thread, self._thread = self._thread, None
+        if thread:
+            thread.join()
+
+    def _run(self):
+        last = time.monotonic()
+        while self._running.is_set():
+            time.sleep(self.step_interval)
+            now = time.monotonic()
+            self.step(now - last)
+            last = now
+
+
+class SimulatedMaestroController(SensorController):
+    label = "Simulated Maestro"
+
+    debounce = 0.01
+    """How long, in seconds, to leave an input to settle after it changes"""
+
+    def __init__(
+        self,
+        *,
+        channel_count: int = 24,
+        channels: Optional[Dict[int, MaestroChannelDefinition]] = None,
+        simulator: Optional[TrackSimulator] = None,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.channel_count = channel_count
+        self.channels = channels or {}
+        self.simulator = simulator or TrackSimulator.for_layout(self.layout)
+        self._poll_interval = AdaptiveInterval()
+        self._inputs: Optional[Tuple[List[Sensor], EdgeDetector]] = None
+
+    def set_channel(self, index: int, channel: Optional[MaestroChannelDefinition]):
+        if not (0 <= index < self.channel_count):
+            raise ValueError("Channel index out of range")
+        self._inputs = None
+        if channel:
+            self.channels[index] = channel
+            channel.subject.set_controller(self, index=index)
+        elif index in self.channels:
+            self.channels[index].subject.set_controller(None)
+            del self.channels[index]
+
+    def register_sensor(
+        self, sensor, *, index: int, normally_high: bool = True, **params
+    ):
+        self.set_channel(
+            index, MaestroChannelDefinition(sensor=sensor, normally_high=normally_high)
+        )
+
+    async def start(self):
+        self.simulator.acquire()
+        self.device_present = True
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            started = loop.time()
+            when = self.simulator.time
+            edges = self.poll(when)
+            sensors, _ = self._inputs  # type: ignore
+            interval = self._poll_interval.update(
+                bool(edges), self.magnet_expected_in(sensors, when)
+            )
+            await asyncio.sleep(max(0.0, interval - (loop.time() - started)))
+
+    async def stop(self):
+        self.simulator.release()
+        self.device_present = False
+
+    def poll(self, when: Optional[float] = None) -> List[Tuple[int, bool]]:
+        """Reads the simulated inputs once, reporting and returning any edges
+
+        Edges are timestamped with the simulator's clock unless told otherwise.
+        """
+        if when is None:
+            when = self.simulator.time
+        if self._inputs is None:
+            self._inputs = self._get_inputs()
+        sensors, edge_detector = self._inputs
+        sensor_states = self.simulator.sensor_states
+        activated = np.array(
+            [sensor_states.get(sensor, False) for sensor in sensors], dtype=bool
+        )
+        edges = edge_detector.update(activated, when)
+        for j, is_activated in edges:
+            self.report_sensor_activity(sensors[j], is_activated, when)
+        return edges
+
+    def _get_inputs(self) -> Tuple[List[Sensor], EdgeDetector]:
+        sensors = [
+            channel_definition.sensor
+            for _, channel_definition in sorted(self.channels.items())
+            if channel_definition.sensor
+        ]
+        edge_detector = EdgeDetector(len(sensors), debounce=self.debounce)
+        # Carry on from whatever has already been reported
+        edge_detector.states[:] = [sensor.activated for sensor in sensors]
+        return sensors, edge_detector
+
+    def to_yaml(self) -> dict:
+        return {
+            **super().to_yaml(),
+            "channel_count": self.channel_count,
+            "channels": {i: self.channels[i].to_yaml() for i in sorted(self.channels)},
+        }
+
+
+class SimulatedHub:
+    def __init__(self, mac_address: str):
+        self.mac_address = mac_address
+        self.connected = False
+        self.train: Optional[Train] = None
+        self.commands: Optional[CommandQueue] = None
+
+
+class SimulatedPoweredUpController(TrainController):
+    label = "Simulated Powered UP"
+
+    max_command_rate = 10.0
+    """The most commands a second to send to each hub"""
+
+    min_motor_speed_change = 0.02
+    """Smaller changes in motor speed than this aren't sent"""
+
+    def __init__(
+        self,
+        *,
+        hub_count: int = 0,
+        latency: float = 0.03,
+        jitter: float = 0.02,
+        disconnect_rate: float = 0.0,
+        reconnect_delay: float = 2.0,
+        top_speed: float = 55.0,
+        simulator: Optional[TrackSimulator] = None,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.hub_count = hub_count
+        self.latency = latency
+        """How long, in seconds, before a command reaches a hub"""
+        self.jitter = jitter
+        """The most extra time, in seconds, a command can take to reach a hub"""
+        self.disconnect_rate = disconnect_rate
+        """How often each hub disconnects, on average, per second"""
+        self.reconnect_delay = reconnect_delay
+        """How long, on average, a hub takes to reconnect"""
+        self.top_speed = top_speed
+        self.simulator = simulator or TrackSimulator.for_layout(self.layout)
+        self.command_dispatcher = CommandDispatcher(name="simulated-hub-commands")
+        self.hubs: Dict[str, SimulatedHub] = {}
+        for i in range(hub_count):
+            self._add_hub(f"00:00:00:00:{i // 256:02x}:{i % 256:02x}")
+        self._running = False
+
+    def _add_hub(self, mac_address: str) -> SimulatedHub:
+        hub = SimulatedHub(mac_address)
+        hub.commands = self.command_dispatcher.add_queue(
+            lambda kind, value: self._send_command(hub, kind, value),
+            max_rate=self.max_command_rate,
+            min_change=self.min_motor_speed_change,
+        )
+        self.hubs[mac_address] = hub
+        return hub
+
+    async def start(self):
+        self._running = True
+        self.simulator.acquire()
+        self.command_dispatcher.start()
+        self.device_present = True
+        for hub in self.hubs.values():
+            if hub.train:
+                self._schedule_connect(hub)
+
+    async def stop(self):
+        self._running = False
+        self.command_dispatcher.stop()
+        for hub in self.hubs.values():
+            self._disconnect(hub, reconnect=False)
+        self.simulator.release()
+        self.device_present = False
+
+    def register_train(self, train, mac_address):
+        mac_address = mac_address.lower()
+        hub = self.hubs.get(mac_address) or self._add_hub(mac_address)
+        hub.train = train
+        train.connected = False
+        self.simulator.add_train(train, self.top_speed)
+        if self._running:
+            self._schedule_connect(hub)
+
+    def _hub_for_train(self, train: Train) -> Optional[SimulatedHub]:
+        for hub in self.hubs.values():
+            if hub.train == train:
+                return hub
+        return None
+
+    def set_train_motor_speed(self, train: Train, value: float):
+        hub = self._hub_for_train(train)
+        if hub and hub.commands is not None:
+            hub.commands.put("motor", value, urgent=value == 0)
+
+    def set_train_lights(self, train: Train, value: bool):
+        hub = self._hub_for_train(train)
+        if hub and hub.commands is not None:
+            hub.commands.put("lights", value)
+
+    def _delay(self) -> float:
+        return self.latency + self.simulator.random.uniform(0, self.jitter)
+
+    def _send_command(self, hub: SimulatedHub, kind: str, value):
+        # Commands sent while disconnected are lost, as with a real hub
+        if not hub.connected:
+            return
+
+        def receive():
+            if hub.connected and hub.train and kind == "motor":
+                self.simulator.set_motor_speed(hub.train, value)
+
+        self.simulator.schedule(self._delay(), receive)
+
+    def _schedule_connect(self, hub: SimulatedHub):
+        self.simulator.schedule(self._delay(), lambda: self._connect(hub))
+
+    def _connect(self, hub: SimulatedHub):
+        if hub.connected or not self._running:
+            return
+        hub.connected = True
+        if hub.train:
+            hub.train.connected = True
+            if hub.commands is not None:
+                # Bring the hub up to date with anything it missed
+                hub.commands.put("motor", hub.train.motor_speed, urgent=True)
+                if hub.train.lights_on:
+                    hub.commands.put("lights", True, urgent=True)
+        if self.disconnect_rate > 0:
+            self.simulator.schedule(
+                self.simulator.random.expovariate(self.disconnect_rate),
+                lambda: self._disconnect(hub),
+            )
+
+    def _disconnect(self, hub: SimulatedHub, reconnect: bool = True):
+        if not hub.connected:
+            return
+        logger.info("Simulated hub %s disconnected", hub.mac_address)
+        hub.connected = False
+        if hub.train:
+            # Hubs stop their motors when they lose their connection
+            self.simulator.set_motor_speed(hub.train, 0)
+            hub.train.connected = False
+        if reconnect and self._running:
+            self.simulator.schedule(
+                self.simulator.random.uniform(0.5, 1.5) * self.reconnect_delay,
+                lambda: self._connect(hub),
+            )
+
+    def to_yaml(self) -> dict:
+        return {
+            **super().to_yaml(),
+            "hub_count": self.hub_count,
+            "latency": self.latency,
+            "jitter": self.jitter,
+            "disconnect_rate": self.disconnect_rate,
+            "reconnect_delay": self.reconnect_delay,
+            "top_speed": self.top_speed,
+        }
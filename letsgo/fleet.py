@@ -0,0 +1,119 @@
+"""
+Predicts the speeds of every train on a layout at once
+
+The inputs to each train's speed model (motor speed, battery level and so on) and the
+model's coefficients are kept as rows of two arrays, so that every train's speed can be
+worked out with a handful of NumPy operations each tick. Rows are only refreshed, and
+speeds only recalculated, when a train's state or model changes, and speeds are cached
+until the next tick. Until then, a train whose state has changed falls back to
+predicting its own speed.
+"""
+
+from __future__ import annotations
+
+import math
+from typing import Dict, List, Optional, Set, TYPE_CHECKING
+
+import numpy as np
+
+from letsgo import signals
+from letsgo.speed_model import FEATURE_NAMES, POWERS, polynomial_feature_matrix
+
+if TYPE_CHECKING:
+    from letsgo.layout import Layout
+    from letsgo.train import Train
+
+__all__ = ["FleetPredictor"]
+
+
+class FleetPredictor:
+    def __init__(self, layout: Layout):
+        self.layout = layout
+        self.trains: List[Train] = []
+        """The trains, in the order of the rows of the arrays"""
+        self.inputs = np.zeros((0, len(FEATURE_NAMES)))
+        self.coefficients = np.zeros((0, len(POWERS)))
+        self.speeds = np.zeros(0)
+        """Each train's speed as of the last tick, in studs per second"""
+        self.acceleration = np.zeros(0)
+        """How quickly each train can speed up, in studs per second squared"""
+        self.deceleration = np.zeros(0)
+        """How quickly each train can slow down, in studs per second squared"""
+        self._index: Dict[Train, int] = {}
+        self._stale: Set[Train] = set()
+        self._rebuild = True
+
+        signals.train_added.connect(self.on_trains_changed, sender=layout)
+        signals.train_removed.connect(self.on_trains_changed, sender=layout)
+        signals.train_motor_speed_changed.connect(self.on_train_changed)
+        signals.battery_level_changed.connect(self.on_train_changed)
+        signals.train_lights_on_changed.connect(self.on_train_changed)
+        signals.train_speed_model_changed.connect(self.on_train_changed)
+
+    def on_trains_changed(self, sender, train: Train):
+        self._rebuild = True
+
+    def on_train_changed(self, sender: Train, **kwargs):
+        if sender in self._index:
+            self._stale.add(sender)
+
+    def _refresh(self, i: int, train: Train):
+        battery_level = train.battery_level
+        self.inputs[i] = (
+            train.motor_speed,
+            battery_level or 0,
+            battery_level is not None,
+            train.lights_on,
+        )
+        self.coefficients[i] = train.speed_estimation.get_model().coefficients
+        self.acceleration[i] = train.physics.max_acceleration
+        self.deceleration[i] = train.physics.max_deceleration
+
+    def update(self):
+        """Recalculates every train's speed; called once a tick"""
+        if self._rebuild:
+            self._rebuild = False
+            self.trains = list(self.layout.trains.values())
+            self._index = {train: i for i, train in enumerate(self.trains)}
+            self.inputs = np.zeros((len(self.trains), len(FEATURE_NAMES)))
+            self.coefficients = np.zeros((len(self.trains), len(POWERS)))
+            self.acceleration = np.zeros(len(self.trains))
+            self.deceleration = np.zeros(len(self.trains))
+            self._stale = set()
+            stale = self.trains
+        elif self._stale:
+            # Swap rather than clear, in case a train changes while we're refreshing
+            stale, self._stale = list(self._stale), set()
+        else:
+            # Nothing has changed, so neither have the speeds
+            return
+        for train in stale:
+            self._refresh(self._index[train], train)
+
+        features = polynomial_feature_matrix(self.inputs)
+        speeds = np.einsum("ij,ij->i", features, self.coefficients)
+        # As in PolynomialSpeedModel.predict, trains with stopped motors don't move,
+        # and no train goes backwards
+        speeds[self.inputs[:, 0] == 0] = 0
+        self.speeds = np.maximum(speeds, 0)
+
+    def speed(self, train: Train) -> float:
+        """Returns the train's speed, from the last tick if it hasn't changed since"""
+        i = self._index.get(train)
+        if i is None or train in self._stale or i >= len(self.speeds):
+            return train.speed_estimation.predict()
+        return float(self.speeds[i])
+
+    def time_to(self, distances: np.ndarray) -> np.ndarray:
+        """How long each train will take to travel the given distances, in seconds"""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(self.speeds > 0, distances / self.speeds, math.inf)
+
+    def braking_distances(self, velocity: Optional[np.ndarray] = None) -> np.ndarray:
+        """How far each train would take to stop, in studs
+
+        By default this is from the speeds they're heading for, but their current
+        velocities can be given instead.
+        """
+        velocity = self.speeds if velocity is None else velocity
+        return velocity**2 / (2 * self.deceleration)
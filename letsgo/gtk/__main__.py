@@ -5,6 +5,7 @@ import gi
 
 gi.require_version("Gtk", "3.0")
 
+from letsgo.calibration import CalibrationStore
 from letsgo.gtk.utils import get_builder
 from letsgo.gtk.window import LayoutWindow
 
@@ -47,6 +48,9 @@ class Application(Gtk.Application):
         self.builder = get_builder()
 
         self.window = LayoutWindow()
+        self.window.layout.calibration_store = CalibrationStore(
+            os.path.join(GLib.get_user_data_dir(), "letsgo-trains", "calibration")
+        )
 
         self.load_from_settings()
 
@@ -5,6 +5,7 @@ import cairo
 import math
 
 import gi
+import numpy as np
 import pkg_resources
 from cairo import Context
 from letsgo import pieces
@@ -468,7 +469,7 @@ class LayoutDrawer:
 
         self.draw_highlight_layer(self.layout, cr)
 
-        # self.draw_trains(self.layout, cr)
+        self.draw_trains(self.layout, cr)
 
     def draw_grid(self, cr: Context):
         cr.set_line_width(1 / self.drawing_options.scale)
@@ -613,46 +614,23 @@ class LayoutDrawer:
 
         cr.restore()
 
-    def transform_track_point(self, track_point):
-        px, py, angle = track_point.piece.point_position(
-            track_point.anchor_name, track_point.offset
-        )
-        return self.piece_matrices[track_point.piece].transform_point(px, py)
-
-    def point_back(self, track_point, distance):
-        error = distance
-        px, py = self.transform_track_point(track_point)
-        for i in range(2):
-            track_point = track_point - error
-            px2, py2 = self.transform_track_point(track_point)
-            new_distance = math.sqrt((px - px2) ** 2 + (py - py2) ** 2)
-            error = distance - new_distance
-        return track_point, (px2, py2)
-
     def draw_trains(self, layout: Layout, cr: Context):
         for train in layout.trains.values():
-            car_start = train.position
+            car_positions = train.car_positions
+            bogey_poses = car_positions.bogey_poses()
 
             annotation = train.meta.get("annotation")
 
             for i, car in enumerate(train.cars):
-                front_bogey_offset, rear_bogey_offset = car.bogey_offsets
-                bogey_spacing = rear_bogey_offset - front_bogey_offset
-                front_bogey_position = car_start - front_bogey_offset
-                front_bogey_xy = self.transform_track_point(front_bogey_position)
-                rear_bogey_position, rear_bogey_xy = self.point_back(
-                    front_bogey_position, bogey_spacing
-                )
+                bogeys = bogey_poses[car_positions.car_bogeys[i]]
+                if len(bogeys) < 2 or np.isnan(bogeys[:, :2]).any():
+                    continue
+                front_bogey_offset = car.bogey_offsets[0]
+                (front_x, front_y, _), (rear_x, rear_y, _) = bogeys[0], bogeys[-1]
 
                 cr.save()
-                cr.translate(front_bogey_xy[0], front_bogey_xy[1])
-                cr.rotate(
-                    math.pi
-                    + math.atan2(
-                        front_bogey_xy[1] - rear_bogey_xy[1],
-                        front_bogey_xy[0] - rear_bogey_xy[0],
-                    )
-                )
+                cr.translate(front_x, front_y)
+                cr.rotate(math.pi + math.atan2(front_y - rear_y, front_x - rear_x))
 
                 cr.set_source_rgb(*hex_to_rgb(train.meta.get("color", "#a0a0ff")))
 
@@ -686,4 +664,3 @@ class LayoutDrawer:
                         cr.fill()
 
                 cr.restore()
-                car_start = rear_bogey_position - (car.length - rear_bogey_offset + 1)
@@ -1,6 +1,5 @@
 import logging
 import os
-import time
 
 from gi.repository import Gio, Gtk, GLib, Gdk
 
@@ -22,6 +21,7 @@ from letsgo.gtk.trains import TrainListBox
 
 from letsgo import signals
 from letsgo.layout import Layout
+from letsgo.ticker import Ticker
 
 from letsgo.gtk.utils import get_builder
 from letsgo.pieces import FlippablePiece, Piece
@@ -54,7 +54,6 @@ class LayoutWindow(Gtk.ApplicationWindow):
         self.current_filename = None
         self.saved_epoch = self.layout.epoch
 
-        signals.tick.connect(self.layout.tick)
         # self.topham_hatt = TophamHatt(self.layout)
         # signals.tick.connect(self.topham_hatt.tick)
 
@@ -92,8 +91,9 @@ class LayoutWindow(Gtk.ApplicationWindow):
         self.layout_drawer = LayoutDrawer(self.layout_area, self.layout)
 
         self.layout.start()
-        # self.last_tick = time.time()
-        # GLib.timeout_add(30, self.send_tick)
+        # Handles controllers' sensor events and moves trains on the main thread
+        self.ticker = Ticker(self.layout)
+        GLib.timeout_add(30, self.ticker)
 
     def create_actions(self):
         self.actions = {
@@ -359,11 +359,3 @@ class LayoutWindow(Gtk.ApplicationWindow):
 
     def on_selection_delete(self, action, parameter):
         self.layout_drawer.delete_selection()
-
-    def send_tick(self):
-        this_tick = time.time()
-        signals.tick.send(
-            self.layout, time=this_tick, time_elapsed=this_tick - self.last_tick
-        )
-        self.last_tick = this_tick
-        return True
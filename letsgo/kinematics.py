@@ -0,0 +1,295 @@
+"""
+Moves every train on a layout at once
+
+Rather than each train walking its front and rear track points along piece by piece,
+the kinematics engine keeps where every train's front and rear are as a segment of the
+compiled track graph (see `letsgo.track_graph`) and an offset along it, in NumPy
+arrays, along with each train's velocity and acceleration. A tick then advances every
+train with a handful of array operations, and only trains that cross into another
+segment need any more work than that.
+
+Trains' track points are only worked out again when something asks for them. The engine
+is optional; a layout only uses one once it's been given one:
+
+    layout.kinematics = KinematicsEngine(layout)
+"""
+
+from __future__ import annotations
+
+import math
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
+
+import numpy as np
+
+from letsgo import signals
+from letsgo.physics import FixedSteps, TrainPhysics, integrate
+from letsgo.track_graph import TrackGraph
+from letsgo.track_point import TrackPoint
+
+if TYPE_CHECKING:
+    from letsgo.layout import Layout
+    from letsgo.train import Train
+
+__all__ = ["KinematicsEngine"]
+
+
+class KinematicsEngine:
+    announce_moves = True
+    """Whether to send train_moved for each train that moves, which keeps e.g. the
+    layout's magnet index up to date. Headless simulations that don't need that can
+    turn it off."""
+
+    def __init__(self, layout: Layout):
+        self.layout = layout
+        self.trains: List[Train] = []
+        """The trains, in the order of the rows of the arrays"""
+        self.segment = np.zeros(0, dtype=int)
+        """The segment each train's front is on, or -1 if it isn't on the track"""
+        self.offset = np.zeros(0)
+        self.rear_segment = np.zeros(0, dtype=int)
+        self.rear_offset = np.zeros(0)
+        self.velocity = np.zeros(0)
+        """In studs per second"""
+        self.acceleration = np.zeros(0)
+        """In studs per second squared"""
+        self.odometer = np.zeros(0)
+        """How far each train has moved, as Train.odometer"""
+        self.graph: Optional[TrackGraph] = None
+        self._index: Dict[Train, int] = {}
+        self._materialised = np.zeros(0, dtype=bool)
+        self._lengths = np.zeros(1)
+        self._following = np.full(1, -1)
+        self._following_epoch: Optional[int] = None
+        self._fleet_trains: Optional[List[Train]] = None
+        self._fleet_rows = np.zeros(0, dtype=int)
+        self._steps = FixedSteps(TrainPhysics.step)
+        self._rebuild = False
+
+    def attach(self):
+        """Takes over moving the layout's trains"""
+        self._relocate()
+        signals.train_added.connect(self.on_trains_changed, sender=self.layout)
+        signals.train_removed.connect(self.on_trains_changed, sender=self.layout)
+        signals.train_positioned.connect(self.on_train_positioned)
+
+    def detach(self):
+        """Hands trains back, with their track points up to date"""
+        signals.train_added.disconnect(self.on_trains_changed, sender=self.layout)
+        signals.train_removed.disconnect(self.on_trains_changed, sender=self.layout)
+        signals.train_positioned.disconnect(self.on_train_positioned)
+        self._materialise_all()
+        self._hand_back()
+        self.trains, self._index = [], {}
+
+    def _hand_back(self):
+        for train, velocity, odometer in zip(
+            self.trains, self.velocity.tolist(), self.odometer.tolist()
+        ):
+            train.kinematics = None
+            train.physics.velocity = velocity
+            train._odometer = odometer
+
+    def on_trains_changed(self, sender, train: Train):
+        self._rebuild = True
+
+    def on_train_positioned(self, sender: Train, position: Optional[TrackPoint]):
+        i = self._index.get(sender)
+        if i is not None:
+            self._locate(i, sender)
+
+    def _materialise_all(self):
+        for train in self.trains:
+            self.materialise(train)
+
+    def _relocate(self):
+        """Rebuilds the arrays from trains' track points, e.g. if the track changes"""
+        self._materialise_all()
+        self._hand_back()
+
+        self.graph = self.layout.track_graph
+        self.trains = list(self.layout.trains.values())
+        self._index = {train: i for i, train in enumerate(self.trains)}
+        count = len(self.trains)
+        self.segment = np.full(count, -1)
+        self.offset = np.zeros(count)
+        self.rear_segment = np.full(count, -1)
+        self.rear_offset = np.zeros(count)
+        self.velocity = np.array([train.physics.velocity for train in self.trains])
+        self.acceleration = np.zeros(count)
+        self.odometer = np.array([train._odometer for train in self.trains])
+        self._materialised = np.ones(count, dtype=bool)
+        # An extra segment of infinite length at the end, for trains that aren't on
+        # the track (as -1 indexes it)
+        self._lengths = np.array(
+            [segment.length for segment in self.graph.segments] + [math.inf]
+        )
+        self._following_epoch = None
+        self._fleet_trains = None
+        for i, train in enumerate(self.trains):
+            self._locate(i, train)
+            train.kinematics = self
+        self._rebuild = False
+
+    def _locate(self, i: int, train: Train):
+        assert self.graph
+        position, rear_position = train._position, train._rear_position
+        try:
+            if position is None or rear_position is None:
+                raise KeyError
+            segment, offset = self.graph.locate(position)
+            rear_segment, rear_offset = self.graph.locate(rear_position)
+        except KeyError:
+            self.segment[i] = self.rear_segment[i] = -1
+            self.velocity[i] = self.acceleration[i] = 0
+        else:
+            self.segment[i], self.offset[i] = segment.index, offset
+            self.rear_segment[i], self.rear_offset[i] = rear_segment.index, rear_offset
+        self._materialised[i] = True
+
+    def _refresh(self):
+        if self._rebuild or self.graph is not self.layout.track_graph:
+            self._relocate()
+        self._update_following()
+
+    def _update_following(self):
+        """Works out which segment follows each, given the current state of points"""
+        epoch = self.layout.points_state_epoch
+        if self._following_epoch == epoch:
+            return
+        assert self.graph
+        following = []
+        for segment in self.graph.segments:
+            for successor in segment.successors:
+                if successor.available:
+                    following.append(successor.index)
+                    break
+            else:
+                following.append(-1)
+        self._following = np.array(following + [-1])
+        self._following_epoch = epoch
+
+    def _advance(self, segment: np.ndarray, offset: np.ndarray, distance: np.ndarray):
+        """Moves positions along in place, returning how far each actually got"""
+        offset += distance
+        moved = distance.copy()
+        while True:
+            (over,) = np.nonzero(offset > self._lengths[segment])
+            if not len(over):
+                return moved
+            lengths = self._lengths[segment[over]]
+            following = self._following[segment[over]]
+            # Trains that run out of track stop at the end of it
+            ended = following < 0
+            moved[over[ended]] -= offset[over[ended]] - lengths[ended]
+            offset[over[ended]] = lengths[ended]
+            offset[over[~ended]] -= lengths[~ended]
+            segment[over[~ended]] = following[~ended]
+
+    def step(self, time_elapsed: float, velocity: Optional[np.ndarray] = None):
+        """Moves every train along by however far it goes in the time elapsed
+
+        By default, trains accelerate or brake towards the speeds predicted for them by
+        the layout's fleet predictor, which should be up to date. If velocities are
+        given, trains go at those straight away.
+        """
+        self._refresh()
+        on_track = self.segment >= 0
+        previous = self.velocity
+        if velocity is None:
+            target, acceleration, deceleration = self._fleet_targets()
+            velocity, distance = integrate(
+                self.velocity,
+                np.where(on_track, target, 0.0),
+                acceleration,
+                deceleration,
+                self._steps(time_elapsed),
+                self._steps.step,
+            )
+        else:
+            velocity = np.where(on_track, velocity, 0.0)
+            distance = velocity * time_elapsed
+        self.velocity = velocity
+        if time_elapsed > 0:
+            self.acceleration = (velocity - previous) / time_elapsed
+
+        moved = self._advance(self.segment, self.offset, distance)
+        self._advance(self.rear_segment, self.rear_offset, moved)
+        self.odometer += moved
+        stopped = moved < distance
+        self.velocity[stopped] = self.acceleration[stopped] = 0
+
+        (moving,) = np.nonzero(moved)
+        self._materialised[moving] = False
+        if self.announce_moves:
+            for i, distance in zip(moving.tolist(), moved[moving].tolist()):
+                signals.train_moved.send(self.trains[i], distance=distance)
+
+    def _fleet_targets(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Each train's target speed, and how quickly it can accelerate and brake"""
+        fleet = self.layout.fleet
+        if fleet.trains is not self._fleet_trains:
+            rows = {train: i for i, train in enumerate(fleet.trains)}
+            self._fleet_rows = np.array(
+                [rows.get(train, len(fleet.trains)) for train in self.trains],
+                dtype=int,
+            )
+            self._fleet_trains = fleet.trains
+        # Trains the fleet predictor hasn't seen yet carry on as they are until it has
+        return (
+            np.append(fleet.speeds, 0.0)[self._fleet_rows],
+            np.append(fleet.acceleration, 0.0)[self._fleet_rows],
+            np.append(fleet.deceleration, 0.0)[self._fleet_rows],
+        )
+
+    def velocity_of(self, train: Train) -> float:
+        return float(self.velocity[self._index[train]])
+
+    def odometer_of(self, train: Train) -> float:
+        return float(self.odometer[self._index[train]])
+
+    def move(self, train: Train, distance: float):
+        """Moves a single train, as Train.move would, except that it stops at the end
+        of the line"""
+        self._refresh()
+        i = self._index[train]
+        if distance < 0 or self.segment[i] < 0:
+            # Segments only go forwards, so back up the slow way
+            self.materialise(train)
+            position, rear_position = train._position, train._rear_position
+            assert position and rear_position
+            position += distance
+            rear_position += distance
+            self._locate(i, train)
+            moved = distance
+        else:
+            row = slice(i, i + 1)
+            moved = float(
+                self._advance(
+                    self.segment[row], self.offset[row], np.array([distance])
+                )[0]
+            )
+            self._advance(
+                self.rear_segment[row], self.rear_offset[row], np.array([moved])
+            )
+            self._materialised[i] = False
+        self.odometer[i] += moved
+        signals.train_moved.send(train, distance=moved)
+
+    def materialise(self, train: Train):
+        """Updates a train's track points from the arrays, if they've moved on"""
+        i = self._index.get(train)
+        if i is None or self._materialised[i]:
+            return
+        self._materialised[i] = True
+        if self.segment[i] < 0:
+            return
+        train._position = self._track_point(self.segment[i], self.offset[i], train)
+        train._rear_position = self._track_point(
+            self.rear_segment[i], self.rear_offset[i], train
+        )
+
+    def _track_point(self, segment_index: int, offset: float, train: Train):
+        assert self.graph
+        segment = self.graph.segments[segment_index]
+        (piece, in_anchor, out_anchor), offset = segment.traversal_at(offset)
+        return TrackPoint(piece, in_anchor, out_anchor, offset, train=train)
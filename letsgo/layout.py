@@ -2,16 +2,27 @@ from __future__ import annotations
 
 import functools
 import logging
+import math
 import threading
-from typing import Dict
+from typing import Dict, Optional
 
+from letsgo.calibration import CalibrationStore
 from letsgo.control import Controller, SensorController, TrainController
+from letsgo.control.runtime import ControllerRuntime
+from letsgo.fleet import FleetPredictor
+from letsgo.kinematics import KinematicsEngine
+from letsgo.magnet_index import MagnetIndex
+from letsgo.occupancy import OccupancyIndex
+from letsgo.reservations import ReservationTable
 from letsgo.pieces import Piece
 from letsgo.pieces.points import BasePoints
 from letsgo.routeing import Itinerary
 from letsgo.sensor import Sensor
+from letsgo.sensor_distances import SensorDistances
+from letsgo.sensor_events import SensorEventAggregator
 from letsgo.station import Station
 from letsgo.track import Anchor
+from letsgo.track_graph import TrackGraph
 from letsgo.train import Train
 from letsgo.utils.quadtree import ResizingIndex
 from . import signals
@@ -54,10 +65,27 @@ class Layout:
         """QTree for things like sensors, lights, and boom barriers"""
 
         self.running = threading.Event()
+        self.controller_runtime = ControllerRuntime()
+        self.calibration_store: Optional[CalibrationStore] = None
+        """Where trains' speed observations are kept between sessions, if anywhere"""
         self._epoch = 0
+        self._topology_epoch = 0
+        self._track_graph: Optional[TrackGraph] = None
+        self._points_state_epoch = 0
+        self._sensor_distances: Optional[SensorDistances] = None
+        self._magnet_index: Optional[MagnetIndex] = None
+        self._occupancy: Optional[OccupancyIndex] = None
         self.meta = {}
 
         self.sensor_magnets_last_seen = {}
+        self.magnet_arrivals: Dict[Sensor, float] = {}
+        """When a magnet is next expected at each sensor with a controller, as of the
+        last tick, for controllers to poll more often when one is due"""
+        self.sensor_events = SensorEventAggregator(self)
+        self.fleet = FleetPredictor(self)
+        self._kinematics: Optional[KinematicsEngine] = None
+        self.reservation_table = ReservationTable(self)
+        """When trains expect to occupy which blocks of track"""
 
     @property
     def collections(self):
@@ -83,7 +111,9 @@ class Layout:
     @_changes_layout
     def add_piece(self, piece):
         self.pieces[piece.id] = piece
+        self.topology_changed()
         signals.piece_positioned.connect(self.on_piece_positioned, piece)
+        signals.points_state_changed.connect(self.on_points_state_changed, piece)
         for anchor in piece.anchors.values():
             if anchor.id in self.anchors and anchor != self.anchors[anchor.id]:
                 self.anchors[anchor.id] += anchor
@@ -101,16 +131,28 @@ class Layout:
             self.anchors_qtree.remove_item(piece.anchors[anchor_name])
             del self.anchors[piece.anchors[anchor_name].id]
         del self.pieces[piece.id]
+        self.topology_changed()
         self.pieces_qtree.remove_item(piece)
         signals.piece_positioned.disconnect(self.on_piece_positioned, piece)
+        signals.points_state_changed.disconnect(self.on_points_state_changed, piece)
         signals.piece_removed.send(self, piece=piece)
 
     def add_train(self, train):
         self.trains[train.id] = train
+        signals.train_positioned.connect(self.on_train_positioned, train)
+        signals.train_moved.connect(self.on_train_moved, train)
+        self.on_train_positioned(train)
         signals.train_added.send(self, train=train)
 
     def remove_train(self, train):
         del self.trains[train.id]
+        signals.train_positioned.disconnect(self.on_train_positioned, train)
+        signals.train_moved.disconnect(self.on_train_moved, train)
+        if self._magnet_index:
+            self._magnet_index.remove_train(train)
+        if self._occupancy:
+            self._occupancy.remove_train(train)
+        self.reservation_table.release(train)
         signals.train_removed.send(self, train=train)
 
     @_changes_layout
@@ -135,17 +177,18 @@ class Layout:
         self.controllers[controller.id] = controller
         signals.controller_added.send(self, controller=controller)
         if self.running.is_set():
-            controller.start()
+            self.controller_runtime.add_controller(controller)
 
     def remove_controller(self, controller):
         if self.running.is_set():
-            controller.stop()
+            self.controller_runtime.remove_controller(controller)
         del self.controllers[controller.id]
         signals.controller_removed.send(self, controller=controller)
 
     @_changes_layout
     def add_sensor(self, sensor):
         self.sensors[sensor.id] = sensor
+        self._sensor_distances = None
         signals.sensor_positioned.connect(self.on_trackside_item_positioned, sensor)
         if sensor.position:
             self.on_trackside_item_positioned(sensor)
@@ -155,6 +198,7 @@ class Layout:
     @_changes_layout
     def remove_sensor(self, sensor):
         del self.sensors[sensor.id]
+        self._sensor_distances = None
         self.trackside_items_qtree.remove_item(sensor)
         signals.sensor_positioned.disconnect(self.on_trackside_item_positioned, sensor)
         signals.sensor_removed.send(self, sensor=sensor)
@@ -174,8 +218,8 @@ class Layout:
             self.anchors_qtree.insert_item(anchor, anchor.position)
         else:
             self.anchors_qtree.remove_item(anchor)
-        while anchor.subsumes:
-            self.anchors_qtree.remove_item(anchor.subsumes.pop())
+        for subsumed_anchor in anchor.pop_subsumed():
+            self.anchors_qtree.remove_item(subsumed_anchor)
 
     def on_trackside_item_positioned(self, trackside_item: TracksideItem):
         if trackside_item.position:
@@ -185,24 +229,83 @@ class Layout:
         else:
             self.trackside_items_qtree.remove_item(trackside_item)
 
+    @property
+    def kinematics(self) -> Optional[KinematicsEngine]:
+        """If set, moves all the trains at once, rather than each moving itself"""
+        return self._kinematics
+
+    @kinematics.setter
+    def kinematics(self, value: Optional[KinematicsEngine]):
+        if self._kinematics:
+            self._kinematics.detach()
+        self._kinematics = value
+        if value:
+            value.attach()
+
     def tick(self, sender, time, time_elapsed):
+        self.handle_sensor_events()
+        self.sensor_events.flush_expired(time)
         for train in self.trains.values():
-            train.tick(time, time_elapsed)
+            train.speed_estimation.tick()
+        self.fleet.update()
+        if self._kinematics:
+            self._kinematics.step(time_elapsed)
+        else:
+            for train in self.trains.values():
+                if train.position:
+                    train.tick(time, time_elapsed)
+        self.update_magnet_arrivals(time)
+
+    def update_magnet_arrivals(self, time: float):
+        """Works out when a magnet is next expected at each sensor with a controller,
+        from where magnets are and how fast their trains are going"""
+        magnet_arrivals: Dict[Sensor, float] = {}
+        sensors = [
+            sensor for sensor in self.sensors.values() if sensor.controller is not None
+        ]
+        if sensors:
+            magnet_index = self.magnet_index
+            for sensor in sensors:
+                expected_in = math.inf
+                for match in magnet_index.candidates(sensor):
+                    # Magnets behind the sensor are coming towards it
+                    speed = self.fleet.speed(match.train)
+                    if match.distance >= 0 and speed > 0:
+                        expected_in = min(expected_in, match.distance / speed)
+                magnet_arrivals[sensor] = time + expected_in
+        # Replaced rather than updated, as controllers read it from their own thread
+        self.magnet_arrivals = magnet_arrivals
 
     def start(self):
         if self.running.is_set():
             raise AssertionError
         self.running.set()
+        self.controller_runtime.start()
         for controller in self.controllers.values():
-            controller.start()
+            self.controller_runtime.add_controller(controller)
+
+    def handle_sensor_events(self):
+        """Handles sensor events queued by controllers, a batch at a time
+
+        This is done at the start of each tick, on the same thread as trains are moved,
+        so that sensor activity and the trains it repositions don't race with them.
+        """
+        for controller in list(self.controllers.values()):
+            if isinstance(controller, SensorController):
+                for event in controller.sensor_events.drain():
+                    event.sensor.report_activity(event.activated, event.when)
 
     def stop(self):
         if not self.running.is_set():
             logger.warning("Layout.stop called when layout isn't running")
             return
         self.running.clear()
-        for controller in self.controllers.values():
-            controller.stop()
+        self.controller_runtime.stop()
+        # Anything reported while the controllers were stopping
+        self.handle_sensor_events()
+        self.sensor_events.flush()
+        if self.calibration_store:
+            self.calibration_store.flush()
 
     @property
     def epoch(self):
@@ -216,73 +319,72 @@ class Layout:
         self._epoch += 1
         signals.layout_changed.send(self, cleared=cleared)
 
-    def on_sensor_activity(self, sender: Sensor, activated, when):
-        (
-            last_train_seen,
-            last_magnet_index_seen,
-            last_time_seen,
-        ) = self.sensor_magnets_last_seen.get(sender, (None, None, None))
+    @property
+    def topology_epoch(self):
+        """This changes whenever pieces are added, removed, connected or disconnected."""
+        return self._topology_epoch
 
-        if not activated:
-            return
+    def topology_changed(self):
+        self._topology_epoch += 1
 
-        maximum_distance = 1000
+    @property
+    def points_state_epoch(self):
+        """This changes whenever any points change state."""
+        return self._points_state_epoch
+
+    @property
+    def track_graph(self) -> TrackGraph:
+        """A compiled graph of the track, recompiled whenever the topology changes"""
+        if self._track_graph is None or self._track_graph.epoch != self._topology_epoch:
+            self._track_graph = TrackGraph(
+                self.pieces.values(), epoch=self._topology_epoch
+            )
+        return self._track_graph
 
-        train_seen, train_seen_offset, magnet_index_seen = None, None, None
+    @property
+    def magnet_index(self) -> MagnetIndex:
+        """Where trains' magnets are expected to be, rebuilt when the topology changes"""
+        track_graph = self.track_graph
+        if self._magnet_index is None or self._magnet_index.graph is not track_graph:
+            self._magnet_index = MagnetIndex(track_graph)
+            for train in self.trains.values():
+                self._magnet_index.place_train(train)
+        return self._magnet_index
 
-        for train in self.trains.values():
-            car_offset = 0.0
-
-            if train.speed == 0:
-                continue
-
-            for i, car in enumerate(train.cars):
-                # No magnet in this car to expect
-                if car.magnet_offset is None:
-                    continue
-                # Discount any magnets we've seen in the last two seconds
-                if (
-                    train == last_train_seen
-                    and i == last_magnet_index_seen
-                    and when < last_time_seen + 2
-                ):
-                    continue
-
-                train_offset = car_offset + car.magnet_offset
-                expected_magnet_position = train.position - train_offset
-
-                distance_forward = expected_magnet_position.distance_to(
-                    sender.track_point, maximum_distance
-                )
-                if distance_forward:
-                    train_seen, train_seen_offset, magnet_index_seen = (
-                        train,
-                        train_offset,
-                        i,
-                    )
-                    maximum_distance = min(distance_forward, maximum_distance)
-                distance_backward = sender.track_point.distance_to(
-                    expected_magnet_position, maximum_distance
-                )
-                if distance_backward:
-                    train_seen, train_seen_offset, magnet_index_seen = (
-                        train,
-                        train_offset,
-                        i,
-                    )
-                    maximum_distance = min(distance_backward, maximum_distance)
-
-                # The 1 is the gap between cars
-                car_offset += car.length + 1
-
-        if train_seen:
-            self.sensor_magnets_last_seen[sender] = train_seen, magnet_index_seen, when
-            branch_decisions = train_seen.position.branch_decisions
-            train_seen.position = sender.track_point + train_seen_offset
-            train_seen.position.branch_decisions = branch_decisions
-            signals.train_spotted.send(
-                train_seen, sensor=sender, position=train_seen.position, when=when
+    @property
+    def occupancy(self) -> OccupancyIndex:
+        """Which track trains occupy, rebuilt when the topology changes"""
+        track_graph = self.track_graph
+        if self._occupancy is None or self._occupancy.graph is not track_graph:
+            self._occupancy = OccupancyIndex(track_graph)
+            for train in self.trains.values():
+                self._occupancy.place_train(train)
+        return self._occupancy
+
+    def on_train_positioned(self, sender: Train, **kwargs):
+        self.magnet_index.place_train(sender)
+        self.occupancy.place_train(sender)
+
+    def on_train_moved(self, sender: Train, distance: float):
+        self.magnet_index.move_train(sender, distance)
+        self.occupancy.move_train(sender, distance)
+
+    def on_points_state_changed(self, sender: BasePoints, state: str):
+        self._points_state_epoch += 1
+
+    @property
+    def sensor_distances(self) -> SensorDistances:
+        """Distances between sensors, recomputed when the track or points change"""
+        epoch = self._topology_epoch, self._points_state_epoch
+        if self._sensor_distances is None or self._sensor_distances.epoch != epoch:
+            self._sensor_distances = SensorDistances(
+                self.track_graph, self.sensors.values(), epoch=epoch
             )
+        return self._sensor_distances
+
+    def on_sensor_activity(self, sender: Sensor, activated, when):
+        if activated:
+            self.sensor_events.add(sender, when)
 
     @property
     def placed_pieces(self):
@@ -5,6 +5,7 @@ from letsgo.control import Controller
 
 from letsgo.layout import Layout
 from letsgo.layout_parser import LayoutParser
+from letsgo.piece_store import PieceStore
 from letsgo.pieces import Piece, piece_classes
 from letsgo.pieces.curve import CurveDirection
 from letsgo.sensor import Sensor
@@ -75,3 +76,11 @@ class LetsGoLayoutParser(LayoutParser):
         #     self.add_sensor(sensor, announce=False)
 
         layout.changed()
+
+    def parse_piece_store(self, fp) -> PieceStore:
+        """Parses only the track pieces of a layout file into a `PieceStore`.
+
+        This avoids creating `Piece` objects, for very large layouts that only need
+        positioning and drawing."""
+        doc = yaml.safe_load(fp)
+        return PieceStore.from_yaml(doc.get("pieces", []))
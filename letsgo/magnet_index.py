@@ -0,0 +1,212 @@
+"""
+Where trains' magnets are expected to be, indexed by track segment
+
+When a sensor is activated, only magnets expected within a window either side of it
+need to be considered. Magnet positions are kept as offsets along segments of the
+track graph, and are moved along as their trains move.
+"""
+
+from __future__ import annotations
+
+import bisect
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple, TYPE_CHECKING
+
+from letsgo.track_graph import Segment, TrackGraph
+from letsgo.track_point import EndOfTheLine
+
+if TYPE_CHECKING:
+    from letsgo.car_positions import CarPositions
+    from letsgo.sensor import Sensor
+    from letsgo.train import Train
+
+MagnetLocation = Optional[Tuple[Segment, float]]
+
+
+class MagnetMatch(NamedTuple):
+    train: Train
+    car_index: int
+    train_offset: float
+    """How far the magnet is behind the front of the train"""
+    distance: float
+    """How far the magnet is expected to be behind the sensor, or ahead if negative"""
+    reverse: bool
+    """Whether the train is passing the sensor against the direction of its track point"""
+
+
+class _SegmentMagnets:
+    """Magnets on a single segment, sorted by offset"""
+
+    __slots__ = ("offsets", "magnets")
+
+    def __init__(self):
+        self.offsets: List[float] = []
+        self.magnets: List[Tuple[Train, int]] = []
+
+    def insert(self, offset: float, train: Train, car_index: int):
+        i = bisect.bisect(self.offsets, offset)
+        self.offsets.insert(i, offset)
+        self.magnets.insert(i, (train, car_index))
+
+    def remove(self, offset: float, train: Train, car_index: int):
+        i = bisect.bisect_left(self.offsets, offset)
+        while self.magnets[i] != (train, car_index):
+            i += 1
+        del self.offsets[i]
+        del self.magnets[i]
+
+    def between(self, start: float, end: float):
+        i = bisect.bisect_left(self.offsets, start)
+        j = bisect.bisect_right(self.offsets, end)
+        return zip(self.offsets[i:j], self.magnets[i:j])
+
+
+class MagnetIndex:
+    window = 250.0
+    """How far either side of a sensor to look for magnets"""
+
+    def __init__(self, graph: TrackGraph):
+        self.graph = graph
+        self._segments: Dict[Segment, _SegmentMagnets] = {}
+        self._locations: Dict[Train, List[MagnetLocation]] = {}
+        self._train_offsets: Dict[Train, Dict[int, float]] = {}
+
+    def _insert(self, location: MagnetLocation, train: Train, car_index: int):
+        if location:
+            segment, offset = location
+            if segment not in self._segments:
+                self._segments[segment] = _SegmentMagnets()
+            self._segments[segment].insert(offset, train, car_index)
+
+    def _remove(self, location: MagnetLocation, train: Train, car_index: int):
+        if location:
+            segment, offset = location
+            self._segments[segment].remove(offset, train, car_index)
+
+    def place_train(self, train: Train):
+        """(Re)calculates where a train's magnets are from its position"""
+        self.remove_train(train)
+        locations: List[MagnetLocation] = []
+        car_positions: Optional[CarPositions] = getattr(train, "car_positions", None)
+        if car_positions is not None:
+            # Trains keep track of where their magnets are themselves
+            magnet_locations = car_positions.magnet_locations()
+            if car_positions.graph is self.graph:
+                self._train_offsets[train] = dict(train.magnet_offsets())
+                for car_index, magnet_location in magnet_locations:
+                    self._insert(magnet_location, train, car_index)
+                    locations.append(magnet_location)
+                self._locations[train] = locations
+                return
+        if not train.position:
+            return
+        self._train_offsets[train] = dict(train.magnet_offsets())
+        for car_index, train_offset in self._train_offsets[train].items():
+            try:
+                location: MagnetLocation = self.graph.locate(
+                    train.position - train_offset
+                )
+            except (EndOfTheLine, KeyError):
+                location = None
+            self._insert(location, train, car_index)
+            locations.append(location)
+        self._locations[train] = locations
+
+    def move_train(self, train: Train, distance: float):
+        """Moves a train's magnets along, following the current state of points"""
+        locations = self._locations.get(train)
+        car_positions: Optional[CarPositions] = getattr(train, "car_positions", None)
+        if car_positions is not None and locations is not None:
+            # Trains move their own along, so read them from there
+            magnet_locations = car_positions.magnet_locations()
+            if car_positions.graph is self.graph:
+                for i, (car_index, location) in enumerate(magnet_locations):
+                    self._remove(locations[i], train, car_index)
+                    self._insert(location, train, car_index)
+                    locations[i] = location
+                return
+            locations = None
+        if locations is None or distance < 0 or not all(locations):
+            self.place_train(train)
+            return
+        for i, car_index in enumerate(self._train_offsets[train]):
+            location = locations[i]
+            self._remove(location, train, car_index)
+            segment, offset = location  # type: ignore
+            offset += distance
+            while offset > segment.length:
+                offset -= segment.length
+                for successor in segment.successors:
+                    if successor.available:
+                        segment = successor
+                        break
+                else:
+                    location = None
+                    break
+            else:
+                location = segment, offset
+            self._insert(location, train, car_index)
+            locations[i] = location
+
+    def remove_train(self, train: Train):
+        for car_index, location in zip(
+            self._train_offsets.pop(train, ()), self._locations.pop(train, ())
+        ):
+            self._remove(location, train, car_index)
+
+    def candidates(
+        self, sensor: Sensor, window: Optional[float] = None
+    ) -> List[MagnetMatch]:
+        """Returns magnets that could have activated a sensor, nearest first"""
+        window = self.window if window is None else window
+        directions = [False] if sensor.single_direction else [False, True]
+        matches = []
+        for reverse in directions:
+            track_point = sensor.track_point
+            try:
+                segment, offset = self.graph.locate(
+                    track_point.reversed() if reverse else track_point
+                )
+            except KeyError:
+                continue
+            for distance, train, car_index in self._search(segment, offset, window):
+                matches.append(
+                    MagnetMatch(
+                        train,
+                        car_index,
+                        self._train_offsets[train][car_index],
+                        distance,
+                        reverse,
+                    )
+                )
+        matches.sort(key=lambda match: abs(match.distance))
+        return matches
+
+    def _search(self, segment: Segment, offset: float, window: float):
+        """Finds magnets within a window ahead of and behind an offset along a segment"""
+        found: Dict[Tuple[Train, int], float] = {}
+
+        def visit(segment: Segment, offset: float, forwards: bool, visited: Set):
+            # offset is where the sensor is relative to the start of this segment
+            visited.add(segment)
+            if segment in self._segments:
+                for magnet_offset, magnet in self._segments[segment].between(
+                    offset - window, offset + window
+                ):
+                    distance = offset - magnet_offset
+                    if magnet not in found or abs(distance) < abs(found[magnet]):
+                        found[magnet] = distance
+            if forwards and segment.length - offset < window:
+                for successor in segment.successors:
+                    if successor not in visited:
+                        visit(successor, offset - segment.length, True, visited)
+            if not forwards and offset < window:
+                for predecessor in segment.predecessors:
+                    if predecessor not in visited:
+                        visit(predecessor, predecessor.length + offset, False, visited)
+
+        visit(segment, offset, True, set())
+        visit(segment, offset, False, set())
+        return [
+            (distance, train, car_index)
+            for (train, car_index), distance in found.items()
+        ]
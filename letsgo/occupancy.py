@@ -0,0 +1,321 @@
+"""
+Which stretches of track trains occupy, indexed by track segment
+
+Each train occupies the track from its rear to its front, which may span several
+segments of the track graph. Each stretch is kept sorted by where it starts along its
+segment, and also along the reverse of that segment, so that trains facing either way
+are found. As trains move, the ends of their extents are moved along without needing
+their track points.
+
+Trains are never longer than the longest extent seen so far, so finding what occupies an
+offset only needs to look back that far, with a binary search.
+"""
+
+from __future__ import annotations
+
+import bisect
+import heapq
+import math
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple, TYPE_CHECKING
+
+from letsgo import signals
+from letsgo.track_graph import Segment, TrackGraph
+
+if TYPE_CHECKING:
+    from letsgo.pieces import Piece
+    from letsgo.track_point import TrackPoint
+    from letsgo.train import Train
+
+__all__ = ["OccupancyIndex", "Gap"]
+
+
+class Gap(NamedTuple):
+    distance: float
+    """From the front of one train to the nearest part of the other"""
+    train: Train
+
+
+class _Extent:
+    """The segments a train occupies, from its rear to its front"""
+
+    __slots__ = ("path", "rear_offset", "front_offset")
+
+    def __init__(self, path: List[Segment], rear_offset: float, front_offset: float):
+        self.path = path
+        self.rear_offset = rear_offset
+        self.front_offset = front_offset
+
+    def intervals(self):
+        last = len(self.path) - 1
+        for i, segment in enumerate(self.path):
+            yield (
+                segment,
+                self.rear_offset if i == 0 else 0.0,
+                self.front_offset if i == last else segment.length,
+            )
+
+
+class _SegmentTrains:
+    """Stretches of a single segment that trains occupy, sorted by where they start"""
+
+    __slots__ = ("starts", "entries")
+
+    def __init__(self):
+        self.starts: List[float] = []
+        self.entries: List[Tuple[float, Train]] = []
+
+    def insert(self, start: float, end: float, train: Train):
+        i = bisect.bisect(self.starts, start)
+        self.starts.insert(i, start)
+        self.entries.insert(i, (end, train))
+
+    def remove(self, start: float, train: Train):
+        i = bisect.bisect_left(self.starts, start)
+        while self.entries[i][1] is not train:
+            i += 1
+        del self.starts[i]
+        del self.entries[i]
+
+    def overlapping(self, start: float, end: float, longest: float):
+        """Trains occupying any of a stretch of the segment"""
+        i = bisect.bisect_left(self.starts, start - longest)
+        j = bisect.bisect_right(self.starts, end)
+        for k in range(i, j):
+            entry_end, train = self.entries[k]
+            if entry_end >= start:
+                yield self.starts[k], entry_end, train
+
+
+class OccupancyIndex:
+    def __init__(self, graph: TrackGraph):
+        self.graph = graph
+        self._segments: Dict[Segment, _SegmentTrains] = {}
+        self._extents: Dict[Train, _Extent] = {}
+        self._overlapping: Dict[Train, Set[Train]] = {}
+        self._longest = 0.0
+
+    def _stretches(self, extent: _Extent):
+        """Each stretch an extent occupies, and the same the other way"""
+        for segment, start, end in extent.intervals():
+            yield segment, start, end
+            if segment.reverse:
+                yield segment.reverse, segment.length - end, segment.length - start
+
+    def _insert(self, train: Train, extent: _Extent):
+        self._extents[train] = extent
+        for segment, start, end in self._stretches(extent):
+            if segment not in self._segments:
+                self._segments[segment] = _SegmentTrains()
+            self._segments[segment].insert(start, end, train)
+            self._longest = max(self._longest, end - start)
+        self._check_overlaps(train)
+
+    def _remove(self, train: Train) -> Optional[_Extent]:
+        extent = self._extents.pop(train, None)
+        if extent:
+            for segment, start, _ in self._stretches(extent):
+                self._segments[segment].remove(start, train)
+        return extent
+
+    def place_train(self, train: Train):
+        """(Re)calculates what a train occupies from its position"""
+        self._remove(train)
+        position, rear_position = train.position, train.rear_position
+        if not position or not rear_position:
+            self._check_overlaps(train)
+            return
+        try:
+            rear_segment, rear_offset = self.graph.locate(rear_position)
+            front_segment, front_offset = self.graph.locate(position)
+        except KeyError:
+            self._check_overlaps(train)
+            return
+        path = self._path(rear_segment, rear_offset, front_segment, train.length)
+        if path is None:
+            # We can't tell which way the train came, so only count its front segment
+            path, rear_offset = [front_segment], max(0.0, front_offset - train.length)
+        self._insert(train, _Extent(path, rear_offset, front_offset))
+
+    @staticmethod
+    def _path(
+        rear_segment: Segment, rear_offset: float, front_segment: Segment, length: float
+    ) -> Optional[List[Segment]]:
+        """Finds the segments from a train's rear to its front, preferring the way
+        points are set"""
+        if (
+            rear_segment is front_segment
+            and length <= rear_segment.length - rear_offset
+        ):
+            return [rear_segment]
+        stack = [(rear_segment.length - rear_offset, [rear_segment])]
+        while stack:
+            distance, path = stack.pop()
+            # Available successors last, so that they're tried first
+            for successor in sorted(path[-1].successors, key=lambda s: s.available):
+                if successor is front_segment:
+                    return path + [successor]
+                if distance + successor.length < length:
+                    stack.append((distance + successor.length, path + [successor]))
+        return None
+
+    def move_train(self, train: Train, distance: float):
+        """Moves what a train occupies along, following the current state of points"""
+        extent = self._remove(train)
+        if extent is None or distance < 0:
+            self.place_train(train)
+            return
+        path = extent.path
+        front_offset = extent.front_offset + distance
+        while front_offset > path[-1].length:
+            front_offset -= path[-1].length
+            for successor in path[-1].successors:
+                if successor.available:
+                    path.append(successor)
+                    break
+            else:
+                # Off the end of the line, which the train will have noticed
+                self.place_train(train)
+                return
+        rear_offset = extent.rear_offset + distance
+        while len(path) > 1 and rear_offset > path[0].length:
+            rear_offset -= path[0].length
+            del path[0]
+        self._insert(train, _Extent(path, rear_offset, front_offset))
+
+    def remove_train(self, train: Train):
+        self._remove(train)
+        self._check_overlaps(train)
+
+    def extent(self, train: Train) -> Optional[Tuple[List[Segment], float, float]]:
+        """The segments a train occupies from its rear to its front, how far along
+        the first its rear is, and how far along the last its front is"""
+        extent = self._extents.get(train)
+        if extent is None:
+            return None
+        return list(extent.path), extent.rear_offset, extent.front_offset
+
+    def pieces(self, train: Train) -> Set[Piece]:
+        """The pieces any part of a train is on"""
+        extent = self._extents.get(train)
+        found: Set[Piece] = set()
+        if extent:
+            for segment, start, end in extent.intervals():
+                i = max(0, bisect.bisect_right(segment.offsets, start) - 1)
+                while i < len(segment.traversals) and segment.offsets[i] <= end:
+                    found.add(segment.traversals[i][0])
+                    i += 1
+        return found
+
+    def occupants(self, track_point: TrackPoint) -> List[Train]:
+        """Trains occupying a point on the track"""
+        try:
+            segment, offset = self.graph.locate(track_point)
+        except KeyError:
+            return []
+        return self.occupants_at(segment, offset)
+
+    def occupants_at(self, segment: Segment, offset: float) -> List[Train]:
+        if segment not in self._segments:
+            return []
+        return [
+            train
+            for _, _, train in self._segments[segment].overlapping(
+                offset, offset, self._longest
+            )
+        ]
+
+    def overlapping(self, train: Train) -> Set[Train]:
+        """Other trains occupying any of the same track as a train"""
+        extent = self._extents.get(train)
+        found: Set[Train] = set()
+        if extent:
+            for segment, start, end in extent.intervals():
+                for _, _, other in self._segments[segment].overlapping(
+                    start, end, self._longest
+                ):
+                    found.add(other)
+        found.discard(train)
+        return found
+
+    def overlaps(self) -> Set[Tuple[Train, Train]]:
+        """Every pair of trains occupying the same track, in no particular order"""
+        return {
+            (train, other)
+            for train, others in self._overlapping.items()
+            for other in others
+            if id(train) < id(other)
+        }
+
+    def gap_ahead(
+        self,
+        train: Train,
+        maximum_distance: float = math.inf,
+        follow_points_state: bool = True,
+    ) -> Optional[Gap]:
+        """The nearest train ahead of a train's front, going either way"""
+        extent = self._extents.get(train)
+        if extent is None:
+            return None
+        segment, offset = extent.path[-1], extent.front_offset
+        nearest = self._next_on_segment(segment, offset, train)
+        if nearest:
+            return nearest if nearest.distance <= maximum_distance else None
+
+        # A bounded search over segments, as in TrackGraph.distances_from
+        seen: Set[Segment] = set()
+        queue: List[Tuple[float, int, Segment]] = []
+        distance = segment.length - offset
+        for successor in segment.successors:
+            if not follow_points_state or successor.available:
+                heapq.heappush(queue, (distance, successor.index, successor))
+        while queue:
+            distance, _, segment = heapq.heappop(queue)
+            if distance > maximum_distance:
+                return None
+            if segment in seen:
+                continue
+            seen.add(segment)
+            nearest = self._next_on_segment(segment, 0.0, train)
+            if nearest:
+                distance += nearest.distance
+                return (
+                    Gap(distance, nearest.train)
+                    if distance <= maximum_distance
+                    else None
+                )
+            distance += segment.length
+            for successor in segment.successors:
+                if successor not in seen and (
+                    not follow_points_state or successor.available
+                ):
+                    heapq.heappush(queue, (distance, successor.index, successor))
+        return None
+
+    def _next_on_segment(
+        self, segment: Segment, offset: float, train: Train
+    ) -> Optional[Gap]:
+        trains = self._segments.get(segment)
+        if not trains:
+            return None
+        # Anything already overlapping the offset is no distance away
+        for _, _, other in trains.overlapping(offset, offset, self._longest):
+            if other is not train:
+                return Gap(0.0, other)
+        i = bisect.bisect_right(trains.starts, offset)
+        for start, (_, other) in zip(trains.starts[i:], trains.entries[i:]):
+            if other is not train:
+                return Gap(start - offset, other)
+        return None
+
+    def _check_overlaps(self, train: Train):
+        """Announces any trains that have started overlapping this one"""
+        previous = self._overlapping.pop(train, set())
+        for other in previous:
+            self._overlapping.get(other, set()).discard(train)
+        overlapping = self.overlapping(train)
+        if overlapping:
+            self._overlapping[train] = overlapping
+            for other in overlapping:
+                self._overlapping.setdefault(other, set()).add(train)
+        for other in overlapping - previous:
+            signals.trains_overlapping.send(train, other=other)
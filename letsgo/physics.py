@@ -0,0 +1,114 @@
+"""
+How trains speed up and slow down
+
+Trains have momentum: rather than going at the speed their motor would drive them at
+once, they accelerate towards it as quickly as their motor can pull their mass, and slow
+down as quickly as they can be braked. Velocities are integrated in fixed steps, so that
+how far a train goes doesn't depend on how often the layout ticks, and the same
+integration works on a single train or on arrays of them (see `letsgo.kinematics`).
+
+Deceleration is constant, so braking distances have a closed form.
+"""
+
+from __future__ import annotations
+
+import math
+from typing import Optional, Tuple, TypeVar, TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from letsgo.train import Train
+
+__all__ = ["DEFAULT_MASS_PER_STUD", "FixedSteps", "TrainPhysics", "integrate"]
+
+DEFAULT_MASS_PER_STUD = 12.0
+"""The mass of a car, in grams per stud of length, if it isn't given"""
+
+Velocity = TypeVar("Velocity", float, np.ndarray)
+
+
+def integrate(
+    velocity: Velocity,
+    target: Velocity,
+    acceleration: Velocity,
+    deceleration: Velocity,
+    steps: int,
+    step: float,
+) -> Tuple[Velocity, Velocity]:
+    """Moves velocities towards their targets, within limits, over some fixed steps
+
+    Returns the new velocities and the distances travelled.
+    """
+    distance = velocity * 0.0
+    for _ in range(steps):
+        velocity = np.minimum(
+            np.maximum(target, velocity - deceleration * step),
+            velocity + acceleration * step,
+        )
+        distance = distance + velocity * step
+    return velocity, distance
+
+
+class FixedSteps:
+    """Splits up time as it passes into whole steps, carrying the rest over"""
+
+    def __init__(self, step: float):
+        self.step = step
+        self._unintegrated = 0.0
+
+    def __call__(self, time_elapsed: float) -> int:
+        self._unintegrated += time_elapsed
+        # Allow for rounding error, so that e.g. ticks of 0.05s are five steps
+        steps = int(self._unintegrated / self.step + 1e-9)
+        self._unintegrated = max(0.0, self._unintegrated - steps * self.step)
+        return steps
+
+
+class TrainPhysics:
+    step = 0.01
+    """How long each step of integration covers, in seconds"""
+
+    tractive_force = 40_000.0
+    """How hard the motor can pull, in gram studs per second squared"""
+
+    braking_force = 60_000.0
+    """How hard the train can be slowed, in gram studs per second squared"""
+
+    def __init__(self, train: Train):
+        self.train = train
+        self.velocity = 0.0
+        """How fast the train is actually going, in studs per second"""
+        self.steps = FixedSteps(self.step)
+
+    @property
+    def max_acceleration(self) -> float:
+        """In studs per second squared"""
+        return self.tractive_force / self.train.mass
+
+    @property
+    def max_deceleration(self) -> float:
+        """In studs per second squared"""
+        return self.braking_force / self.train.mass
+
+    def advance(self, target: float, time_elapsed: float) -> float:
+        """Accelerates or brakes towards a target speed, returning the distance covered"""
+        velocity, distance = integrate(
+            self.velocity,
+            target,
+            self.max_acceleration,
+            self.max_deceleration,
+            self.steps(time_elapsed),
+            self.step,
+        )
+        self.velocity = float(velocity)
+        return float(distance)
+
+    def braking_distance(self, velocity: Optional[float] = None) -> float:
+        """How far the train would go before stopping if it started braking now"""
+        velocity = self.velocity if velocity is None else velocity
+        return velocity**2 / (2 * self.max_deceleration)
+
+    def stopping_speed(self, distance: float) -> float:
+        """The fastest the train can go and still stop within a distance"""
+        return math.sqrt(2 * self.max_deceleration * max(0.0, distance))
@@ -0,0 +1,614 @@
+"""
+Array-backed storage for very large layouts
+
+A `PieceStore` holds pieces as NumPy columns (type code, state, placement, position and
+anchor connectivity) rather than as `Piece` objects each with a dict of `Anchor`
+objects. It is intended for layouts with tens of thousands of pieces that are loaded,
+positioned and drawn, but not edited piece-by-piece.
+
+Individual pieces can be accessed as lightweight `PieceView` flyweights, which support
+the parts of the `Piece` API needed to follow and draw track (including `TrackPoint`),
+and delegate traversals and drawing to a shared prototype piece per class and state.
+Use `to_layout()` to materialise a full `Layout` for editing.
+"""
+
+from __future__ import annotations
+
+import math
+from typing import (
+    Any,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    Type,
+    TYPE_CHECKING,
+)
+
+import numpy as np
+
+from letsgo.pieces import Piece, piece_classes
+from letsgo.track import Bounds, Position
+from letsgo.track_graph import TrackGraph
+
+if TYPE_CHECKING:
+    from cairo import Context
+    from letsgo.drawing_options import DrawingOptions
+    from letsgo.layout import Layout
+
+
+def _add_positions(positions: np.ndarray, others: np.ndarray) -> np.ndarray:
+    """Vectorised `Position.__add__` over (n, 3) arrays of (x, y, angle)"""
+    cos, sin = np.cos(positions[:, 2]), np.sin(positions[:, 2])
+    return np.stack(
+        [
+            positions[:, 0] + cos * others[:, 0] - sin * others[:, 1],
+            positions[:, 1] + sin * others[:, 0] + cos * others[:, 1],
+            (positions[:, 2] + others[:, 2]) % math.tau,
+        ],
+        axis=1,
+    )
+
+
+def _sub_positions(positions: np.ndarray, others: np.ndarray) -> np.ndarray:
+    """Vectorised `Position.__sub__` over (n, 3) arrays of (x, y, angle)"""
+    angle = (positions[:, 2] - others[:, 2] - math.pi) % math.tau
+    cos, sin = np.cos(angle), np.sin(angle)
+    return np.stack(
+        [
+            positions[:, 0] - cos * others[:, 0] + sin * others[:, 1],
+            positions[:, 1] - sin * others[:, 0] - cos * others[:, 1],
+            angle,
+        ],
+        axis=1,
+    )
+
+
+class PieceStore:
+    """Struct-of-arrays storage for track pieces.
+
+    Each piece is a row, identified by its index. Anchors are identified by their index
+    in the piece class' `anchor_names`, and connections are stored symmetrically in
+    `connected_pieces` and `connected_anchors`, with -1 meaning unconnected.
+    """
+
+    anchor_slots = 4
+
+    def __init__(self, capacity: int = 1024):
+        self._length = 0
+        self.ids: List[str] = []
+
+        self.type_codes = np.zeros(capacity, dtype=np.int16)
+        self.states = np.zeros(capacity, dtype=np.int8)
+        self.placements = np.full((capacity, 3), np.nan)
+        self.positions = np.full((capacity, 3), np.nan)
+        self.connected_pieces = np.full((capacity, self.anchor_slots), -1, np.int32)
+        self.connected_anchors = np.full((capacity, self.anchor_slots), -1, np.int8)
+
+        self.piece_classes: List[Type[Piece]] = []
+        self._type_codes: Dict[Type[Piece], int] = {}
+        self.state_values: List[Hashable] = []
+        self._state_codes: Dict[Hashable, int] = {}
+
+        self._default_states: Dict[int, Hashable] = {}
+        self._prototypes: Dict[Tuple[int, int], Piece] = {}
+        self._relative_positions: Optional[np.ndarray] = None
+        self._bounding_radii: Optional[np.ndarray] = None
+        self._indexes_by_id: Optional[Dict[str, int]] = None
+        self._topology_epoch = 0
+        self._track_graph: Optional[TrackGraph] = None
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the columns (excluding ids)"""
+        return sum(
+            column.nbytes
+            for column in (
+                self.type_codes,
+                self.states,
+                self.placements,
+                self.positions,
+                self.connected_pieces,
+                self.connected_anchors,
+            )
+        )
+
+    def _grow(self):
+        capacity = max(1024, 2 * len(self.type_codes))
+        for name, fill in (
+            ("type_codes", 0),
+            ("states", 0),
+            ("placements", np.nan),
+            ("positions", np.nan),
+            ("connected_pieces", -1),
+            ("connected_anchors", -1),
+        ):
+            column = getattr(self, name)
+            new_column = np.full((capacity,) + column.shape[1:], fill, column.dtype)
+            new_column[: self._length] = column[: self._length]
+            setattr(self, name, new_column)
+
+    # Type and state codes, and the prototype pieces they map to
+
+    def _type_code(self, piece_cls: Type[Piece]) -> int:
+        try:
+            return self._type_codes[piece_cls]
+        except KeyError:
+            if len(piece_cls.anchor_names) > self.anchor_slots:
+                raise ValueError(
+                    f"{piece_cls} has more than {self.anchor_slots} anchors"
+                )
+            self.piece_classes.append(piece_cls)
+            code = self._type_codes[piece_cls] = len(self.piece_classes) - 1
+            if piece_cls.state_attribute:
+                self._default_states[code] = getattr(
+                    piece_cls(layout=None), piece_cls.state_attribute
+                )
+            return code
+
+    def _state_code(self, state: Hashable) -> int:
+        try:
+            return self._state_codes[state]
+        except KeyError:
+            self.state_values.append(state)
+            code = self._state_codes[state] = len(self.state_values) - 1
+            return code
+
+    def _prototype(self, type_code: int, state_code: int) -> Piece:
+        try:
+            return self._prototypes[type_code, state_code]
+        except KeyError:
+            piece_cls = self.piece_classes[type_code]
+            kwargs: Dict[str, Any] = {}
+            if piece_cls.state_attribute:
+                kwargs[piece_cls.state_attribute] = self.state_values[state_code]
+            elif self.state_values[state_code] is not None:
+                raise ValueError(
+                    f"{piece_cls} has state, but doesn't define a state_attribute"
+                )
+            prototype = self._prototypes[type_code, state_code] = piece_cls(
+                layout=None, **kwargs
+            )
+            return prototype
+
+    def prototype(self, index: int) -> Piece:
+        """Returns the shared piece for the given row's class and state"""
+        return self._prototype(self.type_codes[index], self.states[index])
+
+    def _relative_positions_array(self) -> np.ndarray:
+        """Returns relative anchor positions, indexed by type code, state and anchor"""
+        if self._relative_positions is None:
+            relative_positions = np.full(
+                (len(self.piece_classes), len(self.state_values), self.anchor_slots, 3),
+                np.nan,
+            )
+            for (type_code, state_code), prototype in self._prototypes.items():
+                for i, anchor_name in enumerate(prototype.anchor_names):
+                    relative_positions[type_code, state_code, i] = tuple(
+                        prototype.relative_positions()[anchor_name]
+                    )
+            self._relative_positions = relative_positions
+        return self._relative_positions
+
+    def _bounding_radii_array(self) -> np.ndarray:
+        """Returns the distance from a piece's position to its furthest extent, indexed
+        by type code and state"""
+        if self._bounding_radii is None:
+            bounding_radii = np.zeros((len(self.piece_classes), len(self.state_values)))
+            for (type_code, state_code), prototype in self._prototypes.items():
+                bounds = prototype.bounds()
+                bounding_radii[type_code, state_code] = max(
+                    math.hypot(x, y)
+                    for x in (bounds.x, bounds.x + bounds.width)
+                    for y in (bounds.y, bounds.y + bounds.height)
+                )
+            self._bounding_radii = bounding_radii
+        return self._bounding_radii
+
+    # Building
+
+    def add(
+        self,
+        piece_cls: Type[Piece],
+        id: Optional[str] = None,
+        placement: Optional[Position] = None,
+        state: Hashable = None,
+    ) -> int:
+        """Adds a piece, returning its index"""
+        if self._length == len(self.type_codes):
+            self._grow()
+        index = self._length
+        type_code = self._type_code(piece_cls)
+        if state is None:
+            state = self._default_states.get(type_code)
+        state_code = self._state_code(state)
+        if (type_code, state_code) not in self._prototypes:
+            self._prototype(type_code, state_code)
+            self._relative_positions = self._bounding_radii = None
+        self.type_codes[index] = type_code
+        self.states[index] = state_code
+        if placement:
+            self.placements[index] = tuple(placement)
+        self.ids.append(id or str(index))
+        if self._indexes_by_id is not None:
+            self._indexes_by_id[self.ids[index]] = index
+        self._length += 1
+        self._topology_epoch += 1
+        return index
+
+    def connect(
+        self, index: int, anchor_name: str, other_index: int, other_anchor_name: str
+    ):
+        slot = self.piece_classes[self.type_codes[index]].anchor_names.index(
+            anchor_name
+        )
+        other_slot = self.piece_classes[
+            self.type_codes[other_index]
+        ].anchor_names.index(other_anchor_name)
+        if (
+            self.connected_pieces[index, slot] != -1
+            or self.connected_pieces[other_index, other_slot] != -1
+        ):
+            raise ValueError("Anchor already connected")
+        self.connected_pieces[index, slot] = other_index
+        self.connected_anchors[index, slot] = other_slot
+        self.connected_pieces[other_index, other_slot] = index
+        self.connected_anchors[other_index, other_slot] = slot
+        self._topology_epoch += 1
+
+    def disconnect(self, index: int, anchor_name: str):
+        slot = self.piece_classes[self.type_codes[index]].anchor_names.index(
+            anchor_name
+        )
+        other_index = self.connected_pieces[index, slot]
+        if other_index != -1:
+            other_slot = self.connected_anchors[index, slot]
+            self.connected_pieces[other_index, other_slot] = -1
+            self.connected_anchors[other_index, other_slot] = -1
+            self.connected_pieces[index, slot] = -1
+            self.connected_anchors[index, slot] = -1
+            self._topology_epoch += 1
+
+    # Access
+
+    def __getitem__(self, index: int) -> PieceView:
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return PieceView(self, index)
+
+    def __iter__(self) -> Iterator[PieceView]:
+        for index in range(len(self)):
+            yield PieceView(self, index)
+
+    def get(self, id: str) -> Optional[PieceView]:
+        if self._indexes_by_id is None:
+            self._indexes_by_id = {id: index for index, id in enumerate(self.ids)}
+        index = self._indexes_by_id.get(id)
+        return None if index is None else PieceView(self, index)
+
+    @property
+    def track_graph(self) -> TrackGraph:
+        """A compiled graph of the track, recompiled whenever the topology changes"""
+        if self._track_graph is None or self._track_graph.epoch != self._topology_epoch:
+            # Views stand in for pieces
+            self._track_graph = TrackGraph(
+                iter(self), epoch=self._topology_epoch  # type: ignore
+            )
+        return self._track_graph
+
+    # Geometry
+
+    def update_positions(self):
+        """Propagates positions out from placed pieces along connections.
+
+        This is a breadth-first search from all placed pieces at once, with each step
+        computed for the whole frontier in one go. Where a connected subset has more
+        than one placed piece, each piece takes its position from the nearest.
+        """
+        length = len(self)
+        positions = self.positions[:length]
+        positions[:] = np.nan
+        type_codes, states = self.type_codes[:length], self.states[:length]
+        relative_positions = self._relative_positions_array()
+
+        frontier = np.flatnonzero(~np.isnan(self.placements[:length, 0]))
+        positions[frontier] = self.placements[frontier]
+        seen = np.zeros(length, dtype=bool)
+        seen[frontier] = True
+
+        while frontier.size:
+            next_frontier = []
+            for slot in range(self.anchor_slots):
+                neighbours = self.connected_pieces[frontier, slot]
+                rows = frontier[neighbours != -1]
+                neighbours = neighbours[neighbours != -1]
+                unseen = ~seen[neighbours]
+                rows, neighbours = rows[unseen], neighbours[unseen]
+                if not rows.size:
+                    continue
+                # Two rows in the frontier may lead to the same piece
+                neighbours, first = np.unique(neighbours, return_index=True)
+                rows = rows[first]
+                own_anchors = relative_positions[type_codes[rows], states[rows], slot]
+                their_anchors = relative_positions[
+                    type_codes[neighbours],
+                    states[neighbours],
+                    self.connected_anchors[rows, slot],
+                ]
+                positions[neighbours] = _add_positions(
+                    positions[rows], _sub_positions(own_anchors, their_anchors)
+                )
+                seen[neighbours] = True
+                next_frontier.append(neighbours)
+            frontier = (
+                np.concatenate(next_frontier)
+                if next_frontier
+                else np.empty(0, dtype=np.intp)
+            )
+
+    def intersect(self, bbox: Tuple[float, float, float, float]) -> np.ndarray:
+        """Returns the indexes of positioned pieces that may intersect a bounding box"""
+        minx, miny, maxx, maxy = bbox
+        positions = self.positions[: len(self)]
+        radii = self._bounding_radii_array()[
+            self.type_codes[: len(self)], self.states[: len(self)]
+        ]
+        with np.errstate(invalid="ignore"):
+            return np.flatnonzero(
+                (positions[:, 0] + radii >= minx)
+                & (positions[:, 0] - radii <= maxx)
+                & (positions[:, 1] + radii >= miny)
+                & (positions[:, 1] - radii <= maxy)
+            )
+
+    # Rendering
+
+    def draw(
+        self,
+        cr: Context,
+        drawing_options: DrawingOptions,
+        bbox: Optional[Tuple[float, float, float, float]] = None,
+    ):
+        """Draws all positioned pieces, or those that may intersect `bbox`"""
+        if bbox:
+            indexes = self.intersect(bbox)
+        else:
+            indexes = np.flatnonzero(~np.isnan(self.positions[: len(self), 0]))
+        for index in indexes:
+            x, y, angle = self.positions[index]
+            cr.save()
+            cr.translate(x, y)
+            cr.rotate(angle)
+            self.prototype(index).draw(cr, drawing_options)
+            cr.restore()
+
+    # Conversion
+
+    @classmethod
+    def from_yaml(cls, pieces_data: Iterable[dict]) -> PieceStore:
+        """Builds a store from the `pieces` section of a Let's Go! layout file"""
+        store = cls()
+        anchors: Dict[str, Tuple[int, str]] = {}
+        for piece_data in pieces_data:
+            try:
+                piece_cls = piece_classes[piece_data["type"]]
+            except KeyError as e:
+                raise ValueError(
+                    f"Couldn't find piece type {piece_data['type']}"
+                ) from e
+            state = None
+            if piece_cls.state_attribute and piece_cls.state_attribute in piece_data:
+                state = piece_cls.cast_yaml_data(
+                    None,
+                    **{
+                        piece_cls.state_attribute: piece_data[piece_cls.state_attribute]
+                    },
+                )[piece_cls.state_attribute]
+            placement = piece_data.get("placement")
+            index = store.add(
+                piece_cls,
+                id=piece_data.get("id"),
+                placement=Position(**placement) if placement else None,
+                state=state,
+            )
+            for anchor_name, anchor_id in piece_data.get("anchors", {}).items():
+                if anchor_id in anchors:
+                    store.connect(*anchors.pop(anchor_id), index, anchor_name)
+                else:
+                    anchors[anchor_id] = index, anchor_name
+        store.update_positions()
+        return store
+
+    @classmethod
+    def from_layout(cls, layout: Layout) -> PieceStore:
+        store = cls()
+        indexes: Dict[Piece, int] = {}
+        for piece in layout.pieces.values():
+            indexes[piece] = store.add(
+                type(piece),
+                id=piece.id,
+                placement=piece.placement,
+                state=piece._table_key(),
+            )
+        for piece, index in indexes.items():
+            for anchor_name, anchor in piece.anchors.items():
+                next_piece, next_anchor_name = anchor.next(piece)
+                if next_piece and indexes[next_piece] > index:
+                    store.connect(
+                        index, anchor_name, indexes[next_piece], next_anchor_name
+                    )
+        store.update_positions()
+        return store
+
+    def to_layout(self, layout: Layout):
+        """Adds full `Piece` objects for every row to a layout, e.g. for editing"""
+        pieces: List[Piece] = []
+        for index in range(len(self)):
+            piece_cls = self.piece_classes[self.type_codes[index]]
+            kwargs: Dict[str, Any] = {}
+            if piece_cls.state_attribute:
+                kwargs[piece_cls.state_attribute] = self.state_values[
+                    self.states[index]
+                ]
+            placement = self.placements[index]
+            piece = piece_cls(
+                layout=layout,
+                id=self.ids[index],
+                placement=None if np.isnan(placement[0]) else Position(*placement),
+                **kwargs,
+            )
+            layout.add_piece(piece, announce=False)
+            pieces.append(piece)
+        for index, piece in enumerate(pieces):
+            for slot, anchor_name in enumerate(piece.anchor_names):
+                other_index = self.connected_pieces[index, slot]
+                if other_index > index:
+                    other_piece = pieces[other_index]
+                    other_anchor_name = other_piece.anchor_names[
+                        self.connected_anchors[index, slot]
+                    ]
+                    piece.anchors[anchor_name] += other_piece.anchors[other_anchor_name]
+        layout.changed()
+
+
+class AnchorView:
+    """A flyweight view of one anchor of a piece in a `PieceStore`"""
+
+    __slots__ = ("store", "index", "slot")
+
+    def __init__(self, store: PieceStore, index: int, slot: int):
+        self.store, self.index, self.slot = store, index, slot
+
+    def __len__(self):
+        return 2 if self.store.connected_pieces[self.index, self.slot] != -1 else 1
+
+    @property
+    def position(self) -> Optional[Position]:
+        piece = PieceView(self.store, self.index)
+        return (
+            piece.position + piece.relative_positions()[piece.anchor_names[self.slot]]
+        )
+
+    def next(self, piece: PieceView) -> Tuple[Optional[PieceView], Optional[str]]:
+        """Return the piece other than `piece` connected at this anchor"""
+        store = self.store
+        other_index = store.connected_pieces[self.index, self.slot]
+        if other_index == -1:
+            return None, None
+        other_piece = PieceView(store, int(other_index))
+        return (
+            other_piece,
+            other_piece.anchor_names[store.connected_anchors[self.index, self.slot]],
+        )
+
+    def __eq__(self, other):
+        return isinstance(other, AnchorView) and (
+            self.store,
+            self.index,
+            self.slot,
+        ) == (other.store, other.index, other.slot)
+
+    def __hash__(self):
+        return hash((id(self.store), self.index, self.slot))
+
+
+class _AnchorViews(Mapping[str, AnchorView]):
+    __slots__ = ("piece",)
+
+    def __init__(self, piece: PieceView):
+        self.piece = piece
+
+    def __getitem__(self, anchor_name: str) -> AnchorView:
+        piece = self.piece
+        return AnchorView(
+            piece.store, piece.index, piece.anchor_names.index(anchor_name)
+        )
+
+    def __iter__(self):
+        return iter(self.piece.anchor_names)
+
+    def __len__(self):
+        return len(self.piece.anchor_names)
+
+
+class PieceView:
+    """A flyweight view of a piece in a `PieceStore`, with a read-only `Piece` API"""
+
+    __slots__ = ("store", "index")
+
+    def __init__(self, store: PieceStore, index: int):
+        self.store, self.index = store, index
+
+    @property
+    def prototype(self) -> Piece:
+        return self.store.prototype(self.index)
+
+    @property
+    def piece_class(self) -> Type[Piece]:
+        return self.store.piece_classes[self.store.type_codes[self.index]]
+
+    @property
+    def id(self) -> str:
+        return self.store.ids[self.index]
+
+    @property
+    def anchor_names(self) -> Tuple[str, ...]:
+        return self.piece_class.anchor_names
+
+    @property
+    def anchors(self) -> Mapping[str, AnchorView]:
+        return _AnchorViews(self)
+
+    @property
+    def state(self) -> Hashable:
+        return self.store.state_values[self.store.states[self.index]]
+
+    @property
+    def placement(self) -> Optional[Position]:
+        x, y, angle = self.store.placements[self.index]
+        return None if math.isnan(x) else Position(x, y, angle)
+
+    @property
+    def position(self) -> Optional[Position]:
+        x, y, angle = self.store.positions[self.index]
+        return None if math.isnan(x) else Position(x, y, angle)
+
+    def traversals(self, anchor_from: str):
+        return self.prototype.traversals(anchor_from)
+
+    def available_traversal(self, in_anchor: str):
+        return self.prototype.available_traversal(in_anchor)
+
+    def relative_positions(self):
+        return self.prototype.relative_positions()
+
+    def point_position(
+        self, in_anchor: str, offset: float, out_anchor: Optional[str] = None
+    ):
+        return self.prototype.point_position(in_anchor, offset, out_anchor)
+
+    def bounds(self) -> Bounds:
+        return self.prototype.bounds()
+
+    def draw(self, cr: Context, drawing_options: DrawingOptions):
+        self.prototype.draw(cr, drawing_options)
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, PieceView)
+            and self.store is other.store
+            and self.index == other.index
+        )
+
+    def __hash__(self):
+        return hash((id(self.store), self.index))
+
+    def __repr__(self):
+        return f"<PieceView {self.piece_class.__name__} {self.id}>"
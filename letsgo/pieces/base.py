@@ -1,6 +1,7 @@
 from __future__ import annotations
 
-from typing import Dict, Iterable, Optional, Tuple, TYPE_CHECKING
+from types import MappingProxyType
+from typing import Dict, Hashable, Iterable, Mapping, Optional, Tuple, TYPE_CHECKING
 
 
 import cairo
@@ -19,6 +20,8 @@ if TYPE_CHECKING:
 
 from letsgo.track import Anchor, Bounds, Position
 
+Traversals = Mapping[str, Tuple[float, bool]]
+
 
 class Piece(WithRegistry):
     """Base class for all track pieces.
@@ -31,12 +34,20 @@ class Piece(WithRegistry):
     anchor_names: Tuple[str, ...]
     layout_priority = float("inf")
 
+    _tables: Dict[Hashable, Tuple[Mapping, Mapping, Mapping]]
+    """Per-class cache of traversal and relative position tables, keyed by `_table_key()`"""
+
     def __init__(
         self, placement: Position = None, anchors: Dict[str, str] = None, **kwargs
     ):
         super().__init__(**kwargs)
         anchors = anchors or {}
 
+        self._traversals: Mapping[str, Traversals]
+        self._available_traversals: Mapping[str, Optional[Tuple[str, float]]]
+        self._relative_positions: Mapping[str, Position]
+        self._update_tables()
+
         self.anchors: Dict[str, Anchor] = {
             anchor_name: Anchor({self: anchor_name}, id=anchors.get(anchor_name))
             for anchor_name in self.anchor_names
@@ -50,7 +61,7 @@ class Piece(WithRegistry):
         self._position: Optional[Position] = None
         self.position = placement
 
-        self.claimed_by = None
+        self.claimed_by: Optional[Train] = None
         self.reservations: Dict[Train, Dict] = {}
 
     @property
@@ -77,9 +88,9 @@ class Piece(WithRegistry):
     def position(self, value: Optional[Position]):
         old_value = self._position
         self._position = value
-        relative_positions = self.relative_positions()
+        relative_positions = self._relative_positions
         for anchor_name, anchor in self.anchors.items():
-            anchor.position = self.position + relative_positions[anchor_name]
+            anchor.position = value + relative_positions[anchor_name]
 
         if value != old_value and self.layout:
             signals.piece_positioned.send(self)
@@ -123,9 +134,71 @@ class Piece(WithRegistry):
                     stack.append((next_piece, next_position))
                     seen_pieces.add(next_piece)
 
-    def relative_positions(self) -> Dict[str, Position]:
+    state_attribute: Optional[str] = None
+    """The attribute (and constructor argument) holding any per-instance state that
+    traversals and geometry depend on, e.g. curve direction or points state.
+
+    Subclasses that set this should call `_update_tables()` whenever that state
+    changes."""
+
+    def _table_key(self) -> Hashable:
+        """Returns the instance state that traversals and relative positions depend on."""
+        return getattr(self, self.state_attribute) if self.state_attribute else None
+
+    def _update_tables(self):
+        """Points this piece at the precomputed tables for its class and current state.
+
+        Tables are built once per class and `_table_key()`, and are shared between all
+        instances in the same state.
+        """
+        cls = type(self)
+        # Look in the class' own namespace, so that subclasses don't share tables
+        tables = cls.__dict__.get("_tables")
+        if tables is None:
+            tables = cls._tables = {}
+        key = self._table_key()
+        try:
+            table = tables[key]
+        except KeyError:
+            traversals = {
+                anchor_name: MappingProxyType(dict(self._build_traversals(anchor_name)))
+                for anchor_name in self.anchor_names
+            }
+            available_traversals = {
+                anchor_name: next(
+                    (
+                        (out_anchor, distance)
+                        for out_anchor, (distance, available) in traversals[
+                            anchor_name
+                        ].items()
+                        if available
+                    ),
+                    None,
+                )
+                for anchor_name in self.anchor_names
+            }
+            table = tables[key] = (
+                MappingProxyType(traversals),
+                MappingProxyType(available_traversals),
+                MappingProxyType(self._build_relative_positions()),
+            )
+        (
+            self._traversals,
+            self._available_traversals,
+            self._relative_positions,
+        ) = table
+
+    def relative_positions(self) -> Mapping[str, Position]:
         """Returns a mapping from anchor name to that anchor's relative position.
 
+        The returned mapping is shared and must not be modified. See
+        `_build_relative_positions()` for how it is constructed.
+        """
+        return self._relative_positions
+
+    def _build_relative_positions(self) -> Dict[str, Position]:
+        """Builds a mapping from anchor name to that anchor's relative position.
+
         The base implementation provides a relative position for the first anchor,
         which should always be backwards out from the piece position (i.e. x=0, y=0,
         theta=pi).
@@ -133,25 +206,29 @@ class Piece(WithRegistry):
         Subclasses should override and extend this method to provide relative positions
         for other anchors. e.g., for a hypothetical 90° 40R curve piece:
 
-        >>> def relative_positions(self):
+        >>> def _build_relative_positions(self):
         >>>     return {
-        >>>         **super().relative_positions(),
+        >>>         **super()._build_relative_positions(),
         >>>         'out': Position(40, -40, math.pi / 2),
         >>>     }
 
-        This method is used when calculating positions for connected pieces, starting
-        from the placement origin (i.e. the piece in a connected subset which has
-        `self.placement` set).
+        This is called once per class and `_table_key()`, and the result is used when
+        calculating positions for connected pieces, starting from the placement origin
+        (i.e. the piece in a connected subset which has `self.placement` set).
         """
         return {self.anchor_names[0]: Position(0, 0, math.pi)}
 
-    def traversals(self, anchor_from: str) -> Dict[str, Tuple[float, bool]]:
+    def traversals(self, anchor_from: str) -> Traversals:
+        """Returns a mapping from out anchor name to (distance, available) tuples.
+
+        The returned mapping is shared and must not be modified."""
+        return self._traversals[anchor_from]
+
+    def _build_traversals(self, anchor_from: str) -> Dict[str, Tuple[float, bool]]:
         raise NotImplementedError
 
     def available_traversal(self, in_anchor) -> Optional[Tuple[str, float]]:
-        for out_anchor, (distance, available) in self.traversals(in_anchor).items():
-            if available:
-                return out_anchor, distance
+        return self._available_traversals[in_anchor]
 
     def bounds(self) -> Bounds:
         raise NotImplementedError
@@ -160,7 +237,7 @@ class Piece(WithRegistry):
         raise NotImplementedError
 
     def point_position(
-        self, in_anchor: str, offset: float, out_anchor: str = None
+        self, in_anchor: str, offset: float, out_anchor: Optional[str] = None
     ) -> Position:
         raise NotImplementedError
 
@@ -12,7 +12,7 @@ class BaseCrossover(Piece):
     length: float
     label: str
 
-    def traversals(self, anchor_from):
+    def _build_traversals(self, anchor_from):
         return {
             self.anchor_names[3 - self.anchor_names.index(anchor_from)]: (
                 self.length,
@@ -51,9 +51,9 @@ class BaseCrossover(Piece):
         cr.line_to(self.length / 2 + 2.5, self.length / 2)
         cr.stroke()
 
-    def relative_positions(self):
+    def _build_relative_positions(self):
         return {
-            **super().relative_positions(),
+            **super()._build_relative_positions(),
             "out": Position(self.length, 0, 0),
             "left": Position(self.length / 2, -self.length / 2, -math.pi / 2),
             "right": Position(self.length / 2, self.length / 2, math.pi / 2),
@@ -20,17 +20,26 @@ class CurveDirection(enum.Enum):
 class BaseCurve(FlippablePiece):
     anchor_names = ("in", "out")
     layout_priority = 20
+    state_attribute = "direction"
 
     radius: float
     per_circle: float
     sleepers: int
-    direction: CurveDirection
 
     def __init__(self, direction: CurveDirection = CurveDirection.left, **kwargs):
-        self.direction = direction
+        self._direction = direction
         super().__init__(**kwargs)
 
-    def traversals(self, anchor_from):
+    @property
+    def direction(self) -> CurveDirection:
+        return self._direction
+
+    @direction.setter
+    def direction(self, value: CurveDirection):
+        self._direction = value
+        self._update_tables()
+
+    def _build_traversals(self, anchor_from):
         return {
             "out"
             if anchor_from == "in"
@@ -105,14 +114,14 @@ class BaseCurve(FlippablePiece):
 
         cr.restore()
 
-    def relative_positions(self):
+    def _build_relative_positions(self):
         rotate = math.tau / self.per_circle
         x = (cmath.rect(self.radius, rotate) - self.radius) * cmath.rect(
             1, -math.pi / 2
         )
         flip = -1 if self.direction == CurveDirection.left else 1
         return {
-            **super().relative_positions(),
+            **super()._build_relative_positions(),
             "out": Position(x.real, x.imag * flip, rotate * flip),
         }
 
@@ -1,11 +1,12 @@
 from __future__ import annotations
 
-from typing import Dict, Type
+from typing import Dict, List, Tuple, Type
 
 import cairo
 import cmath
 import math
 
+from letsgo import signals
 from letsgo.drawing_options import DrawingOptions
 from .base import FlippablePiece, Piece
 from letsgo.track import Anchor, Bounds, Position
@@ -27,20 +28,50 @@ def _distance(xy1, xy2):
 class BasePoints(FlippablePiece):
     anchor_names = ("in", "out", "branch")
     layout_priority = 30
+    state_attribute = "state"
+
+    direction: str
+
+    # Branch geometry, computed once per class by `_build_branch_geometry()`
+    branch_point: Tuple[float, float]
+    control_points: List[Tuple[float, float]]
+    branch_length: float
+    intermediate_branch_t: List[float]
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if "direction" in cls.__dict__:
+            cls._build_branch_geometry()
 
     def __init__(self, state: str = "out", **kwargs):
-        self.state = state
+        self._state = state
+        super().__init__(**kwargs)
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    @state.setter
+    def state(self, value: str):
+        if value != self._state:
+            self._state = value
+            self._update_tables()
+            signals.points_state_changed.send(self, state=value)
+
+    @classmethod
+    def _build_branch_geometry(cls):
+        coordinate_sign = -1 if cls.direction == "left" else 1
 
         branch_point = cmath.rect(40, math.tau * 5 / 16) + 48 - 24j
-        self.branch_point = branch_point.real, branch_point.imag * self.coordinate_sign
+        cls.branch_point = branch_point.real, branch_point.imag * coordinate_sign
 
         # Bezier curve control points for the branch
-        self.control_points = [
+        cls.control_points = [
             (16, 0),
             (
-                self.branch_point[0] - math.sin(math.tau * 5 / 16) * 16,
-                self.branch_point[1]
-                + (math.cos(math.tau * 5 / 16) * 16) * self.coordinate_sign,
+                cls.branch_point[0] - math.sin(math.tau * 5 / 16) * 16,
+                cls.branch_point[1]
+                + (math.cos(math.tau * 5 / 16) * 16) * coordinate_sign,
             ),
         ]
 
@@ -49,31 +80,28 @@ class BasePoints(FlippablePiece):
         branch_length = 0
         for i in range(1, intermediate_branch_point_count + 1):
             branch_length += _distance(
-                self.branch_bezier(i / intermediate_branch_point_count),
-                self.branch_bezier((i + 1) / intermediate_branch_point_count),
+                cls.branch_bezier(i / intermediate_branch_point_count),
+                cls.branch_bezier((i + 1) / intermediate_branch_point_count),
             )
             intermediate_branch_lengths.append(branch_length)
 
-        self.branch_length = branch_length
+        cls.branch_length = branch_length
 
-        self.intermediate_branch_t = [0.0]
+        cls.intermediate_branch_t = [0.0]
         for i in range(1, intermediate_branch_point_count):
             t = i / intermediate_branch_point_count
-            x, y = intermediate_branch_lengths[i - 1 : i + 1]
             if (
                 intermediate_branch_lengths[i - 1]
-                < self.branch_length * len(self.intermediate_branch_t) / 100
+                < cls.branch_length * len(cls.intermediate_branch_t) / 100
                 <= intermediate_branch_lengths[i]
             ):
-                self.intermediate_branch_t.append(t)
-
-        super().__init__(**kwargs)
+                cls.intermediate_branch_t.append(t)
 
-    def branch_bezier(self, t):
-        return _bezier(*self.control_points, self.branch_point, t)
+    @classmethod
+    def branch_bezier(cls, t):
+        return _bezier(*cls.control_points, cls.branch_point, t)
 
-    def traversals(self, anchor_from):
-        traversals = {}
+    def _build_traversals(self, anchor_from):
         if anchor_from == "in":
             return {
                 "out": (32, self.state == "out"),
@@ -224,9 +252,9 @@ class BasePoints(FlippablePiece):
         else:
             raise AssertionError
 
-    def relative_positions(self):
+    def _build_relative_positions(self):
         return {
-            **super().relative_positions(),
+            **super()._build_relative_positions(),
             "out": Position(32, 0, 0),
             "branch": Position(
                 *self.branch_point, math.tau / 16 * self.coordinate_sign
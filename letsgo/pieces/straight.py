@@ -15,7 +15,7 @@ class BaseStraight(Piece):
     label: str
     length: float
 
-    def traversals(self, anchor_from):
+    def _build_traversals(self, anchor_from):
         return {"out" if anchor_from == "in" else "in": (self.length, True)}
 
     # Drawing
@@ -49,9 +49,9 @@ class BaseStraight(Piece):
         cr.line_to(self.length, 2.5)
         cr.stroke()
 
-    def relative_positions(self):
+    def _build_relative_positions(self):
         return {
-            **super().relative_positions(),
+            **super()._build_relative_positions(),
             "out": Position(self.length, 0, 0),
         }
 
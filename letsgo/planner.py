@@ -0,0 +1,460 @@
+"""
+Plans routes for all trains at once, so that they don't get in each other's way
+
+`letsgo.routeing.Router` plans for one train at a time, oblivious to any others. The
+cooperative planner instead plans every train towards its next stop in turn, in order of
+priority, reserving the blocks each will occupy and when in the layout's reservation
+table (see `letsgo.reservations`), so that trains planned later route around them, in
+time as well as in space. This is windowed cooperative A*:
+
+* The search is over a time-expanded graph, of where a train's front is on the track
+  graph and when it gets there. At the end of each segment a train can choose which way
+  to go through points, and can wait before setting off along the next, for as long as
+  the blocks it is on stay free.
+* Other trains' reservations are only considered within a window of time, and only that
+  much of each plan is reserved. Plans are expected to be made again well before the
+  window runs out.
+* Trains that can't be planned for hold their positions, and any plans that relied on
+  them moving off are made again. They're moved to the front of the queue next time.
+* Each replan is limited in how long it can take, and how many states it can explore
+  for each train. Trains not planned within that hold their positions.
+"""
+
+from __future__ import annotations
+
+import heapq
+import itertools
+import logging
+import math
+import time as _time
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple, TYPE_CHECKING
+
+from letsgo.reservations import path_blocks
+from letsgo.track_graph import Segment
+from letsgo.track_point import EndOfTheLine
+
+if TYPE_CHECKING:
+    from letsgo.layout import Layout
+    from letsgo.pieces import Piece
+    from letsgo.reservations import Interval
+    from letsgo.train import Train
+
+__all__ = ["CooperativePlanner", "Plan"]
+
+logger = logging.getLogger(__name__)
+
+Goal = Tuple[Segment, float]
+
+
+class Plan(NamedTuple):
+    train: Train
+    segments: List[Segment]
+    """From the segment the train's front is on to the one its destination is on"""
+    departures: List[float]
+    """When the train's front should set off along each segment, having waited if need
+    be"""
+    arrival: float
+    """When the train is expected to reach its destination"""
+    destination: Goal
+
+
+class _Node:
+    """Where a train's front has got to on the way, and when"""
+
+    __slots__ = (
+        "segment",
+        "offset",
+        "arrival",
+        "trailing",
+        "parent",
+        "departure",
+        "intervals",
+        "goal",
+    )
+
+    def __init__(
+        self,
+        segment: Segment,
+        offset: float,
+        arrival: float,
+        trailing: List[Tuple[Piece, float]],
+        parent: Optional[_Node] = None,
+        departure: Optional[float] = None,
+        intervals: Sequence[Interval] = (),
+        goal: bool = False,
+    ):
+        self.segment = segment
+        self.offset = offset
+        self.arrival = arrival
+        self.trailing = trailing
+        """Blocks the train is still on, and where they end relative to its front"""
+        self.parent = parent
+        self.departure = departure
+        """When the train left the parent node"""
+        self.intervals = intervals
+        """The blocks the train occupies on the way from the parent, and when"""
+        self.goal = goal
+
+
+class CooperativePlanner:
+    window = 30.0
+    """How far ahead, in seconds, to avoid other trains and reserve blocks"""
+
+    budget = 0.05
+    """How long, in seconds, each replan can take"""
+
+    max_expansions = 2000
+    """How many states to explore for each train, at most"""
+
+    resolution = 0.5
+    """States of the same segment closer together in time than this, in seconds, are
+    treated as the same"""
+
+    motor_speed = 0.5
+    """The motor speed trains are planned to go at"""
+
+    max_waits = 20
+    """How many times to put off setting off, to let other trains by, before giving up"""
+
+    def __init__(self, layout: Layout):
+        self.layout = layout
+        self.priorities: List[Train] = []
+        """Trains in the order they're planned for, first first"""
+        self.plans: Dict[Train, Plan] = {}
+
+    def plan(self, now: float) -> Dict[Train, Plan]:
+        """Plans every train with somewhere to go, replacing earlier plans"""
+        table = self.layout.reservation_table
+        deadline = _time.monotonic() + self.budget
+        horizon = now + self.window
+
+        trains = list(self.layout.trains.values())
+        self.priorities = [train for train in self.priorities if train in trains] + [
+            train for train in trains if train not in self.priorities
+        ]
+        for train in trains:
+            table.release(train)
+        table.expire(now)
+
+        goals = {train: self.goals(train) for train in trains}
+        for train in trains:
+            if goals[train]:
+                # Others can't go through it before it's had a chance to move off
+                table.reserve(train, self._holding(train, now))
+            else:
+                # Trains with nowhere to go stay where they are
+                table.reserve(train, self._holding(train, now, math.inf))
+
+        plans: Dict[Train, Plan] = {}
+        failed: List[Train] = []
+        queue = [train for train in self.priorities if goals[train]]
+        while queue:
+            train = queue.pop(0)
+            plan = None
+            if _time.monotonic() < deadline:
+                plan = self._plan_train(train, goals[train], now, horizon, deadline)
+            if plan is not None:
+                plans[train] = plan
+                continue
+            failed.append(train)
+            # It stays where it is, so plans that assumed it would move off are void
+            table.release(train)
+            holding = self._holding(train, now, math.inf)
+            displaced = {conflict.train for conflict in table.reserve(train, holding)}
+            for other in displaced & set(plans):
+                del plans[other]
+                table.release(other)
+                table.reserve(other, self._holding(other, now))
+            conflicts = table.reserve(train, holding)
+            if conflicts:
+                logger.warning(
+                    "Train %s can't hold its blocks, which trains %s also occupy",
+                    train.id,
+                    ", ".join(sorted({conflict.train.id for conflict in conflicts})),
+                )
+            queue = [
+                other
+                for other in self.priorities
+                if other in queue or (other in displaced and other not in failed)
+            ]
+
+        # Those that couldn't be planned for go first next time
+        self.priorities = failed + [
+            train for train in self.priorities if train not in failed
+        ]
+        self.plans = plans
+        return plans
+
+    def goals(self, train: Train) -> List[Goal]:
+        """Where a train's front could stop at its next stop, at any of the platforms
+        there, and facing either way"""
+        itinerary, index = train.itinerary, train.itinerary_index
+        if itinerary is None or index is None or index >= len(itinerary.stops):
+            return []
+        graph = self.layout.track_graph
+        goals = []
+        for platform in itinerary.stops[index].station.available_platforms(train):
+            for track_point in (platform.position, platform.position.reversed()):
+                try:
+                    goals.append(graph.locate(track_point))
+                except (EndOfTheLine, KeyError):
+                    continue
+        return goals
+
+    def speed(self, train: Train) -> float:
+        """How fast, in studs per second, a train is planned to go"""
+        return train.speed_estimation.predict(motor_speed=self.motor_speed)
+
+    def _holding(
+        self, train: Train, now: float, until: Optional[float] = None
+    ) -> List[Interval]:
+        """The blocks a train is on, until a time, or by default until it could have
+        cleared them"""
+        extent = self.layout.occupancy.extent(train)
+        if extent is None:
+            return []
+        path, rear_offset, _ = extent
+        speed = self.speed(train)
+        return [
+            (piece, now, until if until is not None else now + leave / speed)
+            if speed
+            else (piece, now, math.inf if until is None else until)
+            for piece, _, leave in path_blocks(
+                (path[0], rear_offset), path[1:], train.length
+            )
+        ]
+
+    @staticmethod
+    def _distances_to(goals: List[Goal]) -> Dict[Segment, float]:
+        """How far it is from the start of each segment to the nearest goal"""
+        distances: Dict[Segment, float] = {}
+        for segment, offset in goals:
+            distances[segment] = min(offset, distances.get(segment, math.inf))
+        queue = [
+            (distance, segment.index, segment)
+            for segment, distance in distances.items()
+        ]
+        heapq.heapify(queue)
+        while queue:
+            distance, _, segment = heapq.heappop(queue)
+            if distance > distances[segment]:
+                continue
+            for predecessor in segment.predecessors:
+                candidate = predecessor.length + distance
+                if candidate < distances.get(predecessor, math.inf):
+                    distances[predecessor] = candidate
+                    heapq.heappush(queue, (candidate, predecessor.index, predecessor))
+        return distances
+
+    def _plan_train(
+        self,
+        train: Train,
+        goals: List[Goal],
+        now: float,
+        horizon: float,
+        deadline: float,
+    ) -> Optional[Plan]:
+        speed = self.speed(train)
+        extent = self.layout.occupancy.extent(train)
+        if not speed or extent is None:
+            return None
+        path, rear_offset, front_offset = extent
+        length = train.length
+        distances = self._distances_to(goals)
+
+        def heuristic(segment: Segment, offset: float) -> float:
+            distance = min(
+                [
+                    goal_offset - offset
+                    for goal_segment, goal_offset in goals
+                    if goal_segment is segment and goal_offset >= offset
+                ]
+                + [
+                    segment.length - offset + distances[successor]
+                    for successor in segment.successors
+                    if successor in distances
+                ],
+                default=math.inf,
+            )
+            return distance / speed
+
+        # The blocks the train is on to start with
+        trailing = [
+            (piece, leave - length)
+            for piece, _, leave in path_blocks((path[0], rear_offset), path[1:], length)
+        ]
+        start = _Node(path[-1], front_offset, now, trailing)
+        counter = itertools.count()
+        queue = [(now + heuristic(start.segment, start.offset), next(counter), start)]
+        closed = set()
+        expansions = 0
+
+        while queue:
+            if expansions >= self.max_expansions or _time.monotonic() > deadline:
+                return None
+            _, _, node = heapq.heappop(queue)
+            if node.goal:
+                return self._finish(train, node, horizon)
+            key = (
+                node.segment.index,
+                round(node.offset),
+                round(node.arrival / self.resolution),
+            )
+            if key in closed:
+                continue
+            closed.add(key)
+            expansions += 1
+
+            # Stop at a goal along this segment
+            for goal_segment, goal_offset in goals:
+                if goal_segment is node.segment and goal_offset >= node.offset:
+                    child = self._advance(
+                        train, speed, node, goal_offset, horizon, stopping=True
+                    )
+                    if child:
+                        child.goal = True
+                        heapq.heappush(queue, (child.arrival, next(counter), child))
+
+            # Or carry on to the end of it, and whichever way from there
+            if not node.segment.successors:
+                continue
+            child = self._advance(train, speed, node, node.segment.length, horizon)
+            if child is None:
+                continue
+            for successor in node.segment.successors:
+                estimate = heuristic(successor, 0.0)
+                if estimate == math.inf:
+                    continue
+                successor_node = _Node(
+                    successor,
+                    0.0,
+                    child.arrival,
+                    child.trailing,
+                    parent=node,
+                    departure=child.departure,
+                    intervals=child.intervals,
+                )
+                heapq.heappush(
+                    queue, (child.arrival + estimate, next(counter), successor_node)
+                )
+        return None
+
+    def _advance(
+        self,
+        train: Train,
+        speed: float,
+        node: _Node,
+        offset: float,
+        horizon: float,
+        stopping: bool = False,
+    ) -> Optional[_Node]:
+        """Moves a train's front along its segment as soon as it can, after waiting
+        for other trains to clear the blocks ahead if need be
+
+        If the train is stopping there, it holds the blocks it ends up on.
+        """
+        table = self.layout.reservation_table
+        length = train.length
+        travel = offset - node.offset
+        ahead = list(path_blocks((node.segment, node.offset), (), travel))
+
+        def intervals(departure: float) -> List[Interval]:
+            result = []
+            for piece, enter, leave in ahead:
+                still_on = stopping and leave + length > travel
+                result.append(
+                    (
+                        piece,
+                        departure + max(0.0, enter) / speed,
+                        math.inf if still_on else departure + (leave + length) / speed,
+                    )
+                )
+            return result
+
+        def waiting(departure: float) -> List[Interval]:
+            result = []
+            for piece, leave in node.trailing:
+                still_on = stopping and leave + length > travel
+                result.append(
+                    (
+                        piece,
+                        node.arrival,
+                        math.inf if still_on else departure + (leave + length) / speed,
+                    )
+                )
+            return result
+
+        departure = node.arrival
+        for _ in range(self.max_waits):
+            later = departure
+            for piece, start, end in intervals(departure):
+                if start >= horizon:
+                    continue
+                for conflict in table.conflicts(piece, start, end, train):
+                    # Let it by first
+                    later = max(later, departure + conflict.end - start)
+            if later == departure:
+                break
+            departure = later
+        else:
+            return None
+        if departure == math.inf:
+            # Something's in the way for good
+            return None
+
+        # It has to be able to stay where it is in the meantime
+        for piece, start, end in waiting(departure):
+            if table.conflicts(piece, start, end, train):
+                return None
+
+        arrival = departure + travel / speed
+        trailing = [
+            (piece, leave - travel)
+            for piece, leave in node.trailing
+            if leave - travel + length > 0
+        ] + [
+            (piece, leave - travel)
+            for piece, _, leave in ahead
+            if leave - travel + length > 0
+        ]
+        return _Node(
+            node.segment,
+            offset,
+            arrival,
+            trailing,
+            parent=node,
+            departure=departure,
+            intervals=waiting(departure) + intervals(departure),
+        )
+
+    def _finish(self, train: Train, goal: _Node, horizon: float) -> Optional[Plan]:
+        """Reserves what's within the window of a plan, and returns it, or None if
+        that conflicts with other reservations"""
+        steps: List[_Node] = []
+        node: Optional[_Node] = goal
+        while node is not None:
+            steps.append(node)
+            node = node.parent
+        steps.reverse()
+        segments, departures = [], []
+        for step in steps[1:]:
+            assert step.parent and step.departure is not None
+            segments.append(step.parent.segment)
+            departures.append(step.departure)
+
+        reserved = [
+            (piece, start, min(end, horizon))
+            for step in steps
+            for piece, start, end in step.intervals
+            if start < horizon
+        ]
+        if self.layout.reservation_table.reserve(train, reserved):
+            # Something else has reserved some of it in the meantime
+            return None
+        return Plan(
+            train,
+            segments,
+            departures,
+            goal.arrival,
+            (goal.segment, goal.offset),
+        )
@@ -0,0 +1,264 @@
+"""
+Recording and replaying what happens on a layout
+
+A Recorder appends sensor activity, trains being spotted, motor speed changes and ticks
+to a compact binary log, memory-mapped so that recording costs little more than a
+memory copy. Each record starts with its type and a monotonic timestamp. Sensors and
+trains are referred to by small integers, each defined by a record the first time it's
+used.
+
+A Replayer feeds a recording back into a (usually headless) layout with the same
+sensors and trains, either in real time or as fast as possible. Sightings of trains
+aren't replayed, as the layout works those out for itself; they can be compared with
+the recording afterwards.
+"""
+
+from __future__ import annotations
+
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import (
+    BinaryIO,
+    Dict,
+    Iterator,
+    NamedTuple,
+    Optional,
+    Tuple,
+    TYPE_CHECKING,
+    Union,
+)
+
+from letsgo import signals
+
+if TYPE_CHECKING:
+    from letsgo.layout import Layout
+    from letsgo.sensor import Sensor
+    from letsgo.train import Train
+
+__all__ = [
+    "Recorder",
+    "Replayer",
+    "read_records",
+    "SensorActivityRecord",
+    "TrainSpottedRecord",
+    "MotorSpeedRecord",
+    "TickRecord",
+]
+
+MAGIC = b"LGREC\0"
+VERSION = 1
+_file_header = struct.Struct("<6sH")
+
+# Record types. Zero marks the end of the log, as that's what the unwritten remainder
+# of the file is filled with.
+_END, _DEFINE, _SENSOR_ACTIVITY, _TRAIN_SPOTTED, _MOTOR_SPEED, _TICK = range(6)
+
+_record_header = struct.Struct("<Bd")
+_payloads = {
+    _DEFINE: struct.Struct("<HH"),  # index, length of the id that follows
+    _SENSOR_ACTIVITY: struct.Struct("<H?d"),  # sensor, activated, when
+    _TRAIN_SPOTTED: struct.Struct("<HHd"),  # train, sensor, when
+    _MOTOR_SPEED: struct.Struct("<Hf"),  # train, motor speed
+    _TICK: struct.Struct("<dd"),  # time, time elapsed
+}
+
+
+class SensorActivityRecord(NamedTuple):
+    timestamp: float
+    sensor_id: str
+    activated: bool
+    when: float
+
+
+class TrainSpottedRecord(NamedTuple):
+    timestamp: float
+    train_id: str
+    sensor_id: str
+    when: float
+
+
+class MotorSpeedRecord(NamedTuple):
+    timestamp: float
+    train_id: str
+    motor_speed: float
+
+
+class TickRecord(NamedTuple):
+    timestamp: float
+    time: float
+    time_elapsed: float
+
+
+Record = Union[SensorActivityRecord, TrainSpottedRecord, MotorSpeedRecord, TickRecord]
+
+
+class Recorder:
+    chunk_size = 1 << 20
+    """How much to grow the log file by, in bytes, when it fills up"""
+
+    def __init__(self, layout: Layout, path: Union[str, os.PathLike]):
+        self.layout = layout
+        self.path = path
+        self._lock = threading.Lock()
+        self._file: Optional[BinaryIO] = None
+        self._mmap: Optional[mmap.mmap] = None
+        self._position = 0
+        self._ids: Dict[str, int] = {}
+
+    def start(self):
+        self._file = open(self.path, "w+b")
+        self._file.truncate(self.chunk_size)
+        self._mmap = mmap.mmap(self._file.fileno(), self.chunk_size)
+        self._position = 0
+        self._ids = {}
+        self._write(_file_header.pack(MAGIC, VERSION))
+
+        signals.sensor_activity.connect(self.on_sensor_activity)
+        signals.train_spotted.connect(self.on_train_spotted)
+        signals.train_motor_speed_changed.connect(self.on_train_motor_speed_changed)
+        signals.tick.connect(self.on_tick)
+
+    def stop(self):
+        signals.sensor_activity.disconnect(self.on_sensor_activity)
+        signals.train_spotted.disconnect(self.on_train_spotted)
+        signals.train_motor_speed_changed.disconnect(self.on_train_motor_speed_changed)
+        signals.tick.disconnect(self.on_tick)
+
+        with self._lock:
+            assert self._file and self._mmap
+            self._mmap.close()
+            self._mmap = None
+            # Don't leave the unused remainder of the last chunk
+            self._file.truncate(self._position)
+            self._file.close()
+            self._file = None
+
+    def __enter__(self) -> Recorder:
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _write(self, data: bytes):
+        assert self._file and self._mmap
+        end = self._position + len(data)
+        if end > len(self._mmap):
+            size = (end // self.chunk_size + 1) * self.chunk_size
+            self._mmap.close()
+            self._file.truncate(size)
+            self._mmap = mmap.mmap(self._file.fileno(), size)
+        self._mmap[self._position : end] = data
+        self._position = end
+
+    def _index(self, id: str) -> int:
+        """Returns the index for an id, defining it first if it's new"""
+        if id not in self._ids:
+            index = self._ids[id] = len(self._ids)
+            encoded = id.encode()
+            self._write(_record_header.pack(_DEFINE, time.monotonic()))
+            self._write(_payloads[_DEFINE].pack(index, len(encoded)) + encoded)
+        return self._ids[id]
+
+    def _record(self, record_type: int, *values):
+        with self._lock:
+            if not self._mmap:
+                return
+            values = tuple(
+                self._index(value) if isinstance(value, str) else value
+                for value in values
+            )
+            self._write(
+                _record_header.pack(record_type, time.monotonic())
+                + _payloads[record_type].pack(*values)
+            )
+
+    def on_sensor_activity(self, sender: Sensor, activated: bool, when: float):
+        self._record(_SENSOR_ACTIVITY, sender.id, activated, when)
+
+    def on_train_spotted(self, sender: Train, sensor: Sensor, when: float, **kwargs):
+        self._record(_TRAIN_SPOTTED, sender.id, sensor.id, when)
+
+    def on_train_motor_speed_changed(self, sender: Train, motor_speed: float):
+        self._record(_MOTOR_SPEED, sender.id, motor_speed)
+
+    def on_tick(self, sender, time: float, time_elapsed: float):
+        self._record(_TICK, time, time_elapsed)
+
+
+def read_records(path: Union[str, os.PathLike]) -> Iterator[Record]:
+    with open(path, "rb") as f:
+        if not os.fstat(f.fileno()).st_size:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            magic, version = _file_header.unpack_from(data)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{path} isn't a recording this version can read")
+            ids: Dict[int, str] = {}
+            position = _file_header.size
+            # A recording that wasn't stopped cleanly may end part-way through a record
+            while position + _record_header.size <= len(data):
+                record_type, timestamp = _record_header.unpack_from(data, position)
+                if record_type == _END:
+                    return
+                position += _record_header.size
+                payload = _payloads[record_type]
+                values = payload.unpack_from(data, position)
+                position += payload.size
+                if record_type == _DEFINE:
+                    index, length = values
+                    ids[index] = bytes(data[position : position + length]).decode()
+                    position += length
+                elif record_type == _SENSOR_ACTIVITY:
+                    sensor, activated, when = values
+                    yield SensorActivityRecord(timestamp, ids[sensor], activated, when)
+                elif record_type == _TRAIN_SPOTTED:
+                    train, sensor, when = values
+                    yield TrainSpottedRecord(timestamp, ids[train], ids[sensor], when)
+                elif record_type == _MOTOR_SPEED:
+                    train, motor_speed = values
+                    yield MotorSpeedRecord(timestamp, ids[train], motor_speed)
+                elif record_type == _TICK:
+                    yield TickRecord(timestamp, *values)
+
+
+class Replayer:
+    def __init__(self, layout: Layout, path: Union[str, os.PathLike]):
+        self.layout = layout
+        self.path = path
+
+    def replay(self, speed: float = 1.0) -> Tuple[int, float]:
+        """Feeds the recording into the layout, returning the records and time taken
+
+        With a speed of math.inf, records are replayed as fast as possible. Activations
+        are attributed in batches on the replayed ticks, as they were when recorded, so
+        that replays are deterministic.
+        """
+        count, first_timestamp, started = 0, None, time.monotonic()
+        for record in read_records(self.path):
+            if first_timestamp is None:
+                first_timestamp = record.timestamp
+            if speed != math.inf:
+                delay = (record.timestamp - first_timestamp) / speed - (
+                    time.monotonic() - started
+                )
+                if delay > 0:
+                    time.sleep(delay)
+            if isinstance(record, SensorActivityRecord):
+                sensor = self.layout.sensors[record.sensor_id]
+                sensor.report_activity(record.activated, record.when)
+            elif isinstance(record, MotorSpeedRecord):
+                train = self.layout.trains[record.train_id]
+                train.maximum_motor_speed = record.motor_speed
+            elif isinstance(record, TickRecord):
+                self.layout.tick(
+                    self, time=record.time, time_elapsed=record.time_elapsed
+                )
+            count += 1
+        # As when the layout stops
+        self.layout.sensor_events.flush()
+        return count, time.monotonic() - started
@@ -0,0 +1,279 @@
+"""
+When trains expect to occupy which blocks of track
+
+A piece's `claimed_by` says which train has it now, and `Piece.reservations` how far
+ahead of each train it is, but neither says *when* a train will be on it. That's needed
+to let several trains through shared track, such as a passing loop on a single-track
+line, without stopping any of them. A reservation table keeps, for each block, the
+intervals of time trains expect to occupy it. Blocks are pieces, as for claims, so that
+trains going different ways through the same points conflict.
+
+Different trains' reservations on a block never overlap, and a train's own overlapping
+reservations are merged, so each block's are sorted by both start and end. Checking for
+conflicts is then a binary search.
+
+Expected times come from speed estimation, by way of the layout's fleet predictor.
+"""
+
+from __future__ import annotations
+
+import bisect
+import math
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from typing import TYPE_CHECKING
+
+from letsgo.track_graph import Segment
+
+if TYPE_CHECKING:
+    from letsgo.layout import Layout
+    from letsgo.pieces import Piece
+    from letsgo.train import Train
+
+__all__ = ["Reservation", "ReservationTable", "path_blocks"]
+
+Interval = Tuple["Piece", float, float]
+"""A block, and when it's expected to be entered and left"""
+
+
+class Reservation(NamedTuple):
+    block: Piece
+    start: float
+    end: float
+    train: Train
+
+
+def path_blocks(
+    start: Tuple[Segment, float],
+    segments: Iterable[Segment],
+    distance: float = math.inf,
+) -> Iterator[Tuple[Piece, float, float]]:
+    """Each piece along a path, with how far ahead of the start it begins and ends
+
+    The path starts some way along the first segment, and carries on through the rest
+    for up to a distance. Pieces the start is part-way through begin at a negative
+    distance.
+    """
+    until = distance
+    first, offset = start
+    distance = -offset
+    for segment in (first, *segments):
+        for (piece, _, _), traversal_offset, end_offset in zip(
+            segment.traversals,
+            segment.offsets,
+            [*segment.offsets[1:], segment.length],
+        ):
+            if distance + traversal_offset >= until:
+                return
+            if distance + end_offset > 0:
+                yield piece, distance + traversal_offset, distance + end_offset
+        distance += segment.length
+
+
+class _BlockReservations:
+    """Reservations on a single block, sorted by start (and so by end)"""
+
+    __slots__ = ("starts", "reservations")
+
+    def __init__(self):
+        self.starts: List[float] = []
+        self.reservations: List[Reservation] = []
+
+    def overlapping(self, start: float, end: float) -> List[int]:
+        """The indices of reservations overlapping an interval"""
+        i = bisect.bisect_left(self.starts, end)
+        indices = []
+        while i > 0 and self.reservations[i - 1].end > start:
+            i -= 1
+            indices.append(i)
+        return indices
+
+    def conflicts(self, start: float, end: float, train: Optional[Train]):
+        return [
+            self.reservations[i]
+            for i in self.overlapping(start, end)
+            if self.reservations[i].train is not train
+        ]
+
+    def insert(self, reservation: Reservation):
+        i = bisect.bisect(self.starts, reservation.start)
+        self.starts.insert(i, reservation.start)
+        self.reservations.insert(i, reservation)
+
+    def remove(self, reservation: Reservation):
+        i = bisect.bisect_left(self.starts, reservation.start)
+        while self.reservations[i] is not reservation:
+            i += 1
+        del self.starts[i]
+        del self.reservations[i]
+
+
+class ReservationTable:
+    margin = 1.0
+    """How long, in seconds, to reserve blocks for either side of when a train is
+    expected to be on them, to allow for its speed not being quite as estimated"""
+
+    def __init__(self, layout: Optional[Layout] = None):
+        self.layout = layout
+        self._blocks: Dict[Piece, _BlockReservations] = {}
+        self._trains: Dict[Train, List[Reservation]] = {}
+
+    def reservations(self, train: Train) -> List[Reservation]:
+        return list(self._trains.get(train, ()))
+
+    def block_reservations(self, block: Piece) -> List[Reservation]:
+        """A block's reservations, earliest first"""
+        if block not in self._blocks:
+            return []
+        return list(self._blocks[block].reservations)
+
+    def conflicts(
+        self, block: Piece, start: float, end: float, train: Optional[Train] = None
+    ) -> List[Reservation]:
+        """Other trains' reservations on a block that overlap an interval"""
+        if block not in self._blocks:
+            return []
+        return self._blocks[block].conflicts(start, end, train)
+
+    def is_free(
+        self, block: Piece, start: float, end: float, train: Optional[Train] = None
+    ) -> bool:
+        return not self.conflicts(block, start, end, train)
+
+    def next_free(
+        self,
+        block: Piece,
+        start: float,
+        duration: float = 0.0,
+        train: Optional[Train] = None,
+    ) -> float:
+        """The earliest time from `start` that a block is free for a while"""
+        if block not in self._blocks:
+            return start
+        block_reservations = self._blocks[block]
+        i = max(0, bisect.bisect_right(block_reservations.starts, start) - 1)
+        for reservation in block_reservations.reservations[i:]:
+            if reservation.train is train:
+                continue
+            if reservation.start >= start + duration:
+                break
+            start = max(start, reservation.end)
+        return start
+
+    def reserve(self, train: Train, intervals: Iterable[Interval]) -> List[Reservation]:
+        """Reserves blocks for a train, all or none of them
+
+        Returns any other trains' reservations that conflict, in which case nothing is
+        reserved.
+        """
+        intervals = list(intervals)
+        conflicts = [
+            conflict
+            for block, start, end in intervals
+            for conflict in self.conflicts(block, start, end, train)
+        ]
+        if conflicts:
+            return conflicts
+        for block, start, end in intervals:
+            self._reserve(train, block, start, end)
+        return []
+
+    def _reserve(self, train: Train, block: Piece, start: float, end: float):
+        if block not in self._blocks:
+            self._blocks[block] = _BlockReservations()
+        block_reservations = self._blocks[block]
+        # Merge with any of the train's own that this overlaps
+        for i in block_reservations.overlapping(start, end):
+            reservation = block_reservations.reservations[i]
+            start, end = min(start, reservation.start), max(end, reservation.end)
+            self._discard(reservation)
+        reservation = Reservation(block, start, end, train)
+        block_reservations.insert(reservation)
+        self._trains.setdefault(train, []).append(reservation)
+
+    def _discard(self, reservation: Reservation):
+        self._blocks[reservation.block].remove(reservation)
+        self._trains[reservation.train].remove(reservation)
+
+    def release(self, train: Train, block: Optional[Piece] = None):
+        """Releases a train's reservations, on one block or all of them"""
+        for reservation in self.reservations(train):
+            if block is None or reservation.block is block:
+                self._discard(reservation)
+        if not self._trains.get(train, True):
+            del self._trains[train]
+
+    def expire(self, now: float):
+        """Forgets reservations that ended before now"""
+        expired = []
+        for block_reservations in self._blocks.values():
+            # Ends are sorted, so these are all at the start
+            i = 0
+            while (
+                i < len(block_reservations.reservations)
+                and block_reservations.reservations[i].end <= now
+            ):
+                i += 1
+            expired.extend(block_reservations.reservations[:i])
+            del block_reservations.starts[:i]
+            del block_reservations.reservations[:i]
+        for reservation in expired:
+            self._trains[reservation.train].remove(reservation)
+            if not self._trains[reservation.train]:
+                del self._trains[reservation.train]
+
+    def expected_intervals(
+        self,
+        train: Train,
+        now: float,
+        segments: Iterable[Segment] = (),
+        distance: float = math.inf,
+    ) -> List[Interval]:
+        """When a train is expected to occupy each block along a path, at the speed
+        predicted for it
+
+        The path starts at the train's rear, including the blocks it's on now, and
+        carries on from its front through `segments`, for up to a distance.
+        """
+        assert self.layout
+        extent = self.layout.occupancy.extent(train)
+        if extent is None:
+            return []
+        path, rear_offset, _ = extent
+        speed = self.layout.fleet.speed(train)
+        intervals = []
+        for block, enter, leave in path_blocks(
+            (path[0], rear_offset), [*path[1:], *segments], train.length + distance
+        ):
+            # The front of the train reaches the block, and then its rear leaves it
+            start = now + max(0.0, enter - train.length) / speed if speed else now
+            end = now + leave / speed if speed else math.inf
+            intervals.append((block, start - self.margin, end + self.margin))
+        return intervals
+
+    def reserve_ahead(
+        self, train: Train, now: float, distance: float
+    ) -> List[Reservation]:
+        """Reserves blocks from a train's rear to a distance ahead of its front, as
+        points are set now
+
+        Returns any conflicting reservations, as `reserve` does.
+        """
+        assert self.layout
+        extent = self.layout.occupancy.extent(train)
+        if extent is None:
+            return []
+        path, _, front_offset = extent
+        segment, segments = path[-1], []
+        remaining = distance - (segment.length - front_offset)
+        while remaining > 0:
+            for successor in segment.successors:
+                if successor.available:
+                    segment = successor
+                    break
+            else:
+                break
+            segments.append(segment)
+            remaining -= segment.length
+        return self.reserve(
+            train, self.expected_intervals(train, now, segments, distance)
+        )
@@ -90,11 +90,13 @@ class Sensor(Controllable, TracksideItem, WithRegistry):
 
     @activated.setter
     def activated(self, value):
-        if value != self._activated:
-            self._activated = value
-            signals.sensor_activity.send(
-                self, activated=self._activated, when=time.time()
-            )
+        self.report_activity(value, time.time())
+
+    def report_activity(self, activated: bool, when: float):
+        """Sets whether the sensor is activated, as observed at a given time"""
+        if activated != self._activated:
+            self._activated = activated
+            signals.sensor_activity.send(self, activated=self._activated, when=when)
 
 
 class HallEffectSensor(Sensor):
@@ -0,0 +1,89 @@
+"""
+Distances between sensors along the track
+
+Sensors don't move while the layout is running, so the distances between them are
+computed once per track topology and points state, and kept in a matrix. Each sensor
+appears twice, once for each direction a train can pass it.
+"""
+
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, Optional, Tuple, TYPE_CHECKING
+
+import numpy as np
+
+from letsgo.track_graph import TrackGraph
+
+if TYPE_CHECKING:
+    from letsgo.sensor import Sensor
+
+DirectedSensor = Tuple["Sensor", bool]
+"""A sensor, and whether it is being passed in the opposite direction to its track point"""
+
+
+class SensorDistances:
+    def __init__(
+        self,
+        graph: TrackGraph,
+        sensors: Iterable[Sensor],
+        epoch: Optional[tuple] = None,
+    ):
+        self.epoch = epoch
+        self.directed_sensors: List[DirectedSensor] = []
+        for sensor in sensors:
+            self.directed_sensors.append((sensor, False))
+            if not sensor.single_direction:
+                self.directed_sensors.append((sensor, True))
+        self.index: Dict[DirectedSensor, int] = {
+            directed_sensor: i
+            for i, directed_sensor in enumerate(self.directed_sensors)
+        }
+
+        locations = [
+            graph.locate(
+                sensor.track_point.reversed() if reverse else sensor.track_point
+            )
+            for sensor, reverse in self.directed_sensors
+        ]
+
+        self.matrix = np.full((len(locations), len(locations)), np.inf)
+        """Distances from (rows) and to (columns) each directed sensor"""
+        for i, (segment, offset) in enumerate(locations):
+            distances = graph.distances_from(segment, offset)
+            for j, (other_segment, other_offset) in enumerate(locations):
+                if other_segment is segment and other_offset >= offset:
+                    self.matrix[i, j] = other_offset - offset
+                elif other_segment in distances:
+                    self.matrix[i, j] = distances[other_segment] + other_offset
+
+        # The nearest other sensor ahead of each one, or -1 if there isn't one
+        ahead = self.matrix.copy()
+        np.fill_diagonal(ahead, np.inf)
+        self._next = np.argmin(ahead, axis=1) if len(ahead) else np.zeros(0, int)
+        self._next[np.isinf(ahead[np.arange(len(ahead)), self._next])] = -1
+
+    def distance(
+        self,
+        from_sensor: Sensor,
+        to_sensor: Sensor,
+        from_reversed: bool = False,
+        to_reversed: bool = False,
+    ) -> float:
+        """Returns the distance between two sensors, or infinity if there's no way"""
+        return self.matrix[
+            self.index[from_sensor, from_reversed], self.index[to_sensor, to_reversed]
+        ]
+
+    def next_sensor(
+        self, sensor: Sensor, reverse: bool = False
+    ) -> Optional[Tuple[Sensor, bool, float]]:
+        """Returns the next sensor a train will pass, which way, and how far away"""
+        i = self.index[sensor, reverse]
+        j = self._next[i]
+        if j < 0:
+            return None
+        next_sensor, next_reversed = self.directed_sensors[j]
+        return next_sensor, next_reversed, self.matrix[i, j]
+
+    def __len__(self):
+        return len(self.directed_sensors)
@@ -0,0 +1,156 @@
+"""
+Attributes sensor activations to trains' magnets, a batch at a time
+
+Activations are collected over a short window, and then assigned to magnets together,
+so that e.g. two trains passing nearby sensors at about the same time aren't attributed
+greedily, one at a time. Batches are attributed on the layout's tick once their window
+has elapsed, so that trains are only ever repositioned on the same thread as they're
+moved.
+"""
+
+from __future__ import annotations
+
+import logging
+from typing import Dict, List, Tuple, TYPE_CHECKING
+
+import numpy as np
+
+from letsgo import signals
+from letsgo.magnet_index import MagnetMatch
+
+if TYPE_CHECKING:
+    from letsgo.layout import Layout
+    from letsgo.sensor import Sensor
+    from letsgo.train import Train
+
+logger = logging.getLogger(__name__)
+
+Magnet = Tuple["Train", int]
+
+
+class SensorEventAggregator:
+    ambiguity_margin = 8.0
+    """Matches closer than this to the assigned match make an activation ambiguous"""
+
+    def __init__(self, layout: Layout, window: float = 0.02):
+        self.layout = layout
+        self.window = window
+        """How long to collect activations for, in seconds, before attributing them"""
+        self._events: List[Tuple[Sensor, float]] = []
+
+    def add(self, sensor: Sensor, when: float):
+        self._events.append((sensor, when))
+        if self.window <= 0:
+            self.flush()
+
+    def flush_expired(self, now: float):
+        """Attributes the activations collected so far, if the window since the first
+        of them has elapsed"""
+        if self._events and self._events[0][1] + self.window <= now:
+            self.flush()
+
+    def flush(self):
+        """Attributes any activations collected so far"""
+        events, self._events = self._events, []
+        if events:
+            self.process(events)
+
+    def _ignore(self, sensor: Sensor, when: float, match: MagnetMatch) -> bool:
+        (
+            last_train_seen,
+            last_car_index_seen,
+            last_time_seen,
+        ) = self.layout.sensor_magnets_last_seen.get(sensor, (None, None, None))
+        # Discount stationary trains, and any magnet we've seen in the last two seconds
+        return (match.train.speed == 0 and match.train.velocity == 0) or (
+            match.train == last_train_seen
+            and match.car_index == last_car_index_seen
+            and when < last_time_seen + 2
+        )
+
+    def process(self, events: List[Tuple[Sensor, float]]):
+        magnet_index = self.layout.magnet_index
+
+        # The nearest match for each magnet, for each event
+        event_matches: List[Dict[Magnet, MagnetMatch]] = []
+        magnets: Dict[Magnet, int] = {}
+        for sensor, when in events:
+            matches: Dict[Magnet, MagnetMatch] = {}
+            for match in magnet_index.candidates(sensor):
+                magnet = match.train, match.car_index
+                if magnet not in matches and not self._ignore(sensor, when, match):
+                    matches[magnet] = match
+                    magnets.setdefault(magnet, len(magnets))
+            event_matches.append(matches)
+
+        if not magnets:
+            return
+
+        # Anything further than the window counts as no match at all
+        unmatched_cost = 2 * magnet_index.window + 1
+        costs = np.full((len(events), len(magnets)), unmatched_cost)
+        for i, matches in enumerate(event_matches):
+            for magnet, match in matches.items():
+                costs[i, magnets[magnet]] = abs(match.distance)
+
+        if len(events) == 1:
+            rows, columns = [0], [int(np.argmin(costs[0]))]
+        else:
+            from scipy.optimize import linear_sum_assignment
+
+            rows, columns = linear_sum_assignment(costs)
+
+        magnet_list = list(magnets)
+        assigned = set(columns)
+        spotted: Dict[Train, Tuple[Sensor, float, MagnetMatch]] = {}
+        for i, j in zip(rows, columns):
+            if costs[i, j] >= unmatched_cost:
+                continue
+            sensor, when = events[i]
+            match = event_matches[i][magnet_list[j]]
+            ambiguous_matches = [
+                other_match
+                for magnet, other_match in event_matches[i].items()
+                if magnets[magnet] not in assigned
+                and abs(other_match.distance) - costs[i, j] < self.ambiguity_margin
+            ]
+            if ambiguous_matches:
+                self._report_ambiguous(sensor, when, [match, *ambiguous_matches])
+                continue
+            self.layout.sensor_magnets_last_seen[sensor] = (
+                match.train,
+                match.car_index,
+                when,
+            )
+            if match.train not in spotted or spotted[match.train][1] < when:
+                spotted[match.train] = sensor, when, match
+
+        # Only the latest sighting of each train is used to correct its position
+        for train, (sensor, when, match) in spotted.items():
+            branch_decisions = train.position.branch_decisions
+            track_point = sensor.track_point
+            if match.reverse:
+                track_point = track_point.reversed()
+            train.position = track_point + match.train_offset
+            train.position.branch_decisions = branch_decisions
+        for train, (sensor, when, match) in spotted.items():
+            signals.train_spotted.send(
+                train,
+                sensor=sensor,
+                position=train.position,
+                when=when,
+                reverse=match.reverse,
+            )
+
+    def _report_ambiguous(
+        self, sensor: Sensor, when: float, matches: List[MagnetMatch]
+    ):
+        logger.warning(
+            "Ambiguous activation of sensor %s; could be any of %s",
+            sensor.id,
+            ", ".join(
+                f"train {m.train.id} car {m.car_index} ({m.distance:.1f} studs)"
+                for m in matches
+            ),
+        )
+        signals.sensor_activity_ambiguous.send(sensor, matches=matches, when=when)
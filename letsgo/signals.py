@@ -6,6 +6,7 @@ layout_changed = signal("layout-changed")
 piece_added = signal("piece-added")
 piece_removed = signal("piece-removed")
 piece_positioned = signal("piece-positioned")
+points_state_changed = signal("points-state-changed")
 
 train_added = signal("train-added")
 train_removed = signal("train-removed")
@@ -13,13 +14,22 @@ train_removed = signal("train-removed")
 train_maximum_motor_speed_changed = signal("train-maximum-motor-speed-changed")
 train_motor_speed_changed = signal("train-motor-speed-changed")
 train_lights_on_changed = signal("train-lights-on-changed")
+train_speed_model_changed = signal("train-speed-model-changed")
 
 train_spotted = signal("train-spotted")
+"Signal sent when a sensor spots a train, with its sensor, position and when, and whether it was passing the sensor in reverse."
+train_positioned = signal("train-positioned")
+train_moved = signal("train-moved")
+trains_overlapping = signal("trains-overlapping")
+"Signal sent when a train starts occupying the same track as another, with other=the other train."
 
 train_name_changed = signal("train-name-changed")
 
 tick = signal("tick")
 
+deadlock_detected = signal("deadlock-detected")
+"Signal sent by the dispatcher when trains are waiting for each other in a circle, with the trains, the train chosen to give way, and whether that resolved it."
+
 station_added = signal("station-added")
 station_removed = signal("station-removed")
 
@@ -35,6 +45,8 @@ controller_removed = signal("controller-removed")
 sensor_added = signal("sensor-added")
 sensor_removed = signal("sensor-removed")
 sensor_activity = signal("sensor-activity")
+sensor_activity_ambiguous = signal("sensor-activity-ambiguous")
+"Signal sent when it isn't clear which magnet activated a sensor, with the candidate matches."
 sensor_positioned = signal("sensor-positioned")
 
 controller_changed = signal("controller-changed")
@@ -1,25 +1,78 @@
 """
 Calculates expected stud-per-second speeds for trains based on a number of factors
 """
+from __future__ import annotations
+
+import collections
+import concurrent.futures
+import functools
+import logging
+import math
+import threading
 import time
+from typing import Deque, List, Optional, TYPE_CHECKING
 
 import numpy as np
-from sklearn.linear_model import LinearRegression
-from sklearn.preprocessing import PolynomialFeatures
 
+from letsgo.speed_model import (
+    FEATURE_NAMES,
+    PolynomialSpeedModel,
+    SpeedModelBackend,
+    get_speed_model_backend,
+    polynomial_feature_matrix,
+    polynomial_features,
+)
 from letsgo.track_point import TrackPoint
 from . import signals
 
+if TYPE_CHECKING:
+    from letsgo.calibration import CalibrationRing
+    from letsgo.sensor import Sensor
+
+logger = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=None)
+def _refit_executor() -> concurrent.futures.ThreadPoolExecutor:
+    return concurrent.futures.ThreadPoolExecutor(
+        max_workers=1, thread_name_prefix="speed-refit"
+    )
+
 
 class SpeedEstimation:
+    history_size = 1000
+    """How many observations to keep, for refitting from scratch"""
+
+    forgetting_factor = 0.995
+    """How much less each observation counts for than the next"""
+
+    model_backend = "rls"
+    """The name of the entry point in the `letsgo.speed_model_backend` group to fit
+    models with"""
+
+    refit_interval: Optional[int] = None
+    """If set, refit from the whole history every so many observations, on a worker
+    thread, to correct any drift in the online fit. The refitted model is installed on
+    the next tick."""
+
     def __init__(self, train, data=None):
         self.train = train
-        self.data = data or []
+        self.data: Deque[dict] = collections.deque(data or (), maxlen=self.history_size)
         self.last_position = None
+        self.last_sensor = None
+        self.last_reverse = False
         self.last_time = None
         self.current_profile = []
         self.last_profile_update = None
-        self.regression = None
+        self._model = PolynomialSpeedModel.proportional(60)
+        self.prior = self.model.coefficients
+        """What refits start from; the warm-started coefficients, if there are any"""
+        self._estimator: Optional[SpeedModelBackend] = None
+        self._warm_started = False
+        self._observations = 0
+        self._lock = threading.Lock()
+        self._refit: Optional[concurrent.futures.Future] = None
+        self._refit_observations = 0
 
         signals.battery_level_changed.connect(self.on_state_changed, sender=train)
         signals.train_motor_speed_changed.connect(self.on_state_changed, sender=train)
@@ -27,6 +80,34 @@ class SpeedEstimation:
 
         signals.train_spotted.connect(self.on_train_spotted, sender=train)
 
+    @property
+    def estimator(self) -> SpeedModelBackend:
+        """Fits the model as observations come in, created on first use"""
+        if self._estimator is None:
+            backend = get_speed_model_backend(self.model_backend)
+            self._estimator = backend(self.prior, forgetting=self.forgetting_factor)
+        return self._estimator
+
+    @estimator.setter
+    def estimator(self, value: SpeedModelBackend):
+        self._estimator = value
+
+    @property
+    def model(self) -> PolynomialSpeedModel:
+        """The fitted model, exported as coefficients, or a hard-coded estimate"""
+        return self._model
+
+    @model.setter
+    def model(self, value: PolynomialSpeedModel):
+        self._model = value
+        signals.train_speed_model_changed.send(self.train, model=value)
+
+    def get_model(self) -> PolynomialSpeedModel:
+        """Returns the model, first warm-starting it if that hasn't happened yet"""
+        if not self._warm_started:
+            self.warm_start()
+        return self.model
+
     def on_state_changed(self, sender, **kwargs):
         self.update_profile(time.time())
 
@@ -45,13 +126,23 @@ class SpeedEstimation:
             )
         self.last_profile_update = when
 
-    def on_train_spotted(self, sender, sensor, position, when):
+    def on_train_spotted(self, sender, sensor, position, when, reverse=False, **kwargs):
+        distance = None
         if self.last_position:
+            distance = self._get_distance_travelled(
+                self.last_position,
+                position,
+                self.last_sensor,
+                sensor,
+                self.last_reverse,
+                reverse,
+            )
+        if distance is not None:
             self.update_profile(when)
-            distance = self._get_distance_travelled(self.last_position, position)
             duration = sum(state["duration"] for state in self.current_profile)
             self.data.append(
                 {
+                    "when": when,
                     "distance": distance,
                     "profile": self.current_profile,
                     "duration": duration,
@@ -85,10 +176,15 @@ class SpeedEstimation:
             position,
             when,
         )
+        self.last_sensor, self.last_reverse = sensor, reverse
 
         self.current_profile = []
         self.update_profile(when)
 
+    @staticmethod
+    def _is_constant_speed(d: dict) -> bool:
+        return len(set(state["motor_speed"] for state in d["profile"])) == 1
+
     def get_constant_speed_profiles(self):
         return [
             [
@@ -99,64 +195,153 @@ class SpeedEstimation:
                 d["lights_on"],
             ]
             for d in self.data
-            if len(set(state["motor_speed"] for state in d["profile"])) == 1
+            if self._is_constant_speed(d)
         ]
 
+    @property
+    def calibration(self) -> Optional[CalibrationRing]:
+        """Where observations are persisted between sessions, if anywhere"""
+        layout = self.train.layout
+        store = layout.calibration_store if layout else None
+        return store.ring(self.train.id) if store else None
+
+    def warm_start(self):
+        """Fits the model to the persisted observations, if it hasn't been already"""
+        with self._lock:
+            if self._warm_started:
+                return
+            self._warm_started = True
+            calibration = self.calibration
+            if calibration is None or not len(calibration):
+                return
+            observations = calibration.observations()
+            features = polynomial_feature_matrix(
+                np.column_stack([observations[name] for name in FEATURE_NAMES])
+            )
+            self.estimator = get_speed_model_backend(self.model_backend).fit(
+                features,
+                observations["speed"].astype(float),
+                self.prior,
+                forgetting=self.forgetting_factor,
+            )
+            self.model = self.estimator.model()
+            self.prior = self.model.coefficients
+
     def update_model(self):
-        constant_speed_profiles = self.get_constant_speed_profiles()
-        # We know trains can't go anywhere if their motor isn't running
-        constant_speed_profiles.extend(
-            [
-                [0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 1],
-                [0, 0, 100, 1, 0],
-                [0, 0, 50, 1, 0],
-                [0, 0, 100, 1, 1],
-                [0, 0, 50, 1, 1],
-            ]
+        """Updates the model with the latest observation"""
+        d = self.data[-1]
+        if not self._is_constant_speed(d):
+            return
+        self.warm_start()
+        calibration = self.calibration
+        if calibration is not None:
+            calibration.append(
+                d.get("when", 0), d["speed"], *(d[name] for name in FEATURE_NAMES)
+            )
+        features = polynomial_features([d[name] for name in FEATURE_NAMES])
+        with self._lock:
+            self.estimator.update(features, d["speed"])
+            self.model = self.estimator.model()
+            self._observations += 1
+            if (
+                self.refit_interval
+                and self._observations % self.refit_interval == 0
+                and self._refit is None
+            ):
+                self._refit = _refit_executor().submit(
+                    self.refit, self.get_constant_speed_profiles()
+                )
+                self._refit_observations = self._observations
+
+    def refit(self, profiles: List[List[float]]) -> SpeedModelBackend:
+        """Refits the model from scratch, from constant speed profiles
+
+        This doesn't use or change any state, so can be done on a worker thread.
+        """
+        features = np.array([polynomial_features(p[1:]) for p in profiles])
+        speeds = np.array([p[0] for p in profiles])
+        return get_speed_model_backend(self.model_backend).fit(
+            features,
+            speeds,
+            self.prior,
+            forgetting=self.forgetting_factor,
+        )
+
+    def install_refit(self, estimator: SpeedModelBackend, observations: int):
+        """Replaces the online fit with a refit made after so many observations"""
+        with self._lock:
+            # Catch up with anything observed since the refit started
+            missed = self._observations - observations
+            if missed:
+                for profile in self.get_constant_speed_profiles()[-missed:]:
+                    estimator.update(polynomial_features(profile[1:]), profile[0])
+            self.estimator = estimator
+            self.model = estimator.model()
+
+    def tick(self):
+        """Installs a refitted model if one has finished, on the layout's thread, so
+        that the model only ever changes there"""
+        refit = self._refit
+        if refit is None or not refit.done():
+            return
+        self._refit = None
+        try:
+            estimator = refit.result()
+        except Exception:
+            logger.exception("Refitting the speed model for %s failed", self.train.id)
+            return
+        self.install_refit(estimator, self._refit_observations)
+
+    def predict(self, **kwargs) -> float:
+        """Returns the expected speed in studs per second
+
+        By default this is for the train's current state, but any of motor_speed,
+        battery_level and lights_on can be given to override it.
+        """
+        train = self.train
+        return self.get_model().predict(
+            kwargs.get("motor_speed", train.motor_speed),
+            kwargs.get("battery_level", train.battery_level),
+            kwargs.get("lights_on", train.lights_on),
         )
-        constant_speed_profiles = np.array(constant_speed_profiles)
-        X = constant_speed_profiles[:, 1:]
-        X = PolynomialFeatures(3).fit_transform(X)
-        y = constant_speed_profiles[:, 0]
-        self.regression = LinearRegression().fit(X, y)
-
-    def predict(self, **kwargs):
-        X = [
-            kwargs.get("motor_speed", self.train.motor_speed),
-            kwargs.get("battery_level", self.train.battery_level or 0),
-            kwargs.get(
-                "battery_level_available", int(self.train.battery_level is not None)
-            ),
-            float(kwargs.get("lights_on", int(self.train.lights_on))),
-        ]
 
-        if X[0] == 0:
-            return 0
-
-        if not self.regression:
-            # This is a hard-coded prediction
-            return X[0] * 60
-
-        X = PolynomialFeatures(3).fit_transform(np.array([X]))
-
-        # Make sure we don't predict it going backwards
-        return max(0, self.regression.predict(X))
-
-    def _get_distance_travelled(self, last_position: TrackPoint, position: TrackPoint):
-        # Calculate the distance travelled by this train since it was last spotted, by tracing its path backwards
-        # to where it was last spotted
-        p = position.reversed()
-        p, distance = p.next_piece(-p.offset, True)
-        c = 0
-        while last_position.piece != p.piece:
-            p, distance = p.next_piece(distance, True)
-            c += 1
-            if c > 1000:
-                print()
-        p = p.reversed()
-        distance += p.offset - last_position.offset
-        return distance
+    def _get_distance_travelled(
+        self,
+        last_position: TrackPoint,
+        position: TrackPoint,
+        last_sensor: Optional[Sensor] = None,
+        sensor: Optional[Sensor] = None,
+        last_reverse: bool = False,
+        reverse: bool = False,
+    ) -> Optional[float]:
+        # Calculate the distance travelled by this train since it was last spotted. If
+        # we know which sensors spotted it, and which way it was passing them, we can
+        # look up the distance between them.
+        layout = self.train.layout
+        if layout and last_sensor and sensor:
+            sensor_distances = layout.sensor_distances
+            index = sensor_distances.index
+            if (last_sensor, last_reverse) in index and (sensor, reverse) in index:
+                distance = sensor_distances.distance(
+                    last_sensor, sensor, last_reverse, reverse
+                )
+                track_point, last_track_point = (
+                    sensor.track_point,
+                    last_sensor.track_point,
+                )
+                if reverse:
+                    track_point = track_point.reversed()
+                if last_reverse:
+                    last_track_point = last_track_point.reversed()
+                offset = track_point.signed_distance_to(position)
+                last_offset = last_track_point.signed_distance_to(last_position)
+                if (
+                    math.isfinite(distance)
+                    and offset is not None
+                    and last_offset is not None
+                ):
+                    return distance + offset - last_offset
+        return last_position.distance_to(position, math.inf)
 
     #
     # def spotted_at(self, position: TrackPoint):
@@ -0,0 +1,269 @@
+"""
+Closed-form polynomial models of how fast trains go
+
+A model is a cubic polynomial in a train's motor speed, battery level, whether its
+battery level is known, and whether its lights are on. It's kept as plain coefficients,
+one per term, so that predicting a speed doesn't involve building arrays or calling
+into a fitting library. Predictions are memoised on the train's state, which rarely
+changes, so most cost no more than a dictionary lookup.
+
+Models are fitted by backends, registered in the `letsgo.speed_model_backend` entry
+point group and only imported when a model is first fitted. The default fits online by
+recursive least squares, so each observation costs the same however many there have
+been, and older observations are gradually forgotten as e.g. the train's motor wears.
+"""
+
+from __future__ import annotations
+
+import functools
+import itertools
+from typing import Dict, List, Optional, Sequence, Tuple, Type
+
+import numpy as np
+import pkg_resources
+
+__all__ = [
+    "FEATURE_NAMES",
+    "DEGREE",
+    "POWERS",
+    "polynomial_features",
+    "polynomial_feature_matrix",
+    "PolynomialSpeedModel",
+    "SpeedModelBackend",
+    "RecursiveLeastSquares",
+    "get_speed_model_backend",
+]
+
+FEATURE_NAMES = ("motor_speed", "battery_level", "battery_level_available", "lights_on")
+
+FEATURE_SCALES = (1.0, 100.0, 1.0, 1.0)
+"""Features are divided by these so they're all roughly between zero and one"""
+
+DEGREE = 3
+
+
+def polynomial_powers(n_features: int, degree: int) -> List[Tuple[int, ...]]:
+    """The exponents of each term, in the same order as sklearn's PolynomialFeatures"""
+    powers = []
+    for d in range(degree + 1):
+        for combination in itertools.combinations_with_replacement(
+            range(n_features), d
+        ):
+            exponents = [0] * n_features
+            for i in combination:
+                exponents[i] += 1
+            powers.append(tuple(exponents))
+    return powers
+
+
+POWERS = polynomial_powers(len(FEATURE_NAMES), DEGREE)
+_POWERS_ARRAY = np.array(POWERS)
+
+
+def polynomial_features(values: Sequence[float]) -> List[float]:
+    """The value of each term of the polynomial, for the given (unscaled) features"""
+    scaled = [value / scale for value, scale in zip(values, FEATURE_SCALES)]
+    features = []
+    for powers in POWERS:
+        feature = 1.0
+        for value, power in zip(scaled, powers):
+            if power:
+                feature *= value**power
+        features.append(feature)
+    return features
+
+
+def polynomial_feature_matrix(values: np.ndarray) -> np.ndarray:
+    """`polynomial_features` for many observations at once, one per row"""
+    scaled = np.asarray(values, dtype=float) / FEATURE_SCALES
+    # Each power of each feature, by repeated multiplication as that's much quicker
+    # than raising to array exponents, then looked up and multiplied for each term
+    table = np.ones(scaled.shape + (DEGREE + 1,))
+    for power in range(1, DEGREE + 1):
+        table[..., power] = table[..., power - 1] * scaled
+    return table[:, np.arange(len(FEATURE_NAMES)), _POWERS_ARRAY].prod(axis=2)
+
+
+StateKey = Tuple[float, Optional[float], bool]
+
+
+class PolynomialSpeedModel:
+    cache_size = 1024
+    """How many states to remember predictions for"""
+
+    def __init__(self, coefficients: Sequence[float]):
+        if len(coefficients) != len(POWERS):
+            raise ValueError(f"Expected {len(POWERS)} coefficients")
+        self.coefficients = tuple(float(c) for c in coefficients)
+        # Group the terms by the power of the motor speed, so that the polynomial can
+        # be evaluated as a cubic in motor speed using Horner's method, with the
+        # coefficients of that cubic depending on the rest of the state
+        self._terms_by_motor_power: List[List[Tuple[float, Tuple[int, ...]]]] = [
+            [] for _ in range(DEGREE + 1)
+        ]
+        for coefficient, powers in zip(self.coefficients, POWERS):
+            if coefficient:
+                self._terms_by_motor_power[powers[0]].append((coefficient, powers[1:]))
+        self._cache: Dict[StateKey, float] = {}
+
+    @classmethod
+    def from_regression(cls, regression) -> PolynomialSpeedModel:
+        """Exports a linear regression fitted over `polynomial_features`"""
+        coefficients = [float(c) for c in regression.coef_]
+        coefficients[0] += float(regression.intercept_)
+        return cls(coefficients)
+
+    @classmethod
+    def proportional(cls, studs_per_second: float) -> PolynomialSpeedModel:
+        """A model where speed is simply proportional to motor speed"""
+        coefficients = [0.0] * len(POWERS)
+        coefficients[POWERS.index((1, 0, 0, 0))] = studs_per_second
+        return cls(coefficients)
+
+    def evaluate(
+        self,
+        motor_speed: float,
+        battery_level: float,
+        battery_level_available: float,
+        lights_on: float,
+    ) -> float:
+        others = (
+            battery_level / FEATURE_SCALES[1],
+            battery_level_available / FEATURE_SCALES[2],
+            lights_on / FEATURE_SCALES[3],
+        )
+        result = 0.0
+        for terms in reversed(self._terms_by_motor_power):
+            coefficient = 0.0
+            for term_coefficient, powers in terms:
+                for value, power in zip(others, powers):
+                    if power:
+                        term_coefficient *= value**power
+                coefficient += term_coefficient
+            result = result * motor_speed / FEATURE_SCALES[0] + coefficient
+        return result
+
+    def predict(
+        self, motor_speed: float, battery_level: Optional[float], lights_on: bool
+    ) -> float:
+        """Returns the predicted speed in studs per second, which is never negative"""
+        key = motor_speed, battery_level, lights_on
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        if motor_speed == 0:
+            # We know trains can't go anywhere if their motor isn't running
+            speed = 0.0
+        else:
+            speed = max(
+                0.0,
+                self.evaluate(
+                    motor_speed,
+                    battery_level or 0,
+                    int(battery_level is not None),
+                    float(lights_on),
+                ),
+            )
+        if len(self._cache) >= self.cache_size:
+            self._cache.clear()
+        self._cache[key] = speed
+        return speed
+
+
+class SpeedModelBackend:
+    """Fits a model's coefficients to observations, given as `polynomial_features`"""
+
+    def __init__(self, initial: Sequence[float], forgetting: float = 0.995):
+        raise NotImplementedError
+
+    @classmethod
+    def fit(
+        cls,
+        features: np.ndarray,
+        speeds: np.ndarray,
+        prior: Sequence[float],
+        forgetting: float = 0.995,
+    ) -> SpeedModelBackend:
+        """Fits a batch of observations, oldest first"""
+        raise NotImplementedError
+
+    def update(self, features: Sequence[float], speed: float):
+        raise NotImplementedError
+
+    def model(self) -> PolynomialSpeedModel:
+        raise NotImplementedError
+
+
+@functools.lru_cache(maxsize=None)
+def get_speed_model_backend(name: str) -> Type[SpeedModelBackend]:
+    try:
+        backend_cls = next(
+            pkg_resources.iter_entry_points("letsgo.speed_model_backend", name)
+        ).load()
+    except StopIteration as e:
+        raise ValueError(
+            f"Couldn't find entrypoint {name} in group letsgo.speed_model_backend"
+        ) from e
+    assert issubclass(backend_cls, SpeedModelBackend)
+    return backend_cls
+
+
+class RecursiveLeastSquares(SpeedModelBackend):
+    """Fits polynomial coefficients one observation at a time.
+
+    Each update costs O(n²) in the number of terms, and nothing is kept but the
+    coefficients and their (scaled) covariance. Observations are weighted by a
+    forgetting factor for each newer observation, so the fit follows gradual changes.
+    """
+
+    max_covariance_trace = 1e4
+    """Stop forgetting once the covariance is this large, so that terms that aren't
+    being excited by recent observations don't become unstable"""
+
+    def __init__(
+        self,
+        initial: Sequence[float],
+        forgetting: float = 0.995,
+        delta: float = 10.0,
+        covariance: Optional[np.ndarray] = None,
+    ):
+        self.coefficients = np.array(initial, dtype=float)
+        self.forgetting = forgetting
+        self.covariance = (
+            np.eye(len(self.coefficients)) * delta if covariance is None else covariance
+        )
+
+    @classmethod
+    def fit(
+        cls,
+        features: np.ndarray,
+        speeds: np.ndarray,
+        prior: Sequence[float],
+        forgetting: float = 0.995,
+        delta: float = 10.0,
+    ) -> RecursiveLeastSquares:
+        """Fits a batch of observations (oldest first) in one go, as if one at a time"""
+        weights = forgetting ** np.arange(len(speeds) - 1, -1, -1)
+        theta = np.asarray(prior, dtype=float)
+        # The prior counts as an observation of each coefficient, made before any of
+        # the real ones
+        information = np.eye(len(theta)) * (forgetting ** len(speeds) / delta)
+        information += (features.T * weights) @ features
+        covariance = np.linalg.inv(information)
+        coefficients = covariance @ (
+            information @ theta + (features.T * weights) @ (speeds - features @ theta)
+        )
+        return cls(coefficients, forgetting, covariance=covariance)
+
+    def update(self, features: Sequence[float], speed: float):
+        x = np.asarray(features, dtype=float)
+        px = self.covariance @ x
+        gain = px / (self.forgetting + x @ px)
+        self.coefficients += gain * (speed - x @ self.coefficients)
+        self.covariance -= np.outer(gain, px)
+        if np.trace(self.covariance) < self.max_covariance_trace:
+            self.covariance /= self.forgetting
+
+    def model(self) -> PolynomialSpeedModel:
+        return PolynomialSpeedModel(self.coefficients.tolist())
@@ -0,0 +1,73 @@
+"""
+A speed model backend using scikit-learn, which is an optional dependency
+
+Install with the `sklearn` extra, and set `SpeedEstimation.model_backend` to "sklearn".
+"""
+
+from __future__ import annotations
+
+import collections
+from typing import Deque, Sequence
+
+import numpy as np
+from sklearn.linear_model import Ridge
+
+from letsgo.speed_model import PolynomialSpeedModel, SpeedModelBackend
+
+__all__ = ["SklearnRidgeRegression"]
+
+
+class SklearnRidgeRegression(SpeedModelBackend):
+    """Refits a ridge regression over recent observations after each one.
+
+    The regression is of how far observations differ from the prior, so that the
+    penalty pulls coefficients towards the prior rather than towards zero.
+    """
+
+    max_observations = 1000
+    """How many of the most recent observations to fit"""
+
+    alpha = 1.0
+    """How strongly to keep coefficients near the prior"""
+
+    def __init__(self, initial: Sequence[float], forgetting: float = 0.995):
+        self.prior = np.array(initial, dtype=float)
+        self.forgetting = forgetting
+        self.features: Deque[np.ndarray] = collections.deque(
+            maxlen=self.max_observations
+        )
+        self.speeds: Deque[float] = collections.deque(maxlen=self.max_observations)
+        self._model = PolynomialSpeedModel(initial)
+
+    @classmethod
+    def fit(
+        cls,
+        features: np.ndarray,
+        speeds: np.ndarray,
+        prior: Sequence[float],
+        forgetting: float = 0.995,
+    ) -> SklearnRidgeRegression:
+        backend = cls(prior, forgetting)
+        backend.features.extend(np.asarray(features, dtype=float))
+        backend.speeds.extend(np.asarray(speeds, dtype=float).tolist())
+        backend._refit()
+        return backend
+
+    def update(self, features: Sequence[float], speed: float):
+        self.features.append(np.asarray(features, dtype=float))
+        self.speeds.append(speed)
+        self._refit()
+
+    def _refit(self):
+        if not self.speeds:
+            return
+        features = np.array(self.features)
+        speeds = np.array(self.speeds)
+        weights = self.forgetting ** np.arange(len(speeds) - 1, -1, -1)
+        # The first feature is the constant term, so there's no separate intercept
+        regression = Ridge(alpha=self.alpha, fit_intercept=False)
+        regression.fit(features, speeds - features @ self.prior, sample_weight=weights)
+        self._model = PolynomialSpeedModel((self.prior + regression.coef_).tolist())
+
+    def model(self) -> PolynomialSpeedModel:
+        return self._model
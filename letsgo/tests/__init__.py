@@ -2,3 +2,25 @@ from .test_drawing import *
 from .test_layout import *
 from .test_routeing import *
 from .test_track_point import *
+from .test_pieces import *
+from .test_piece_store import *
+from .test_track_graph import *
+from .test_sensor_distances import *
+from .test_magnet_index import *
+from .test_car_positions import *
+from .test_occupancy import *
+from .test_reservations import *
+from .test_planner import *
+from .test_sensor_events import *
+from .test_event_queue import *
+from .test_polling import *
+from .test_command_queue import *
+from .test_simulated_control import *
+from .test_controller_runtime import *
+from .test_recording import *
+from .test_speed_model import *
+from .test_calibration import *
+from .test_fleet import *
+from .test_kinematics import *
+from .test_physics import *
+from .test_topham_hatt import *
@@ -0,0 +1,59 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from ..calibration import CalibrationRing, CalibrationStore
+from ..layout import Layout
+from ..speed_estimation import SpeedEstimation
+from ..speed_model import polynomial_feature_matrix, polynomial_features
+from ..train import Car, Train
+from .test_speed_model import make_observations
+
+
+class CalibrationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_ring_keeps_most_recent(self):
+        path = os.path.join(self.directory.name, "train.npy")
+        ring = CalibrationRing(path, capacity=10)
+        for i in range(25):
+            ring.append(i, i * 2, 0.5, 80, 1, 0)
+        self.assertEqual(10, len(ring))
+        ring.flush()
+        del ring
+
+        ring = CalibrationRing(path, capacity=100)
+        self.assertEqual(10, ring.capacity)
+        self.assertEqual(list(range(15, 25)), list(ring.observations()["when"]))
+        ring.append(25, 50, 0.5, 80, 1, 0)
+        self.assertEqual(list(range(16, 26)), list(ring.observations()["when"]))
+
+    def test_feature_matrix_matches_features(self):
+        X, _ = make_observations(20)
+        np.testing.assert_allclose(
+            [polynomial_features(row) for row in X], polynomial_feature_matrix(X)
+        )
+
+    def test_warm_starts_model(self):
+        store = CalibrationStore(self.directory.name)
+        X, y = make_observations(500)
+        ring = store.ring("train/1")
+        for row, speed in zip(X, y):
+            ring.append(0, speed, *row)
+
+        layout = Layout()
+        layout.calibration_store = store
+        train = Train(
+            id="train/1", cars=[Car(length=20, bogey_offsets=[4, 16])], layout=layout
+        )
+        estimation = SpeedEstimation(train)
+        self.assertAlmostEqual(
+            31,
+            estimation.predict(motor_speed=0.5, battery_level=80, lights_on=True),
+            delta=1,
+        )
+        self.assertEqual(tuple(estimation.estimator.coefficients), estimation.prior)
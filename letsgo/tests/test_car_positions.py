@@ -0,0 +1,79 @@
+import math
+import unittest
+
+from ..kinematics import KinematicsEngine
+from ..layout import Layout
+from ..track import Position
+from ..track_point import TrackPoint
+from ..train import Car
+from .utils import loop_with_siding, make_train
+
+
+class CarPositionsTestCase(unittest.TestCase):
+    def setUp(self):
+        # A loop of sixteen curves, with a siding off some points
+        self.layout = Layout()
+        self.points, self.curves, self.siding = loop_with_siding(
+            self.layout, placement=Position(0, 0, 0)
+        )
+
+        self.train = make_train(
+            self.layout,
+            TrackPoint(self.curves[5], "in", "out", 2),
+            cars=[
+                Car(length=20, bogey_offsets=[4, 16], magnet_offset=10),
+                Car(length=20, bogey_offsets=[4, 16]),
+            ],
+        )
+
+    def assertMatchesTrackPoints(self):
+        behind = [4, 16, 25, 37]
+        expected = [
+            self.layout.track_graph.locate(self.train.position - distance)
+            for distance in behind
+        ]
+        locations = self.train.car_positions.bogey_locations()
+        self.assertEqual(
+            [segment for segment, _ in expected], [s for s, _ in locations]
+        )
+        for (_, expected_offset), (_, offset) in zip(expected, locations):
+            self.assertAlmostEqual(expected_offset, offset)
+
+        poses = self.train.car_positions.bogey_poses()
+        for distance, pose in zip(behind, poses):
+            position = (self.train.position - distance).position
+            self.assertAlmostEqual(position.x, pose[0])
+            self.assertAlmostEqual(position.y, pose[1])
+
+    def test_follows_moves(self):
+        self.assertEqual(
+            [slice(0, 2), slice(2, 4)], self.train.car_positions.car_bogeys
+        )
+        self.assertMatchesTrackPoints()
+        for _ in range(30):
+            self.train.move(13)
+            self.assertMatchesTrackPoints()
+        self.train.move(-40)
+        self.assertMatchesTrackPoints()
+
+        self.points.state = "branch"
+        self.train.position = TrackPoint(self.curves[-1], "in", "out", 30)
+        self.train.move(20)
+        self.assertMatchesTrackPoints()
+
+    def test_follows_kinematics_engine(self):
+        self.train.physics.tractive_force = math.inf
+        self.train.maximum_motor_speed = 1
+        self.layout.kinematics = KinematicsEngine(self.layout)
+        for i in range(10):
+            self.layout.tick(None, time=i * 0.1, time_elapsed=0.1)
+            self.assertMatchesTrackPoints()
+        self.layout.kinematics = None
+        self.train.move(10)
+        self.assertMatchesTrackPoints()
+
+    def test_magnet_index_reads_magnets(self):
+        self.train.move(30)
+        ((car_index, location),) = self.train.car_positions.magnet_locations()
+        self.assertEqual(0, car_index)
+        self.assertEqual([location], self.layout.magnet_index._locations[self.train])
@@ -0,0 +1,66 @@
+import threading
+import unittest
+
+from ..control.command_queue import CommandDispatcher, CommandQueue
+
+
+class CommandQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.queue = CommandQueue(
+            lambda kind, value: None, max_rate=10, min_change=0.02
+        )
+
+    def test_latest_value_wins(self):
+        for value in (0.1, 0.2, 0.3):
+            self.queue.put("motor", value)
+        self.assertEqual(("motor", 0.3), self.queue.pop_ready(0))
+        self.assertIsNone(self.queue.pop_ready(1))
+
+    def test_rate_limited(self):
+        self.queue.put("motor", 0.5)
+        self.assertEqual(("motor", 0.5), self.queue.pop_ready(0))
+        self.queue.put("motor", 0.6)
+        self.assertEqual(0.1, self.queue.next_ready(0))
+        self.assertIsNone(self.queue.pop_ready(0.05))
+        self.assertEqual(("motor", 0.6), self.queue.pop_ready(0.1))
+
+    def test_negligible_changes_dropped(self):
+        self.queue.put("motor", 0.5)
+        self.queue.pop_ready(0)
+        self.queue.put("motor", 0.6)
+        # Going back to nearly what was sent supersedes the pending command
+        self.queue.put("motor", 0.51)
+        self.assertEqual(0, len(self.queue))
+        self.queue.put("lights", True)
+        self.assertEqual(1, len(self.queue))
+
+    def test_stopping_jumps_the_queue(self):
+        self.queue.put("lights", True)
+        self.queue.pop_ready(0)
+        self.queue.put("lights", False)
+        self.queue.put("motor", 0, urgent=True)
+        self.assertEqual(0, self.queue.next_ready(0))
+        self.assertEqual(("motor", 0), self.queue.pop_ready(0))
+        self.assertEqual(("lights", False), self.queue.pop_ready(0.1))
+
+
+class CommandDispatcherTestCase(unittest.TestCase):
+    def test_sends_commands(self):
+        dispatcher = CommandDispatcher()
+        sent = []
+        done = threading.Event()
+
+        def send(kind, value):
+            sent.append((kind, value))
+            if len(sent) == 2:
+                done.set()
+
+        queues = [dispatcher.add_queue(send, max_rate=100) for _ in range(2)]
+        dispatcher.start()
+        try:
+            queues[0].put("motor", 0.5)
+            queues[1].put("motor", 0, urgent=True)
+            self.assertTrue(done.wait(1))
+        finally:
+            dispatcher.stop()
+        self.assertCountEqual([("motor", 0.5), ("motor", 0)], sent)
@@ -0,0 +1,127 @@
+import asyncio
+import time
+import unittest
+
+from .. import pieces, signals
+from ..control import Controller
+from ..control.runtime import ControllerRuntime
+from ..layout import Layout
+from ..sensor import HallEffectSensor
+from ..ticker import Ticker
+from ..track_point import TrackPoint
+from .test_event_queue import DummySensorController
+
+
+class FlakyController(Controller):
+    def __init__(self, failures, **kwargs):
+        super().__init__(**kwargs)
+        self.failures = failures
+        self.starts, self.stops = 0, 0
+
+    async def start(self):
+        self.starts += 1
+
+    async def run(self):
+        if self.failures:
+            self.failures -= 1
+            raise IOError("Device went away")
+        await super().run()
+
+    async def stop(self):
+        self.stops += 1
+
+
+class StubbornController(Controller):
+    async def run(self):
+        try:
+            await super().run()
+        except asyncio.CancelledError:
+            await asyncio.sleep(0.5)
+            raise
+
+
+class ControllerRuntimeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.layout = Layout()
+        self.runtime = ControllerRuntime()
+        self.runtime.initial_backoff = 0.01
+        self.runtime.start()
+
+    def tearDown(self):
+        self.runtime.stop()
+
+    def wait_for(self, condition, timeout=2):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def test_restarts_with_backoff(self):
+        controller = FlakyController(2, layout=self.layout)
+        with self.assertLogs("letsgo.control.runtime", "ERROR"):
+            self.runtime.add_controller(controller)
+            self.wait_for(lambda: controller.starts == 3)
+        # Stopped after each failure, but now running
+        self.assertEqual(2, controller.stops)
+        self.runtime.remove_controller(controller)
+        self.assertEqual(3, controller.stops)
+
+    def test_controllers_share_a_loop(self):
+        controllers = [FlakyController(0, layout=self.layout) for _ in range(10)]
+        for controller in controllers:
+            self.runtime.add_controller(controller)
+        self.wait_for(lambda: all(controller.starts for controller in controllers))
+        self.runtime.stop()
+        self.assertEqual([1] * 10, [controller.stops for controller in controllers])
+
+    def test_shutdown_deadline(self):
+        self.runtime.add_controller(StubbornController(layout=self.layout))
+        started = time.monotonic()
+        with self.assertLogs("letsgo.control.runtime", "WARNING"):
+            self.runtime.stop(deadline=0.05)
+        self.assertLess(time.monotonic() - started, 0.4)
+
+
+class LayoutControllerRuntimeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.layout = Layout()
+        piece = pieces.Straight(layout=self.layout)
+        self.layout.add_piece(piece)
+        self.sensor = HallEffectSensor(
+            track_point=TrackPoint(piece, "in"), layout=self.layout
+        )
+        self.layout.add_sensor(self.sensor)
+        self.controller = DummySensorController(layout=self.layout)
+        self.layout.add_controller(self.controller)
+
+        self.received = []
+        signals.sensor_activity.connect(self.on_sensor_activity, self.sensor)
+
+    def tearDown(self):
+        signals.sensor_activity.disconnect(self.on_sensor_activity, self.sensor)
+        if self.layout.running.is_set():
+            self.layout.stop()
+
+    def on_sensor_activity(self, sender, activated, when):
+        self.received.append(activated)
+
+    def test_sensor_events_handled_on_tick(self):
+        self.layout.start()
+        self.controller.report_sensor_activity(self.sensor, True, time.time())
+        # Not on the runtime's thread, but on the next tick
+        time.sleep(0.05)
+        self.assertEqual([], self.received)
+        self.layout.tick(None, time=time.time(), time_elapsed=0)
+        self.assertEqual([True], self.received)
+
+    def test_ticker_handles_sensor_events(self):
+        ticker = Ticker(self.layout)
+        self.layout.start()
+        self.controller.report_sensor_activity(self.sensor, True, time.time())
+        # As called from the UI's main loop
+        self.assertTrue(ticker())
+        self.assertEqual([True], self.received)
+
+        # Until the layout stops
+        self.layout.stop()
+        self.assertFalse(ticker())
@@ -0,0 +1,85 @@
+import threading
+import time
+import unittest
+
+from .. import signals
+from ..control import SensorController
+from ..control.event_queue import SensorEventQueue
+from ..layout import Layout
+from ..sensor import HallEffectSensor
+from .. import pieces
+from ..track_point import TrackPoint
+
+
+class SensorEventQueueTestCase(unittest.TestCase):
+    def test_drain_in_order(self):
+        queue = SensorEventQueue(capacity=4)
+        for i in range(3):
+            queue.put(None, True, i)
+        self.assertEqual([0, 1], [event.when for event in queue.drain(maximum=2)])
+        for i in range(3, 6):
+            queue.put(None, True, i)
+        self.assertEqual(4, len(queue))
+        self.assertEqual([2, 3, 4, 5], [event.when for event in queue.drain()])
+        self.assertEqual([], queue.drain())
+
+    def test_full(self):
+        queue = SensorEventQueue(capacity=2)
+        self.assertTrue(queue.put(None, True, 0))
+        self.assertTrue(queue.put(None, False, 1))
+        self.assertFalse(queue.put(None, True, 2))
+        self.assertEqual(1, queue.dropped)
+        self.assertEqual([0, 1], [event.when for event in queue.drain()])
+
+    def test_capacity_must_be_power_of_two(self):
+        with self.assertRaises(ValueError):
+            SensorEventQueue(capacity=3)
+
+    def test_threads(self):
+        queue = SensorEventQueue(capacity=64)
+        count = 5000
+
+        def produce():
+            i = 0
+            while i < count:
+                if queue.put(None, True, i):
+                    i += 1
+                else:
+                    time.sleep(0)
+
+        received = []
+        producer = threading.Thread(target=produce)
+        producer.start()
+        while len(received) < count:
+            received.extend(event.when for event in queue.drain())
+            time.sleep(0)
+        producer.join()
+        self.assertEqual(list(range(count)), received)
+
+
+class DummySensorController(SensorController):
+    pass
+
+
+class LayoutSensorEventsTestCase(unittest.TestCase):
+    def test_handled_with_device_timestamps(self):
+        layout = Layout()
+        piece = pieces.Straight(layout=layout)
+        layout.add_piece(piece)
+        sensor = HallEffectSensor(track_point=TrackPoint(piece, "in"), layout=layout)
+        layout.add_sensor(sensor)
+        controller = DummySensorController(layout=layout)
+        layout.add_controller(controller)
+
+        received = []
+
+        def on_sensor_activity(sender, activated, when):
+            received.append((activated, when))
+
+        signals.sensor_activity.connect(on_sensor_activity, sensor)
+        controller.report_sensor_activity(sensor, True, 123.0)
+        controller.report_sensor_activity(sensor, False, 124.0)
+        self.assertEqual([], received)
+        layout.tick(None, time=125.0, time_elapsed=0)
+        self.assertEqual([(True, 123.0), (False, 124.0)], received)
+        self.assertFalse(sensor.activated)
@@ -0,0 +1,67 @@
+import math
+import unittest
+
+import numpy as np
+
+from ..layout import Layout
+from ..speed_model import PolynomialSpeedModel
+from ..track_point import TrackPoint
+from .utils import make_train, straight_line
+
+
+class FleetPredictorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.layout = Layout()
+        self.straights = straight_line(self.layout, 10)
+        self.trains = []
+        for i in range(3):
+            train = make_train(
+                self.layout, TrackPoint(self.straights[0], "in") + 30 + i * 25
+            )
+            # Change speed instantly, so these tests aren't about momentum
+            train.physics.tractive_force = train.physics.braking_force = math.inf
+            self.trains.append(train)
+
+    def test_matches_individual_predictions(self):
+        self.trains[0].maximum_motor_speed = 0.5
+        self.trains[1].maximum_motor_speed = 1
+        self.trains[1].lights_on = True
+        self.trains[2].speed_estimation.model = PolynomialSpeedModel(
+            np.linspace(-5, 5, len(PolynomialSpeedModel.proportional(1).coefficients))
+        )
+        self.trains[2].maximum_motor_speed = 0.7
+        fleet = self.layout.fleet
+        fleet.update()
+        self.assertEqual(self.trains, fleet.trains)
+        np.testing.assert_allclose(
+            [train.speed_estimation.predict() for train in self.trains], fleet.speeds
+        )
+        self.assertEqual(30, self.trains[0].speed)
+        np.testing.assert_allclose([1, 0.5], fleet.time_to(np.array(30))[:2])
+        self.assertEqual(
+            self.trains[0].physics.braking_distance(30), fleet.braking_distances()[0]
+        )
+
+    def test_changes_fall_back_until_next_tick(self):
+        fleet = self.layout.fleet
+        fleet.update()
+        self.assertEqual(0, fleet.speeds[0])
+        self.assertEqual(math.inf, fleet.time_to(np.array([10, 10, 10]))[0])
+
+        self.trains[0].maximum_motor_speed = 0.5
+        self.assertEqual(0, fleet.speeds[0])
+        self.assertEqual(30, self.trains[0].speed)
+
+        self.layout.tick(None, time=0, time_elapsed=0.5)
+        self.assertEqual(30, fleet.speeds[0])
+        position = self.trains[0].position
+        self.assertEqual(self.straights[2], position.piece)
+        self.assertAlmostEqual(45 - 32, position.offset)
+
+    def test_trains_added_and_removed(self):
+        fleet = self.layout.fleet
+        fleet.update()
+        self.layout.remove_train(self.trains[1])
+        fleet.update()
+        self.assertEqual([self.trains[0], self.trains[2]], fleet.trains)
+        self.assertEqual((2,), fleet.speeds.shape)
@@ -0,0 +1,74 @@
+import math
+import unittest
+
+import numpy as np
+
+from ..kinematics import KinematicsEngine
+from ..layout import Layout
+from ..track_point import TrackPoint
+from .utils import loop_with_siding, make_train
+
+
+class KinematicsEngineTestCase(unittest.TestCase):
+    def setUp(self):
+        # A loop of sixteen curves, with a siding off some points
+        self.layout = Layout()
+        self.points, self.curves, self.siding = loop_with_siding(self.layout)
+
+        self.train = make_train(self.layout, TrackPoint(self.curves[3], "in", "out", 2))
+        self.engine = KinematicsEngine(self.layout)
+        self.layout.kinematics = self.engine
+
+    def assertSamePoint(self, expected, actual):
+        self.assertEqual(
+            (expected.piece, expected.in_anchor, expected.out_anchor),
+            (actual.piece, actual.in_anchor, actual.out_anchor),
+        )
+        self.assertAlmostEqual(expected.offset, actual.offset)
+
+    def test_matches_track_points(self):
+        start = TrackPoint(self.curves[3], "in", "out", 2)
+        for _ in range(40):
+            self.engine.step(0.1, np.array([60.0]))
+        # Twice around the loop, and a bit
+        self.assertSamePoint(start + 240, self.train.position)
+        self.assertSamePoint(start + 240 - 20, self.train.rear_position)
+        self.assertEqual(60, self.engine.velocity[0])
+
+    def test_materialises_lazily(self):
+        position = self.train._position
+        self.engine.step(0.1, np.array([10.0]))
+        self.assertIs(position, self.train._position)
+        self.assertSamePoint(
+            TrackPoint(self.curves[3], "in", "out", 3), self.train.position
+        )
+        self.assertIsNot(position, self.train._position)
+
+    def test_follows_points_and_stops_at_end_of_line(self):
+        self.points.state = "branch"
+        self.train.position = TrackPoint(self.curves[-1], "in", "out")
+        self.engine.step(10, np.array([60.0]))
+        self.assertSamePoint(
+            TrackPoint(self.siding[-1], "in", "out", 16), self.train.position
+        )
+        self.assertEqual(0, self.engine.velocity[0])
+
+    def test_layout_tick_uses_fleet_speeds(self):
+        self.train.physics.tractive_force = math.inf
+        self.train.maximum_motor_speed = 0.5
+        self.layout.tick(None, time=0, time_elapsed=0.5)
+        self.assertSamePoint(
+            TrackPoint(self.curves[3], "in", "out", 2) + 15, self.train.position
+        )
+
+        self.train.move(-5)
+        self.assertSamePoint(
+            TrackPoint(self.curves[3], "in", "out", 2) + 10, self.train.position
+        )
+
+        self.layout.kinematics = None
+        self.assertIsNone(self.train.kinematics)
+        self.train.move(5)
+        self.assertSamePoint(
+            TrackPoint(self.curves[3], "in", "out", 2) + 15, self.train.position
+        )
@@ -0,0 +1,68 @@
+import unittest
+
+from .. import signals
+from ..layout import Layout
+from ..sensor import HallEffectSensor
+from ..track_point import TrackPoint
+from .utils import make_train, straight_line
+
+
+class MagnetIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.layout = Layout()
+        self.straights = straight_line(self.layout, 20)
+        # 168 studs along
+        self.sensor = HallEffectSensor(
+            track_point=TrackPoint(self.straights[10], "in", "out", 8),
+            layout=self.layout,
+        )
+        self.layout.add_sensor(self.sensor)
+        self.layout.sensor_events.window = 0
+
+    def add_train(self, front):
+        train = make_train(
+            self.layout, TrackPoint(self.straights[0], "in") + front, magnet=True
+        )
+        train.maximum_motor_speed = 0.5
+        return train
+
+    def test_attribution(self):
+        train = self.add_train(192)
+        (match,) = self.layout.magnet_index.candidates(self.sensor)
+        self.assertEqual(train, match.train)
+        self.assertEqual(0, match.car_index)
+        self.assertAlmostEqual(-14, match.distance)
+        self.assertFalse(match.reverse)
+
+    def test_index_follows_train(self):
+        train = self.add_train(192)
+        train.move(20)
+        (match,) = self.layout.magnet_index.candidates(self.sensor)
+        self.assertAlmostEqual(-34, match.distance)
+        train.move(100)
+        self.assertEqual([], self.layout.magnet_index.candidates(self.sensor, 100))
+
+    def test_window(self):
+        self.add_train(192)
+        self.assertEqual([], self.layout.magnet_index.candidates(self.sensor, 10))
+
+    def test_ambiguous(self):
+        train, other_train = self.add_train(186), self.add_train(184)
+        received = []
+
+        def on_ambiguous(sender, matches, when):
+            received.append(matches)
+
+        signals.sensor_activity_ambiguous.connect(on_ambiguous, self.sensor)
+        with self.assertLogs("letsgo.sensor_events", "WARNING"):
+            self.sensor.activated = True
+        (matches,) = received
+        self.assertEqual([other_train, train], [match.train for match in matches])
+        # Neither train has been moved
+        self.assertEqual(186 - 176, train.position.offset)
+
+    def test_sensor_activity_corrects_position(self):
+        train = self.add_train(192)
+        self.sensor.activated = True
+        self.assertEqual(self.straights[11], train.position.piece)
+        self.assertEqual(8 + 10 - 16, train.position.offset)
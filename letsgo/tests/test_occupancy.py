@@ -0,0 +1,78 @@
+import unittest
+
+from .. import signals
+from ..layout import Layout
+from ..track_point import TrackPoint
+from .utils import loop_with_siding, make_train
+
+
+class OccupancyIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        # A loop of sixteen curves, with a siding off some points
+        self.layout = Layout()
+        self.points, self.curves, self.siding = loop_with_siding(self.layout)
+
+    def add_train(self, position):
+        return make_train(self.layout, position)
+
+    def test_occupants(self):
+        train = self.add_train(TrackPoint(self.curves[3], "in", "out", 2))
+        occupancy = self.layout.occupancy
+        self.assertEqual([train], occupancy.occupants(train.position + -10))
+        # Either way along the track
+        self.assertEqual(
+            [train], occupancy.occupants(TrackPoint(self.curves[2], "out", "in", 5))
+        )
+        self.assertEqual([], occupancy.occupants(train.position + 1))
+
+        # Around the loop a few times, across the points
+        for _ in range(20):
+            train.move(17)
+        self.assertEqual([train], occupancy.occupants(train.position + -19))
+        self.assertEqual([], occupancy.occupants(train.position + -21))
+        self.assertEqual([], occupancy.occupants(train.position + 1))
+
+    def test_pieces(self):
+        # Curves are nearly 16 studs long, so this spans three of them
+        train = self.add_train(TrackPoint(self.curves[3], "in", "out", 2))
+        self.assertEqual(set(self.curves[1:4]), self.layout.occupancy.pieces(train))
+
+    def test_gap_ahead(self):
+        first = self.add_train(TrackPoint(self.curves[3], "in", "out", 2))
+        second = self.add_train(TrackPoint(self.curves[3], "in", "out", 2) + 50)
+        occupancy = self.layout.occupancy
+        gap = occupancy.gap_ahead(first)
+        self.assertIs(second, gap.train)
+        self.assertAlmostEqual(30, gap.distance)
+        self.assertIsNone(occupancy.gap_ahead(first, maximum_distance=20))
+
+        # Trains coming the other way count too
+        oncoming = self.add_train(TrackPoint(self.curves[10], "out", "in"))
+        gap = occupancy.gap_ahead(second)
+        self.assertIs(oncoming, gap.train)
+        self.assertAlmostEqual(
+            second.position.distance_to(TrackPoint(self.curves[11], "in", "out")),
+            gap.distance,
+        )
+
+    def test_overlaps_are_announced(self):
+        first = self.add_train(TrackPoint(self.curves[3], "in", "out", 2))
+        second = self.add_train(TrackPoint(self.curves[3], "in", "out", 2) + 30)
+        overlapping = []
+
+        def on_overlapping(sender, other):
+            overlapping.append({sender, other})
+
+        signals.trains_overlapping.connect(on_overlapping)
+        try:
+            first.move(5)
+            self.assertEqual([], overlapping)
+            first.move(10)
+            first.move(1)
+        finally:
+            signals.trains_overlapping.disconnect(on_overlapping)
+        self.assertEqual([{first, second}], overlapping)
+        self.assertEqual(1, len(self.layout.occupancy.overlaps()))
+
+        self.layout.remove_train(second)
+        self.assertEqual(set(), self.layout.occupancy.overlaps())
@@ -0,0 +1,91 @@
+import unittest
+
+from .. import pieces
+from ..kinematics import KinematicsEngine
+from ..layout import Layout
+from ..physics import FixedSteps, TrainPhysics
+from ..topham_hatt import TophamHatt
+from ..track_point import TrackPoint
+from ..train import Car, Train
+
+
+class TrainPhysicsTestCase(unittest.TestCase):
+    def make_train(self, layout=None, **kwargs):
+        return Train(
+            cars=[Car(length=20, bogey_offsets=[4, 16]) for _ in range(3)],
+            layout=layout,
+            **kwargs
+        )
+
+    def test_mass_from_cars(self):
+        train = self.make_train()
+        self.assertEqual(3 * 20 * 12, train.mass)
+        train.cars[0].mass = 1000
+        self.assertEqual(1000 + 2 * 20 * 12, train.mass)
+        self.assertEqual(
+            TrainPhysics.tractive_force / train.mass, train.physics.max_acceleration
+        )
+
+    def test_fixed_steps(self):
+        steps = FixedSteps(0.01)
+        self.assertEqual([2, 3, 0, 1], [steps(t) for t in (0.025, 0.025, 0.004, 0.006)])
+
+    def test_acceleration_is_limited(self):
+        physics = self.make_train().physics
+        distance = physics.advance(60, 0.1)
+        self.assertAlmostEqual(physics.max_acceleration * 0.1, physics.velocity)
+        # Ten steps of ever faster, starting from a standstill
+        self.assertAlmostEqual(physics.max_acceleration * 0.01**2 * 55, distance)
+
+    def test_stops_within_braking_distance(self):
+        physics = self.make_train().physics
+        physics.velocity = 60
+        braking_distance = physics.braking_distance()
+        distance = 0.0
+        while physics.velocity:
+            distance += physics.advance(0, 0.05)
+        self.assertLessEqual(distance, braking_distance)
+        # The closed form is continuous, so a little cautious compared to steps
+        self.assertAlmostEqual(braking_distance, distance, delta=60 * physics.step)
+        self.assertAlmostEqual(60, physics.stopping_speed(braking_distance))
+
+    def test_engine_matches_per_train(self):
+        positions = []
+        for use_engine in (False, True):
+            layout = Layout()
+            straights = [pieces.Straight(layout=layout) for _ in range(20)]
+            for piece in straights:
+                layout.add_piece(piece, announce=False)
+            for previous, piece in zip(straights, straights[1:]):
+                previous.anchors["out"] += piece.anchors["in"]
+            train = self.make_train(
+                layout, position=TrackPoint(straights[0], "in") + 70
+            )
+            layout.add_train(train)
+            if use_engine:
+                layout.kinematics = KinematicsEngine(layout)
+            train.maximum_motor_speed = 1
+            for i in range(20):
+                if i == 12:
+                    train.maximum_motor_speed = 0.25
+                layout.tick(None, time=i * 0.05, time_elapsed=0.05)
+            positions.append(
+                (
+                    straights.index(train.position.piece),
+                    train.position.offset,
+                    train.velocity,
+                )
+            )
+        self.assertEqual(positions[0][0], positions[1][0])
+        self.assertAlmostEqual(positions[0][1], positions[1][1])
+        self.assertAlmostEqual(positions[0][2], positions[1][2])
+
+    def test_dispatcher_allows_for_braking_distance(self):
+        topham_hatt = TophamHatt(Layout(), stop_before_end_of_the_line=16)
+        train = self.make_train()
+        top_speed = train.speed_estimation.predict(motor_speed=1)
+        self.assertEqual(0, topham_hatt.stopping_motor_speed(train, 10))
+        motor_speed = topham_hatt.stopping_motor_speed(train, 16 + 20)
+        self.assertAlmostEqual(
+            20, train.physics.braking_distance(motor_speed * top_speed)
+        )
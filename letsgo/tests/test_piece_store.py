@@ -0,0 +1,119 @@
+import io
+import math
+import unittest
+
+import yaml
+
+from letsgo import pieces
+from letsgo.layout import Layout
+from letsgo.layout_parser import LetsGoLayoutParser
+from letsgo.layout_serializer import LetsGoLayoutSerializer
+from letsgo.piece_store import PieceStore
+from letsgo.pieces.curve import CurveDirection
+from letsgo.track import Position
+from letsgo.track_point import TrackPoint
+
+
+class PieceStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.layout = Layout()
+        self.pieces = [
+            pieces.Straight(layout=self.layout, placement=Position(10, 20, 1)),
+            pieces.RightPoints(layout=self.layout),
+            pieces.Curve(layout=self.layout, direction=CurveDirection.right),
+            pieces.Straight(layout=self.layout),
+            pieces.Crossover(layout=self.layout),
+        ]
+        for piece in self.pieces:
+            self.layout.add_piece(piece)
+        straight, points, curve, branch_straight, crossover = self.pieces
+        straight.anchors["out"] += points.anchors["in"]
+        points.anchors["out"] += curve.anchors["out"]
+        points.anchors["branch"] += branch_straight.anchors["in"]
+        branch_straight.anchors["out"] += crossover.anchors["right"]
+
+    def assertPositionsEqual(self, expected, actual):
+        self.assertAlmostEqual(expected.x, actual.x)
+        self.assertAlmostEqual(expected.y, actual.y)
+        self.assertAlmostEqual(expected.angle % math.tau, actual.angle % math.tau)
+
+    def test_from_layout_positions(self):
+        store = PieceStore.from_layout(self.layout)
+        self.assertEqual(len(self.pieces), len(store))
+        for piece in self.pieces:
+            self.assertPositionsEqual(piece.position, store.get(piece.id).position)
+
+    def test_from_yaml(self):
+        fp = io.BytesIO()
+        LetsGoLayoutSerializer().serialize(fp, self.layout)
+        doc = yaml.safe_load(fp.getvalue())
+        for piece_data in doc["pieces"]:
+            if piece_data["id"] == self.pieces[2].id:
+                piece_data["direction"] = "right"
+        store = PieceStore.from_yaml(doc["pieces"])
+        for piece in self.pieces:
+            view = store.get(piece.id)
+            self.assertEqual(type(piece), view.piece_class)
+            self.assertPositionsEqual(piece.position, view.position)
+
+    def test_parse_piece_store(self):
+        fp = io.BytesIO()
+        LetsGoLayoutSerializer().serialize(fp, self.layout)
+        fp.seek(0)
+        store = LetsGoLayoutParser().parse_piece_store(fp)
+        self.assertEqual(len(self.pieces), len(store))
+        self.assertPositionsEqual(self.pieces[0].position, store[0].position)
+
+    def test_track_point_on_views(self):
+        store = PieceStore.from_layout(self.layout)
+        straight, points, curve = (store.get(piece.id) for piece in self.pieces[:3])
+        track_point = TrackPoint(straight, "in")
+        track_point += 16 + 32 + 4
+        self.assertEqual(curve, track_point.piece)
+        self.assertEqual("out", track_point.in_anchor)
+        self.assertEqual(4, track_point.offset)
+
+    def test_track_graph_is_shared_until_topology_changes(self):
+        store = PieceStore.from_layout(self.layout)
+        start = TrackPoint(store.get(self.pieces[0].id), "in")
+        self.assertEqual(16 + 32 + 4, start.distance_to(start + 16 + 32 + 4))
+        track_graph = store.track_graph
+        self.assertIs(track_graph, (start + 20)._track_graph())
+        store.disconnect(store.get(self.pieces[0].id).index, "out")
+        self.assertIsNot(track_graph, start._track_graph())
+
+    def test_to_layout(self):
+        store = PieceStore.from_layout(self.layout)
+        layout = Layout()
+        store.to_layout(layout)
+        for piece in self.pieces:
+            copied_piece = layout.pieces[piece.id]
+            self.assertEqual(type(piece), type(copied_piece))
+            self.assertPositionsEqual(piece.position, copied_piece.position)
+            for anchor_name, anchor in piece.anchors.items():
+                next_piece, next_anchor_name = anchor.next(piece)
+                copied_next_piece, copied_next_anchor_name = copied_piece.anchors[
+                    anchor_name
+                ].next(copied_piece)
+                self.assertEqual(
+                    next_piece and next_piece.id,
+                    copied_next_piece and copied_next_piece.id,
+                )
+                self.assertEqual(next_anchor_name, copied_next_anchor_name)
+
+    def test_intersect(self):
+        store = PieceStore.from_layout(self.layout)
+        x, y, _ = self.pieces[0].position
+        self.assertIn(0, store.intersect((x - 1, y - 1, x + 1, y + 1)))
+        self.assertEqual(0, len(store.intersect((x + 1000, y, x + 1001, y + 1))))
+
+    def test_large_layout_is_compact(self):
+        store = PieceStore()
+        previous = store.add(pieces.Straight, placement=Position(0, 0, 0))
+        for _ in range(50000):
+            index = store.add(pieces.Straight)
+            store.connect(previous, "out", index, "in")
+            previous = index
+        store.update_positions()
+        self.assertAlmostEqual(50000 * 16, store.positions[50000, 0])
+        self.assertLess(store.nbytes / len(store), 128)
@@ -0,0 +1,49 @@
+import unittest
+
+from letsgo import pieces
+from letsgo.pieces.curve import CurveDirection
+
+
+class PieceTablesTestCase(unittest.TestCase):
+    def test_tables_are_shared_between_instances(self):
+        piece_1, piece_2 = pieces.Straight(layout=None), pieces.Straight(layout=None)
+        self.assertIs(piece_1.traversals("in"), piece_2.traversals("in"))
+        self.assertIs(piece_1.relative_positions(), piece_2.relative_positions())
+
+    def test_tables_are_immutable(self):
+        piece = pieces.Straight(layout=None)
+        with self.assertRaises(TypeError):
+            piece.traversals("in")["branch"] = (1, True)  # type: ignore
+        with self.assertRaises(TypeError):
+            piece.relative_positions()["branch"] = None  # type: ignore
+
+    def test_subclasses_dont_share_tables(self):
+        straight, half_straight = (
+            pieces.Straight(layout=None),
+            pieces.HalfStraight(layout=None),
+        )
+        self.assertEqual((16, True), straight.traversals("in")["out"])
+        self.assertEqual((8, True), half_straight.traversals("in")["out"])
+
+    def test_curve_flip_updates_relative_positions(self):
+        curve = pieces.Curve(layout=None, direction=CurveDirection.left)
+        left_out = curve.relative_positions()["out"]
+        curve.flip()
+        right_out = curve.relative_positions()["out"]
+        self.assertEqual(left_out.x, right_out.x)
+        self.assertEqual(-left_out.y, right_out.y)
+        self.assertIs(
+            right_out,
+            pieces.Curve(
+                layout=None, direction=CurveDirection.right
+            ).relative_positions()["out"],
+        )
+
+    def test_points_state_updates_available_traversal(self):
+        points = pieces.LeftPoints(layout=None)
+        self.assertEqual(("out", 32), points.available_traversal("in"))
+        points.state = "branch"
+        self.assertEqual(
+            ("branch", points.branch_length), points.available_traversal("in")
+        )
+        self.assertEqual(("in", 32), points.available_traversal("out"))
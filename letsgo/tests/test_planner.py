@@ -0,0 +1,181 @@
+import math
+import unittest
+
+from .. import pieces
+from ..layout import Layout
+from ..planner import CooperativePlanner
+from ..routeing import Itinerary, Stop
+from ..station import Platform, Station
+from ..topham_hatt import TophamHatt
+from ..track_point import TrackPoint
+from .utils import make_train, straight_line
+
+
+class CooperativePlannerTestCase(unittest.TestCase):
+    def setUp(self):
+        # Single track from west to east, with a passing loop in the middle
+        self.layout = Layout()
+        self.west, self.main, self.loop, self.east = (
+            straight_line(self.layout, 6),
+            straight_line(self.layout, 4),
+            straight_line(self.layout, 4),
+            straight_line(self.layout, 6),
+        )
+        self.west_points = pieces.LeftPoints(layout=self.layout)
+        self.east_points = pieces.RightPoints(layout=self.layout)
+        self.layout.add_piece(self.west_points, announce=False)
+        self.layout.add_piece(self.east_points, announce=False)
+        self.west[-1].anchors["out"] += self.west_points.anchors["in"]
+        self.west_points.anchors["out"] += self.main[0].anchors["in"]
+        self.west_points.anchors["branch"] += self.loop[0].anchors["in"]
+        self.main[-1].anchors["out"] += self.east_points.anchors["out"]
+        self.loop[-1].anchors["out"] += self.east_points.anchors["branch"]
+        self.east_points.anchors["in"] += self.east[0].anchors["in"]
+        self.planner = CooperativePlanner(self.layout)
+
+    def add_train(self, position, destination=None):
+        itinerary = None
+        if destination:
+            station = Station(platforms=[Platform(destination)])
+            self.layout.add_station(station)
+            itinerary = Itinerary(stops=[Stop(station)])
+        return make_train(
+            self.layout,
+            position,
+            itinerary=itinerary,
+            itinerary_index=0 if itinerary else None,
+        )
+
+    def assertNoOverlaps(self, block):
+        reservations = self.layout.reservation_table.block_reservations(block)
+        for earlier, later in zip(reservations, reservations[1:]):
+            self.assertLessEqual(earlier.end, later.start)
+
+    def test_trains_pass_in_loop(self):
+        eastbound = self.add_train(
+            TrackPoint(self.west[0], "in") + 30, TrackPoint(self.east[-2], "in")
+        )
+        westbound = self.add_train(
+            TrackPoint(self.east[-1], "out", "in") + 30,
+            TrackPoint(self.west[1], "out", "in"),
+        )
+        plans = self.planner.plan(0.0)
+        self.assertEqual({eastbound, westbound}, set(plans))
+        # They go different ways round the loop, neither waiting for the other
+        self.assertNotEqual(plans[eastbound].segments[1], plans[westbound].segments[1])
+        for plan in plans.values():
+            speed = self.planner.speed(plan.train)
+            self.assertAlmostEqual(66 / speed, plan.departures[1])
+        for block in (self.west_points, self.east_points, *self.east):
+            self.assertNoOverlaps(block)
+
+    def test_trains_take_turns_at_points(self):
+        first = self.add_train(
+            TrackPoint(self.main[1], "in") + 8, TrackPoint(self.east[-1], "in")
+        )
+        second = self.add_train(
+            TrackPoint(self.loop[1], "in") + 8, TrackPoint(self.east[-3], "in")
+        )
+        plans = self.planner.plan(0.0)
+        self.assertEqual({first, second}, set(plans))
+        # The second waits for the first to clear the points
+        first_points, second_points = [
+            [
+                reservation
+                for reservation in self.layout.reservation_table.block_reservations(
+                    self.east_points
+                )
+                if reservation.train is train
+            ]
+            for train in (first, second)
+        ]
+        self.assertLessEqual(first_points[0].end, second_points[0].start)
+        self.assertGreater(plans[second].arrival, plans[first].arrival)
+
+    def test_unplannable_trains_go_first_next_time(self):
+        reachable = self.add_train(
+            TrackPoint(self.west[0], "in") + 30, TrackPoint(self.main[2], "in")
+        )
+        blocked = self.add_train(
+            TrackPoint(self.east[0], "in") + 30, TrackPoint(self.east[-1], "in")
+        )
+        # In the way, and going nowhere
+        self.add_train(TrackPoint(self.east[3], "in") + 8)
+        plans = self.planner.plan(0.0)
+        self.assertEqual({reachable}, set(plans))
+        self.assertEqual([blocked, reachable], self.planner.priorities[:2])
+
+    def test_head_on(self):
+        eastbound = self.add_train(
+            TrackPoint(self.east[0], "in") + 30, TrackPoint(self.east[-1], "in")
+        )
+        # Planned for after the eastbound, but can't get past it
+        westbound = self.add_train(
+            TrackPoint(self.east[4], "out", "in") + 8,
+            TrackPoint(self.west[1], "out", "in"),
+        )
+        plans = self.planner.plan(0.0)
+        # The eastbound can't get to where the westbound is stuck either
+        self.assertEqual({}, plans)
+        table = self.layout.reservation_table
+        for train in (eastbound, westbound):
+            self.assertTrue(table.reservations(train))
+            for reservation in table.reservations(train):
+                self.assertEqual(math.inf, reservation.end)
+        for block in self.east:
+            self.assertNoOverlaps(block)
+
+    def test_dispatcher_sets_points_for_plans(self):
+        topham_hatt = TophamHatt(
+            self.layout, slow_down_distance=200, planner=self.planner
+        )
+        eastbound = self.add_train(
+            TrackPoint(self.west[0], "in") + 30, TrackPoint(self.east[-2], "in")
+        )
+        westbound = self.add_train(
+            TrackPoint(self.east[-1], "out", "in") + 30,
+            TrackPoint(self.west[1], "out", "in"),
+        )
+        topham_hatt.tick(None, time=0, time_elapsed=0)
+        plans = self.planner.plans
+        self.assertEqual({eastbound, westbound}, set(plans))
+        # Each set of facing points is set the way the train coming to it goes
+        self.assertEqual(plans[eastbound].segments[1].head[2], self.west_points.state)
+        self.assertEqual(plans[westbound].segments[1].head[2], self.east_points.state)
+        self.assertEqual(
+            {"out", "branch"}, {self.west_points.state, self.east_points.state}
+        )
+
+    def test_dispatcher_holds_trains_until_departure(self):
+        topham_hatt = TophamHatt(
+            self.layout, slow_down_distance=200, planner=self.planner
+        )
+        first = self.add_train(
+            TrackPoint(self.main[1], "in") + 8, TrackPoint(self.east[-1], "in")
+        )
+        second = self.add_train(
+            TrackPoint(self.loop[1], "in") + 8, TrackPoint(self.east[-3], "in")
+        )
+        topham_hatt.tick(None, time=0, time_elapsed=0)
+        plan = self.planner.plans[second]
+        self.assertGreater(plan.departures[0], 0)
+        # The first to the points is on its way, as it gets there as planned
+        self.assertGreater(
+            topham_hatt.follow_plan(first, self.planner.plans[first], math.inf), 0
+        )
+        # Held where it is until it's time to set off
+        self.assertEqual(0, topham_hatt.follow_plan(second, plan, math.inf))
+        topham_hatt.tick(None, time=plan.departures[0], time_elapsed=0)
+        self.assertGreater(topham_hatt.follow_plan(second, plan, math.inf), 0)
+
+    def test_dispatcher_holds_unplanned_trains(self):
+        topham_hatt = TophamHatt(self.layout, planner=self.planner)
+        blocked = self.add_train(
+            TrackPoint(self.east[0], "in") + 30, TrackPoint(self.east[-1], "in")
+        )
+        self.add_train(TrackPoint(self.east[3], "in") + 8)
+        blocked.maximum_motor_speed = 1
+        topham_hatt.tick(None, time=0, time_elapsed=0)
+        self.assertNotIn(blocked, self.planner.plans)
+        self.assertEqual(0, blocked.speed_limits[topham_hatt])
+        self.assertEqual(0, blocked.speed)
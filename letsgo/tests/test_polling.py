@@ -0,0 +1,46 @@
+import unittest
+
+import numpy as np
+
+from ..control.polling import AdaptiveInterval, EdgeDetector
+
+
+class EdgeDetectorTestCase(unittest.TestCase):
+    def test_reports_edges_only(self):
+        detector = EdgeDetector(3)
+        self.assertEqual([], detector.update(np.array([False, False, False]), 0))
+        self.assertEqual(
+            [(1, True)], detector.update(np.array([False, True, False]), 1)
+        )
+        self.assertEqual([], detector.update(np.array([False, True, False]), 2))
+        self.assertEqual(
+            [(0, True), (1, False)], detector.update(np.array([True, False, False]), 3)
+        )
+
+    def test_debounce(self):
+        detector = EdgeDetector(1, debounce=0.01)
+        self.assertEqual([(0, True)], detector.update(np.array([True]), 1.0))
+        # Bouncing straight after the edge is ignored
+        self.assertEqual([], detector.update(np.array([False]), 1.002))
+        self.assertEqual([], detector.update(np.array([True]), 1.004))
+        # If it has settled into a new state after the debounce period, that's reported
+        self.assertEqual([(0, False)], detector.update(np.array([False]), 1.02))
+
+
+class AdaptiveIntervalTestCase(unittest.TestCase):
+    def test_backs_off_when_idle(self):
+        interval = AdaptiveInterval(minimum=0.005, maximum=0.02, backoff=2)
+        self.assertEqual(0.01, interval.update(False))
+        self.assertEqual(0.02, interval.update(False))
+        self.assertEqual(0.02, interval.update(False))
+        self.assertEqual(0.005, interval.update(True))
+
+    def test_speeds_up_when_activity_is_expected(self):
+        interval = AdaptiveInterval(minimum=0.005, maximum=0.02, backoff=10, lead=0.05)
+        self.assertEqual(0.02, interval.update(False))
+        # Activity that's a way off doesn't let it back off further
+        self.assertEqual(0.02, interval.update(False, expected_in=0.3))
+        # Wakes up in time to poll quickly once it's due
+        self.assertAlmostEqual(0.01, interval.update(False, expected_in=0.06))
+        self.assertEqual(0.005, interval.update(False, expected_in=0.04))
+        self.assertEqual(0.005, interval.update(False, expected_in=0.04))
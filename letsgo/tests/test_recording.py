@@ -0,0 +1,144 @@
+import math
+import os
+import tempfile
+import time
+import unittest
+
+from .. import pieces, signals
+from ..layout import Layout
+from ..recording import (
+    MotorSpeedRecord,
+    Recorder,
+    Replayer,
+    SensorActivityRecord,
+    TickRecord,
+    TrainSpottedRecord,
+    read_records,
+)
+from ..sensor import HallEffectSensor
+from ..track_point import TrackPoint
+from ..train import Car, Train
+
+
+class RecordingTestCase(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".lgrec")
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def make_layout(self):
+        layout = Layout()
+        straights = [
+            pieces.Straight(id=f"straight-{i}", layout=layout) for i in range(20)
+        ]
+        for piece in straights:
+            layout.add_piece(piece, announce=False)
+        for previous, piece in zip(straights, straights[1:]):
+            previous.anchors["out"] += piece.anchors["in"]
+        sensor = HallEffectSensor(
+            id="sensor",
+            track_point=TrackPoint(straights[10], "in", "out", 8),
+            layout=layout,
+        )
+        layout.add_sensor(sensor)
+        train = Train(
+            id="train",
+            cars=[Car(length=20, bogey_offsets=[4, 16], magnet_offset=10)],
+            position=TrackPoint(straights[0], "in") + 150,
+            layout=layout,
+        )
+        layout.add_train(train)
+        layout.sensor_events.window = 0
+        return layout, sensor, train
+
+    def record_session(self):
+        layout, sensor, train = self.make_layout()
+        spotted = []
+
+        def on_train_spotted(sender, position, **kwargs):
+            spotted.append((position.piece.id, position.offset))
+
+        signals.train_spotted.connect(on_train_spotted, train)
+        with Recorder(layout, self.path):
+            train.maximum_motor_speed = 0.5
+            for i in range(5):
+                signals.tick.send(layout, time=i * 0.1, time_elapsed=0.1)
+                layout.tick(layout, time=i * 0.1, time_elapsed=0.1)
+            sensor.report_activity(True, 1000.0)
+            sensor.report_activity(False, 1000.1)
+        return spotted
+
+    def test_round_trip(self):
+        self.record_session()
+        records = list(read_records(self.path))
+        self.assertEqual(
+            [MotorSpeedRecord] + [TickRecord] * 5,
+            [type(record) for record in records[:6]],
+        )
+        self.assertEqual("train", records[0].train_id)
+        self.assertEqual(0.5, records[0].motor_speed)
+        # Whether the layout handles the activation before it's recorded depends on
+        # the order the signal's receivers are called in
+        self.assertCountEqual(
+            [
+                (TrainSpottedRecord, ("train", "sensor", 1000.0)),
+                (SensorActivityRecord, ("sensor", True, 1000.0)),
+            ],
+            [(type(record), record[1:]) for record in records[6:8]],
+        )
+        self.assertEqual(("sensor", False, 1000.1), records[8][1:])
+        timestamps = [record.timestamp for record in records]
+        self.assertEqual(sorted(timestamps), timestamps)
+
+    def test_grows_past_chunk_size(self):
+        layout, _, _ = self.make_layout()
+        recorder = Recorder(layout, self.path)
+        recorder.chunk_size = 64
+        with recorder:
+            for i in range(100):
+                signals.tick.send(layout, time=i, time_elapsed=1)
+        records = list(read_records(self.path))
+        self.assertEqual(list(range(100)), [record.time for record in records])
+        self.assertEqual(8 + 100 * 25, os.path.getsize(self.path))
+
+    def test_replay(self):
+        recorded_spottings = self.record_session()
+        layout, sensor, train = self.make_layout()
+        replayed_spottings = []
+
+        def on_train_spotted(sender, position, **kwargs):
+            replayed_spottings.append((position.piece.id, position.offset))
+
+        signals.train_spotted.connect(on_train_spotted, train)
+        count, _ = Replayer(layout, self.path).replay(speed=math.inf)
+        self.assertEqual(9, count)
+        self.assertEqual(recorded_spottings, replayed_spottings)
+        self.assertFalse(sensor.activated)
+
+    def test_replay_batches_on_ticks(self):
+        def run(layout, sensor, train):
+            layout.sensor_events.window = 0.05
+            train.maximum_motor_speed = 0.5
+            for i in range(6):
+                when = 1000 + i * 0.03
+                signals.tick.send(layout, time=when, time_elapsed=0.03)
+                layout.tick(layout, time=when, time_elapsed=0.03)
+                if i == 1:
+                    # Attributed on the first tick at least a window after it
+                    sensor.report_activity(True, when + 0.01)
+                    sensor.report_activity(False, when + 0.02)
+                    # Only the ticks, not how long the session took, decide the batches
+                    time.sleep(0.06)
+
+        layout, sensor, train = self.make_layout()
+        with Recorder(layout, self.path):
+            run(layout, sensor, train)
+        recorded_position = train.position
+
+        layout, sensor, train = self.make_layout()
+        layout.sensor_events.window = 0.05
+        Replayer(layout, self.path).replay(speed=math.inf)
+        self.assertEqual(recorded_position.piece.id, train.position.piece.id)
+        self.assertAlmostEqual(recorded_position.offset, train.position.offset)
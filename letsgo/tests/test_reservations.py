@@ -0,0 +1,80 @@
+import math
+import unittest
+
+from ..layout import Layout
+from ..reservations import ReservationTable
+from ..track_point import TrackPoint
+from .utils import make_train, straight_line
+
+
+class ReservationTableTestCase(unittest.TestCase):
+    def setUp(self):
+        self.layout = Layout()
+        self.straights = straight_line(self.layout, 20)
+        self.table = self.layout.reservation_table
+
+    def add_train(self, front):
+        return make_train(self.layout, TrackPoint(self.straights[0], "in") + front)
+
+    def test_conflicts(self):
+        first, second = self.add_train(40), self.add_train(100)
+        block = self.straights[10]
+        self.assertEqual([], self.table.reserve(first, [(block, 10, 20)]))
+        self.assertEqual([], self.table.reserve(second, [(block, 30, 40)]))
+
+        (conflict,) = self.table.reserve(second, [(block, 15, 25), (block, 50, 60)])
+        self.assertIs(first, conflict.train)
+        # Nothing was reserved
+        self.assertEqual(1, len(self.table.reservations(second)))
+
+        self.assertTrue(self.table.is_free(block, 20, 30))
+        self.assertFalse(self.table.is_free(block, 19, 21))
+        self.assertTrue(self.table.is_free(block, 15, 25, train=first))
+        self.assertEqual(20, self.table.next_free(block, 12, 5))
+        self.assertEqual(40, self.table.next_free(block, 12, 15))
+        self.assertEqual(12, self.table.next_free(block, 12, 15, train=first))
+
+        # A train's own overlapping reservations are merged
+        self.table.reserve(first, [(block, 5, 12)])
+        self.assertEqual(
+            [(5, 20), (30, 40)],
+            [(r.start, r.end) for r in self.table.block_reservations(block)],
+        )
+
+        self.table.expire(25)
+        self.assertEqual([], self.table.reservations(first))
+        self.assertNotIn(first, self.table._trains)
+        self.layout.remove_train(second)
+        self.assertEqual([], self.table.block_reservations(block))
+
+    def test_expected_intervals(self):
+        train = self.add_train(40)
+        train.physics.tractive_force = math.inf
+        train.maximum_motor_speed = 1
+        self.layout.fleet.update()
+        speed = train.speed
+        self.assertEqual([], self.table.reserve_ahead(train, 100, 40))
+        reservations = sorted(
+            self.table.reservations(train), key=lambda r: self.straights.index(r.block)
+        )
+        # From the rear of the train, at 20 studs, to 40 studs ahead of its front at 40
+        self.assertEqual(
+            self.straights[1:5], [reservation.block for reservation in reservations]
+        )
+        margin = self.table.margin
+        self.assertEqual(100 - margin, reservations[0].start)
+        self.assertAlmostEqual(100 + 12 / speed + margin, reservations[0].end)
+        self.assertAlmostEqual(
+            100 + (64 - 20 - 20) / speed - margin, reservations[3].start
+        )
+        self.assertAlmostEqual(100 + (80 - 20) / speed + margin, reservations[3].end)
+
+        # Stopped trains hold their blocks indefinitely
+        train.maximum_motor_speed = 0
+        self.layout.fleet.update()
+        (interval,) = [
+            interval
+            for interval in self.table.expected_intervals(train, 100)
+            if interval[0] is self.straights[2]
+        ]
+        self.assertEqual(math.inf, interval[2])
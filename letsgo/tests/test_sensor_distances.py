@@ -0,0 +1,82 @@
+import math
+import unittest
+import unittest.mock
+
+from .. import pieces
+from ..layout import Layout
+from ..sensor import HallEffectSensor
+from ..track_point import TrackPoint
+from ..train import Car, Train
+
+
+class SensorDistancesTestCase(unittest.TestCase):
+    def setUp(self):
+        # Three straights, then some points leading on to either one or two more
+        self.layout = Layout()
+        self.straights = [pieces.Straight(layout=self.layout) for _ in range(3)]
+        self.points = pieces.RightPoints(layout=self.layout)
+        self.out = pieces.Straight(layout=self.layout)
+        self.branch = [pieces.Straight(layout=self.layout) for _ in range(2)]
+        for piece in [*self.straights, self.points, self.out, *self.branch]:
+            self.layout.add_piece(piece, announce=False)
+        for previous, piece in zip(self.straights, self.straights[1:]):
+            previous.anchors["out"] += piece.anchors["in"]
+        self.straights[-1].anchors["out"] += self.points.anchors["in"]
+        self.points.anchors["out"] += self.out.anchors["in"]
+        self.points.anchors["branch"] += self.branch[0].anchors["in"]
+        self.branch[0].anchors["out"] += self.branch[1].anchors["in"]
+
+        self.first, self.second, self.out_sensor, self.branch_sensor = sensors = [
+            HallEffectSensor(
+                track_point=TrackPoint(piece, "in", "out", 8), layout=self.layout
+            )
+            for piece in (
+                self.straights[0],
+                self.straights[2],
+                self.out,
+                self.branch[1],
+            )
+        ]
+        for sensor in sensors:
+            self.layout.add_sensor(sensor)
+
+    def test_distances(self):
+        distances = self.layout.sensor_distances
+        self.assertEqual(32, distances.distance(self.first, self.second))
+        self.assertEqual(32, distances.distance(self.second, self.first, True, True))
+        self.assertEqual(math.inf, distances.distance(self.second, self.first))
+        self.assertEqual(8 + 32 + 8, distances.distance(self.second, self.out_sensor))
+        self.assertEqual(math.inf, distances.distance(self.second, self.branch_sensor))
+
+    def test_next_sensor(self):
+        distances = self.layout.sensor_distances
+        self.assertEqual((self.second, False, 32), distances.next_sensor(self.first))
+        self.assertEqual(
+            (self.first, True, 32), distances.next_sensor(self.second, True)
+        )
+        self.assertIsNone(distances.next_sensor(self.out_sensor))
+
+    def test_follows_points_state(self):
+        distances = self.layout.sensor_distances
+        self.assertIs(distances, self.layout.sensor_distances)
+        self.points.state = "branch"
+        distances = self.layout.sensor_distances
+        self.assertEqual(math.inf, distances.distance(self.second, self.out_sensor))
+        self.assertAlmostEqual(
+            8 + self.points.branch_length + 16 + 8,
+            distances.distance(self.second, self.branch_sensor),
+        )
+
+    def test_distance_travelled_in_reverse(self):
+        train = Train(cars=[Car(length=20, bogey_offsets=[4, 16])], layout=self.layout)
+        last_position = TrackPoint(self.second.track_point.piece, "out", offset=10)
+        position = TrackPoint(self.first.track_point.piece, "out", offset=6)
+        # Looked up in the matrix, rather than searched for along the track
+        with unittest.mock.patch.object(
+            TrackPoint, "distance_to", side_effect=AssertionError
+        ):
+            distance = train.speed_estimation._get_distance_travelled(
+                last_position, position, self.second, self.first, True, True
+            )
+        # Two studs after the second sensor, to two before the first
+        self.assertEqual(32 - 2 - 2, distance)
@@ -0,0 +1,59 @@
+import unittest
+
+from .. import signals
+from ..layout import Layout
+from ..sensor import HallEffectSensor
+from ..track_point import TrackPoint
+from .utils import make_train, straight_line
+
+
+class SensorEventAggregatorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.layout = Layout()
+        self.straights = straight_line(self.layout, 20)
+        # 120 and 125 studs along
+        self.sensors = [
+            HallEffectSensor(
+                track_point=TrackPoint(self.straights[7], "in", "out", offset),
+                layout=self.layout,
+            )
+            for offset in (8, 13)
+        ]
+        for sensor in self.sensors:
+            self.layout.add_sensor(sensor)
+        # Magnets 118 and 140 studs along
+        self.trains = [self.add_train(front) for front in (128, 150)]
+        self.spotted = []
+        signals.train_spotted.connect(self.on_train_spotted)
+
+    def tearDown(self):
+        signals.train_spotted.disconnect(self.on_train_spotted)
+
+    def on_train_spotted(self, sender, **kwargs):
+        self.spotted.append(sender)
+
+    def add_train(self, front):
+        train = make_train(
+            self.layout, TrackPoint(self.straights[0], "in") + front, magnet=True
+        )
+        train.maximum_motor_speed = 0.5
+        return train
+
+    def test_joint_assignment(self):
+        # Greedily, both activations would be attributed to the first train
+        self.layout.sensor_events.window = 10
+        for sensor in self.sensors:
+            sensor.activated = True
+        self.assertEqual([], self.spotted)
+        self.layout.sensor_events.flush()
+        self.assertCountEqual(self.trains, self.spotted)
+        self.assertEqual(130 - 128, self.trains[0].position.offset)
+        self.assertEqual(135 - 128, self.trains[1].position.offset)
+
+    def test_window_elapses_on_tick(self):
+        self.layout.sensor_events.window = 0.01
+        self.sensors[0].report_activity(True, 100.0)
+        self.layout.tick(None, time=100.005, time_elapsed=0)
+        self.assertEqual([], self.spotted)
+        self.layout.tick(None, time=100.01, time_elapsed=0)
+        self.assertEqual([self.trains[0]], self.spotted)
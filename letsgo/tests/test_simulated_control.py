@@ -0,0 +1,135 @@
+import asyncio
+import time
+import unittest
+
+from .. import signals
+from ..control import (
+    SimulatedMaestroController,
+    SimulatedPoweredUpController,
+    TrackSimulator,
+)
+from ..layout import Layout
+from ..sensor import HallEffectSensor
+from ..track_point import TrackPoint
+from .utils import make_train, straight_line
+
+
+class SimulatedControlTestCase(unittest.TestCase):
+    def setUp(self):
+        self.layout = Layout()
+        self.straights = straight_line(self.layout, 20)
+        # 168 studs along
+        self.sensor = HallEffectSensor(
+            track_point=TrackPoint(self.straights[10], "in", "out", 8),
+            layout=self.layout,
+        )
+        self.layout.add_sensor(self.sensor)
+        self.simulator = TrackSimulator(self.layout, seed=0, realtime=False)
+
+    def add_train(self, front, **kwargs):
+        return make_train(
+            self.layout,
+            TrackPoint(self.straights[0], "in") + front,
+            magnet=True,
+            **kwargs
+        )
+
+    def test_magnet_arrivals_at_polled_sensors(self):
+        controller = SimulatedMaestroController(
+            layout=self.layout, simulator=self.simulator
+        )
+        train = self.add_train(150)
+        train.maximum_motor_speed = 1
+        self.layout.tick(None, time=100, time_elapsed=0)
+        # Only sensors that are polled
+        self.assertEqual({}, self.layout.magnet_arrivals)
+
+        controller.register_sensor(self.sensor, index=0)
+        self.layout.tick(None, time=100, time_elapsed=0)
+        # The magnet is 140 studs along, and the sensor 168
+        expected_in = (168 - 140) / self.layout.fleet.speed(train)
+        self.assertAlmostEqual(
+            expected_in, controller.magnet_expected_in([self.sensor], 100)
+        )
+
+    def test_maestro_inputs_follow_magnets(self):
+        controller = SimulatedMaestroController(
+            layout=self.layout, simulator=self.simulator
+        )
+        controller.register_sensor(self.sensor, index=0)
+        train = self.add_train(150)
+        self.simulator.add_train(train)
+        self.simulator.set_motor_speed(train, 1)
+
+        edges = []
+        for _ in range(40):
+            self.simulator.step(0.05)
+            edges.extend(controller.poll(self.simulator.time))
+        self.assertEqual([(0, True), (0, False)], edges)
+        events = controller.sensor_events.drain()
+        self.assertEqual([True, False], [event.activated for event in events])
+        self.assertEqual({self.sensor}, {event.sensor for event in events})
+
+    def test_headless_run_spots_trains(self):
+        simulator = TrackSimulator(
+            self.layout, seed=0, realtime=False, tick_layout=True
+        )
+        controller = SimulatedMaestroController(layout=self.layout, simulator=simulator)
+        controller.register_sensor(self.sensor, index=0)
+        self.layout.add_controller(controller)
+        train = self.add_train(150)
+        simulator.add_train(train)
+        simulator.set_motor_speed(train, 1)
+        train.maximum_motor_speed = 1
+
+        spotted = []
+
+        def on_train_spotted(sender, sensor, when, **kwargs):
+            spotted.append((sensor, when))
+
+        signals.train_spotted.connect(on_train_spotted, train)
+        try:
+            for _ in range(300):
+                simulator.step(0.005)
+                controller.poll()
+        finally:
+            signals.train_spotted.disconnect(on_train_spotted, train)
+        # Spotted as the simulation runs, on the simulator's clock, rather than
+        # waiting for the layout to stop
+        self.assertEqual(1, len(spotted))
+        sensor, when = spotted[0]
+        self.assertIs(self.sensor, sensor)
+        self.assertLess(when, simulator.time)
+
+    def test_hub_latency_and_disconnects(self):
+        controller = SimulatedPoweredUpController(
+            layout=self.layout, simulator=self.simulator, latency=0.1, jitter=0
+        )
+        train = self.add_train(
+            50, controller=controller, controller_parameters={"mac_address": "AA"}
+        )
+        (hub,) = controller.hubs.values()
+        self.assertFalse(train.connected)
+
+        # Sent before the hub is connected, so lost until it connects
+        train.maximum_motor_speed = 0.5
+
+        asyncio.run(controller.start())
+        try:
+            self.simulator.step(0.1)
+            self.assertTrue(train.connected)
+
+            deadline = time.monotonic() + 1
+            # Wait for the dispatcher thread to send the command
+            while not self.simulator._scheduled and time.monotonic() < deadline:
+                time.sleep(0.001)
+            self.simulator.step(0.04)
+            self.assertEqual(0, self.simulator.trains[train].motor_speed)
+            self.simulator.step(0.07)
+            self.assertEqual(0.5, self.simulator.trains[train].motor_speed)
+
+            controller._disconnect(hub)
+            self.assertFalse(train.connected)
+            self.assertEqual(0, self.simulator.trains[train].motor_speed)
+        finally:
+            asyncio.run(controller.stop())
@@ -0,0 +1,180 @@
+import subprocess
+import sys
+import threading
+import unittest
+
+import numpy as np
+
+from .. import signals
+from ..speed_model import (
+    POWERS,
+    PolynomialSpeedModel,
+    RecursiveLeastSquares,
+    get_speed_model_backend,
+    polynomial_features,
+)
+
+
+def make_observations(count, seed=0):
+    rng = np.random.default_rng(seed)
+    X = np.column_stack(
+        [
+            rng.uniform(0.1, 1, count),
+            rng.uniform(0, 100, count),
+            rng.integers(0, 2, count),
+            rng.integers(0, 2, count),
+        ]
+    )
+    y = 60 * X[:, 0] + 0.1 * X[:, 1] * X[:, 0] - 3 * X[:, 3] + rng.normal(0, 1, count)
+    return X, y
+
+
+class PolynomialSpeedModelTestCase(unittest.TestCase):
+    def test_powers_match_sklearn(self):
+        from sklearn.preprocessing import PolynomialFeatures
+
+        features = PolynomialFeatures(3).fit(np.zeros((1, 4)))
+        self.assertEqual([tuple(p) for p in features.powers_], POWERS)
+
+    def test_matches_regression(self):
+        from sklearn.linear_model import LinearRegression
+
+        X, y = make_observations(50)
+        features = np.array([polynomial_features(row) for row in X])
+        regression = LinearRegression().fit(features, y)
+
+        model = PolynomialSpeedModel.from_regression(regression)
+        for row, speed in zip(X, regression.predict(features)):
+            self.assertAlmostEqual(speed, model.evaluate(*row), places=6)
+
+    def test_proportional(self):
+        model = PolynomialSpeedModel.proportional(60)
+        self.assertAlmostEqual(30, model.predict(0.5, None, False))
+        self.assertAlmostEqual(30, model.predict(0.5, 80, True))
+        self.assertEqual(0, model.predict(0, None, False))
+
+    def test_never_negative(self):
+        coefficients = [0.0] * len(POWERS)
+        coefficients[0] = -5
+        self.assertEqual(0, PolynomialSpeedModel(coefficients).predict(0.5, 50, True))
+
+    def test_memoised(self):
+        model = PolynomialSpeedModel.proportional(60)
+        model.predict(0.5, None, False)
+        self.assertEqual({(0.5, None, False): 30.0}, model._cache)
+
+
+class RecursiveLeastSquaresTestCase(unittest.TestCase):
+    def test_batch_fit_matches_updates(self):
+        X, y = make_observations(30)
+        features = np.array([polynomial_features(row) for row in X])
+        prior = PolynomialSpeedModel.proportional(60).coefficients
+
+        estimator = RecursiveLeastSquares(prior, forgetting=0.99)
+        for x, speed in zip(features, y):
+            estimator.update(x, speed)
+        batch = RecursiveLeastSquares.fit(features, y, prior, forgetting=0.99)
+
+        np.testing.assert_allclose(
+            estimator.coefficients, batch.coefficients, rtol=1e-6, atol=1e-6
+        )
+        np.testing.assert_allclose(
+            estimator.covariance, batch.covariance, rtol=1e-6, atol=1e-9
+        )
+
+    def test_learns(self):
+        X, y = make_observations(500)
+        estimator = RecursiveLeastSquares(
+            PolynomialSpeedModel.proportional(60).coefficients
+        )
+        for row, speed in zip(X, y):
+            estimator.update(polynomial_features(row), speed)
+        model = estimator.model()
+        # 60 * 0.5 + 0.1 * 80 * 0.5 - 3
+        self.assertAlmostEqual(31, model.evaluate(0.5, 80, 1, 1), delta=1)
+        self.assertAlmostEqual(34, model.evaluate(0.5, 80, 1, 0), delta=1)
+
+
+class SpeedModelBackendTestCase(unittest.TestCase):
+    def test_default_backend(self):
+        self.assertIs(RecursiveLeastSquares, get_speed_model_backend("rls"))
+        with self.assertRaises(ValueError):
+            get_speed_model_backend("nonexistent")
+
+    def test_sklearn_not_imported_until_needed(self):
+        subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import sys, letsgo.layout; assert 'sklearn' not in sys.modules",
+            ],
+            check=True,
+        )
+
+    def test_sklearn_backend_learns(self):
+        X, y = make_observations(500)
+        features = np.array([polynomial_features(row) for row in X])
+        backend = get_speed_model_backend("sklearn").fit(
+            features[:-1], y[:-1], PolynomialSpeedModel.proportional(60).coefficients
+        )
+        backend.update(features[-1], y[-1])
+        model = backend.model()
+        self.assertAlmostEqual(31, model.evaluate(0.5, 80, 1, 1), delta=1)
+        self.assertAlmostEqual(34, model.evaluate(0.5, 80, 1, 0), delta=1)
+
+
+class SpeedEstimationTestCase(unittest.TestCase):
+    def add_observations(self, estimation, count):
+        X, y = make_observations(count)
+        for row, speed in zip(X, y):
+            motor_speed, battery_level, battery_level_available, lights_on = row
+            estimation.data.append(
+                {
+                    "profile": [{"motor_speed": motor_speed}],
+                    "motor_speed": motor_speed,
+                    "battery_level": battery_level,
+                    "battery_level_available": battery_level_available,
+                    "lights_on": lights_on,
+                    "speed": speed,
+                }
+            )
+            estimation.update_model()
+
+    def test_bounded_history_and_refit(self):
+        from ..layout import Layout
+        from ..speed_estimation import SpeedEstimation
+        from ..train import Car, Train
+
+        train = Train(cars=[Car(length=20, bogey_offsets=[4, 16])], layout=Layout())
+        estimation = SpeedEstimation(train)
+        estimation.data = type(estimation.data)(maxlen=100)
+        self.add_observations(estimation, 300)
+        self.assertEqual(100, len(estimation.data))
+        online = estimation.model.evaluate(0.5, 80, 1, 1)
+
+        estimation.install_refit(
+            estimation.refit(estimation.get_constant_speed_profiles()), 300
+        )
+        self.assertAlmostEqual(
+            online, estimation.model.evaluate(0.5, 80, 1, 1), delta=1
+        )
+
+    def test_refit_installed_on_tick(self):
+        from ..layout import Layout
+        from ..train import Car, Train
+
+        train = Train(cars=[Car(length=20, bogey_offsets=[4, 16])], layout=Layout())
+        estimation = train.speed_estimation
+        estimation.refit_interval = 10
+        threads = []
+
+        def on_speed_model_changed(sender, model):
+            threads.append(threading.current_thread())
+
+        signals.train_speed_model_changed.connect(on_speed_model_changed, train)
+        self.add_observations(estimation, 10)
+        # Not installed by the worker thread when it's done
+        estimation._refit.result()
+        del threads[:]
+        estimation.tick()
+        self.assertEqual([threading.current_thread()], threads)
@@ -0,0 +1,172 @@
+import unittest
+
+from .. import pieces, signals
+from ..layout import Layout
+from ..topham_hatt import TophamHatt, WaitForGraph
+from ..track_point import TrackPoint
+from ..train import Car
+from .utils import make_train, straight_line
+
+
+def short_cars():
+    return [Car(length=12, bogey_offsets=[2, 10])]
+
+
+class WaitForGraphTestCase(unittest.TestCase):
+    def test_finds_cycles_from_changes(self):
+        graph = WaitForGraph()
+        trains = [object() for _ in range(3)]
+        layout = Layout()
+        blocks = [pieces.Straight(layout=layout) for _ in range(3)]
+        for train, block in zip(trains, blocks):
+            block.claimed_by = train
+        graph.wait(trains[0], blocks[1])
+        graph.wait(trains[1], blocks[2])
+        self.assertEqual([], graph.cycles())
+
+        graph.wait(trains[2], blocks[0])
+        self.assertEqual([[trains[2], trains[0], trains[1]]], graph.cycles())
+        # Nothing's changed since
+        self.assertEqual([], graph.cycles())
+
+        blocks[0].claimed_by = None
+        graph.claim_changed(blocks[0])
+        self.assertEqual([], graph.cycles())
+        blocks[0].claimed_by = trains[0]
+        graph.claim_changed(blocks[0])
+        self.assertEqual([[trains[2], trains[0], trains[1]]], graph.cycles())
+
+
+class TophamHattTestCase(unittest.TestCase):
+    def setUp(self):
+        self.layout = Layout()
+        self.straights = straight_line(self.layout, 8, closed=True)
+        self.topham_hatt = TophamHatt(self.layout, slow_down_distance=20)
+        self.deadlocks = []
+        signals.deadlock_detected.connect(self.on_deadlock_detected)
+
+    def tearDown(self):
+        signals.deadlock_detected.disconnect(self.on_deadlock_detected)
+
+    def on_deadlock_detected(self, sender, **kwargs):
+        self.deadlocks.append(kwargs)
+
+    def add_train(self, position, **kwargs):
+        train = make_train(self.layout, position, cars=short_cars(), **kwargs)
+        train.maximum_motor_speed = 1
+        return train
+
+    def test_claims_until_stopped(self):
+        train = self.add_train(TrackPoint(self.straights[2], "in") + 14)
+        # Told to stop, but still rolling
+        train.maximum_motor_speed = 0
+        train.physics.velocity = 60.0
+        self.topham_hatt.tick(None, time=0, time_elapsed=0.1)
+        self.assertIs(train, self.straights[3].claimed_by)
+        self.assertIs(train, self.straights[4].claimed_by)
+
+        train.physics.velocity = 0.0
+        self.topham_hatt.tick(None, time=0.1, time_elapsed=0.1)
+        self.assertIsNone(self.straights[3].claimed_by)
+        self.assertIsNone(self.straights[4].claimed_by)
+
+    def add_deadlocked_trains(self):
+        # Heading towards each other, stopped short of the piece the other has claimed
+        eastbound = self.add_train(TrackPoint(self.straights[2], "in") + 14)
+        westbound = self.add_train(
+            TrackPoint(self.straights[5], "out") + 14, meta={"priority": -1}
+        )
+        self.straights[3].claimed_by = eastbound
+        self.straights[4].claimed_by = westbound
+        for train in (eastbound, westbound):
+            train.speed_limits[self.topham_hatt] = 0
+            self.assertEqual(0, train.speed)
+        return eastbound, westbound
+
+    def test_lowest_priority_train_backs_off(self):
+        eastbound, westbound = self.add_deadlocked_trains()
+
+        self.topham_hatt.tick(None, time=0, time_elapsed=0.1)
+        self.assertEqual(1, len(self.deadlocks))
+        self.assertEqual({eastbound, westbound}, set(self.deadlocks[0]["trains"]))
+        self.assertIs(westbound, self.deadlocks[0]["train"])
+        self.assertTrue(self.deadlocks[0]["resolved"])
+        # Only the train giving way gives up its claims
+        self.assertIs(eastbound, self.straights[3].claimed_by)
+        self.assertIsNone(self.straights[4].claimed_by)
+
+        for i in range(1, 3):
+            self.topham_hatt.tick(None, time=i * 0.1, time_elapsed=0.1)
+        self.assertEqual(1, len(self.deadlocks))
+        self.assertIs(eastbound, self.straights[4].claimed_by)
+        self.assertEqual(0, westbound.speed_limits[self.topham_hatt])
+
+    def test_forgets_removed_trains(self):
+        eastbound, westbound = self.add_deadlocked_trains()
+        self.topham_hatt.tick(None, time=0, time_elapsed=0.1)
+        self.assertIn(westbound, self.topham_hatt.backed_off)
+        self.layout.remove_train(westbound)
+        self.layout.remove_train(eastbound)
+        self.assertEqual({}, self.topham_hatt.backed_off)
+        self.assertEqual({}, self.topham_hatt.wait_for.waiting_for)
+
+
+class ReroutingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.layout = Layout()
+        # A line into points, with the way they're set and their branch going on
+        self.approach = straight_line(self.layout, 3)
+        self.points = pieces.LeftPoints(layout=self.layout)
+        self.layout.add_piece(self.points, announce=False)
+        self.out = straight_line(self.layout, 3)
+        self.branch = straight_line(self.layout, 3)
+        self.approach[-1].anchors["out"] += self.points.anchors["in"]
+        self.points.anchors["out"] += self.out[0].anchors["in"]
+        self.points.anchors["branch"] += self.branch[0].anchors["in"]
+        self.topham_hatt = TophamHatt(self.layout, slow_down_distance=100)
+        self.deadlocks = []
+        signals.deadlock_detected.connect(self.on_deadlock_detected)
+
+    def tearDown(self):
+        signals.deadlock_detected.disconnect(self.on_deadlock_detected)
+
+    def on_deadlock_detected(self, sender, **kwargs):
+        self.deadlocks.append(kwargs)
+
+    def add_train(self, position, **kwargs):
+        train = make_train(self.layout, position, cars=short_cars(), **kwargs)
+        train.speed_limits[self.topham_hatt] = 0
+        return train
+
+    def test_reroutes_around_a_deadlock(self):
+        # Stopped having claimed through the points, waiting for the oncoming train
+        train = self.add_train(
+            TrackPoint(self.approach[1], "in") + 14, meta={"priority": -1}
+        )
+        oncoming = self.add_train(TrackPoint(self.out[2], "out") + 14)
+        for piece in (self.approach[2], self.points, self.out[0]):
+            piece.claimed_by = train
+        self.out[1].claimed_by = oncoming
+
+        self.topham_hatt.tick(None, time=0, time_elapsed=0.1)
+        self.assertEqual(1, len(self.deadlocks))
+        self.assertIs(train, self.deadlocks[0]["train"])
+        self.assertTrue(self.deadlocks[0]["resolved"])
+        self.assertEqual("branch", self.points.state)
+        # Its claims the way it was going are released, but not up to the points
+        self.assertIsNone(self.out[0].claimed_by)
+        self.assertIs(oncoming, self.out[1].claimed_by)
+        self.assertIs(train, self.points.claimed_by)
+        self.assertNotIn(train, self.topham_hatt.backed_off)
+
+        self.topham_hatt.tick(None, time=0.1, time_elapsed=0.1)
+        self.assertEqual(1, len(self.deadlocks))
+        self.assertNotIn(train, self.topham_hatt.wait_for.waiting_for)
+
+    def test_doesnt_set_points_under_a_train(self):
+        train = self.add_train(
+            TrackPoint(self.points, "in", "out") + 4, meta={"priority": -1}
+        )
+        self.topham_hatt.wait_for.wait(train, self.out[0])
+        self.assertFalse(self.topham_hatt.reroute(train))
+        self.assertEqual("out", self.points.state)
@@ -0,0 +1,81 @@
+import unittest
+
+from .. import pieces
+from ..layout import Layout
+from ..track_point import TrackPoint
+
+
+class TrackGraphTestCase(unittest.TestCase):
+    def setUp(self):
+        # A loop of sixteen curves, with a siding off some points
+        self.layout = Layout()
+        self.points = pieces.LeftPoints(layout=self.layout)
+        self.curves = [pieces.Curve(layout=self.layout) for _ in range(15)]
+        self.siding = [pieces.Straight(layout=self.layout) for _ in range(3)]
+        for piece in [self.points, *self.curves, *self.siding]:
+            self.layout.add_piece(piece, announce=False)
+        loop = [self.points, *self.curves]
+        for i in range(len(loop)):
+            loop[i - 1].anchors["out"] += loop[i].anchors["in"]
+        self.points.anchors["branch"] += self.siding[0].anchors["in"]
+        for previous, piece in zip(self.siding, self.siding[1:]):
+            previous.anchors["out"] += piece.anchors["in"]
+
+    def test_segments(self):
+        graph = self.layout.track_graph
+        # Each way around the loop, and each way along the siding
+        self.assertEqual(4, len(graph.segments))
+        segment, offset = graph.locate(TrackPoint(self.curves[0], "in", "out", 1))
+        self.assertEqual(16, len(segment.traversals))
+        self.assertEqual(32 + 1, offset)
+        self.assertIs(segment, segment.reverse.reverse)
+
+    def test_same_segment(self):
+        track_point = TrackPoint(self.curves[0], "in", "out", 1)
+        other = TrackPoint(self.curves[3], "in", "out", 2)
+        curve_length = self.curves[0].traversals("in")["out"][0]
+        self.assertAlmostEqual(3 * curve_length + 1, track_point.distance_to(other))
+        self.assertIsNone(other.distance_to(track_point, 100))
+
+    def test_around_the_loop(self):
+        curve_length = self.curves[0].traversals("in")["out"][0]
+        loop_length = 32 + 15 * curve_length
+        track_point = TrackPoint(self.curves[3], "in", "out", 2)
+        other = TrackPoint(self.curves[0], "in", "out", 1)
+        self.assertAlmostEqual(
+            loop_length - 3 * curve_length - 1,
+            track_point.distance_to(other, maximum_distance=1000),
+        )
+        self.assertIsNone(track_point.distance_to(other, maximum_distance=100))
+
+    def test_follows_points_state(self):
+        track_point = TrackPoint(self.curves[-1], "in", "out")
+        siding = TrackPoint(self.siding[1], "in", "out", 4)
+        self.assertIsNone(track_point.distance_to(siding))
+        self.points.state = "branch"
+        curve_length = self.curves[0].traversals("in")["out"][0]
+        self.assertAlmostEqual(
+            curve_length + self.points.branch_length + 16 + 4,
+            track_point.distance_to(siding),
+        )
+
+    def test_signed_distance(self):
+        track_point = TrackPoint(self.curves[0], "in", "out", 1)
+        other = TrackPoint(self.curves[0], "in", "out", 3)
+        self.assertEqual(2, track_point.signed_distance_to(other))
+        self.assertEqual(-2, other.signed_distance_to(track_point))
+        self.assertIsNone(other.signed_distance_to(other.reversed() + 8, 4))
+
+    def test_recompiled_on_topology_change(self):
+        graph = self.layout.track_graph
+        self.assertIs(graph, self.layout.track_graph)
+        extra = pieces.Straight(layout=self.layout)
+        self.layout.add_piece(extra)
+        extra.anchors["in"] += self.siding[-1].anchors["out"]
+        self.assertIsNot(graph, self.layout.track_graph)
+        self.assertAlmostEqual(
+            16 * 3 + 2,
+            TrackPoint(self.siding[0], "in").distance_to(
+                TrackPoint(extra, "in", "out", 2)
+            ),
+        )
@@ -1,3 +1,4 @@
+import tracemalloc
 import unittest
 
 from letsgo.track_point import EndOfTheLine
@@ -15,8 +16,6 @@ class TrackPointTestCase(unittest.TestCase):
         self.assertEqual("in", track_point.in_anchor)
         self.assertEqual(8, track_point.offset)
 
-    # The whole traversal thing is a mess that needs rewriting
-    @unittest.expectedFailure
     def test_backward_within_piece(self):
         piece = pieces.Straight(layout=None)
         track_point = TrackPoint(piece, "in", "out", 3)
@@ -45,4 +44,119 @@ class TrackPointTestCase(unittest.TestCase):
         self.assertEqual(7, track_point.offset)
 
     def test_backward_across_one_piece(self):
-        pass
+        layout = Layout()
+        piece, next_piece = pieces.Straight(layout=layout), pieces.Curve(layout=layout)
+        piece.anchors["out"] += next_piece.anchors["in"]
+        track_point = TrackPoint(next_piece, "in", "out", 3)
+        track_point -= 5
+        self.assertEqual(piece, track_point.piece)
+        self.assertEqual("in", track_point.in_anchor)
+        self.assertEqual("out", track_point.out_anchor)
+        self.assertEqual(14, track_point.offset)
+
+    def test_backward_through_points_follows_branch_decisions(self):
+        layout = Layout()
+        branch, points, straight = (
+            pieces.Straight(layout=layout),
+            pieces.LeftPoints(layout=layout),
+            pieces.Straight(layout=layout),
+        )
+        branch.anchors["out"] += points.anchors["branch"]
+        points.anchors["in"] += straight.anchors["in"]
+        track_point = TrackPoint(branch, "in")
+        track_point += 16 + points.branch_length + 8
+        # The points are set to "out", but we came through the branch
+        track_point -= 8 + points.branch_length + 4
+        self.assertEqual(branch, track_point.piece)
+        self.assertEqual(12, track_point.offset)
+
+    def test_reversed(self):
+        piece = pieces.Straight(layout=None)
+        track_point = TrackPoint(piece, "in", "out", 3).reversed()
+        self.assertEqual("out", track_point.in_anchor)
+        self.assertEqual("in", track_point.out_anchor)
+        self.assertEqual(13, track_point.offset)
+
+
+class AllocationTestCase(unittest.TestCase):
+    def setUp(self):
+        # An oval: two semicircles joined by long straights
+        self.layout = Layout()
+        self.pieces = (
+            [pieces.Curve(layout=self.layout) for _ in range(8)]
+            + [pieces.Straight(layout=self.layout) for _ in range(100)]
+            + [pieces.Curve(layout=self.layout) for _ in range(8)]
+            + [pieces.Straight(layout=self.layout) for _ in range(100)]
+        )
+        for piece in self.pieces:
+            self.layout.add_piece(piece, announce=False)
+        for i in range(len(self.pieces)):
+            self.pieces[i - 1].anchors["out"] += self.pieces[i].anchors["in"]
+
+    def assertAllocatesLessThan(self, size, func, *args):
+        # Only allocations from here on are traced, so the peak is just this call's
+        tracemalloc.start()
+        try:
+            before, _ = tracemalloc.get_traced_memory()
+            result = func(*args)
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertLess(peak - before, size)
+        return result, current - before
+
+    def test_add_shares_branch_decisions(self):
+        track_point = TrackPoint(self.pieces[0], "in")
+        track_point += 1000
+        moved = track_point + 500
+        self.assertIs(track_point.branch_decisions, moved.branch_decisions)
+
+    def test_decisions_recorded_only_at_merges(self):
+        layout = Layout()
+        branch, points, straight = (
+            pieces.Straight(layout=layout),
+            pieces.LeftPoints(layout=layout),
+            pieces.Straight(layout=layout),
+        )
+        branch.anchors["out"] += points.anchors["branch"]
+        points.anchors["in"] += straight.anchors["in"]
+        track_point = TrackPoint(branch, "in")
+        track_point += 16 + points.branch_length + 8
+        self.assertEqual(straight, track_point.piece)
+        self.assertEqual(1, len(track_point.branch_decisions))
+        self.assertEqual(
+            ("branch", points.branch_length),
+            track_point.branch_decisions[(points, "in")],
+        )
+
+    def test_add_doesnt_copy_history(self):
+        track_point = TrackPoint(self.pieces[0], "in")
+        track_point += 3000
+
+        def add():
+            for _ in range(100):
+                track_point + 1000
+
+        self.assertAllocatesLessThan(1024, add)
+
+    def test_moving_doesnt_accumulate_memory(self):
+        track_point = TrackPoint(self.pieces[0], "in")
+
+        def move():
+            nonlocal track_point
+            for _ in range(10000):
+                track_point += 3.3
+
+        _, retained = self.assertAllocatesLessThan(4096, move)
+        self.assertLess(retained, 1024)
+
+    def test_anchors_are_compact(self):
+        def create_pieces():
+            return [pieces.Straight(layout=None) for _ in range(1000)]
+
+        created, retained = self.assertAllocatesLessThan(2**21, create_pieces)
+        self.assertLess(retained / len(created), 1536)
+        anchor = created[0].anchors["in"]
+        self.assertFalse(hasattr(anchor, "__dict__"))
+        self.assertIsNone(anchor._id)
+        self.assertEqual(anchor.id, anchor.id)
@@ -0,0 +1,63 @@
+"""Track and trains for tests to share"""
+from typing import List, Optional, Tuple
+
+from .. import pieces
+from ..layout import Layout
+from ..track_point import TrackPoint
+from ..train import Car, Train
+
+
+def straight_line(
+    layout: Layout, count: int, closed: bool = False
+) -> List[pieces.Straight]:
+    """Adds straights to a layout, each joined to the next, and returns them
+
+    If `closed`, the last is joined back to the first, making a circle, topologically
+    speaking."""
+    straights = [pieces.Straight(layout=layout) for _ in range(count)]
+    for piece in straights:
+        layout.add_piece(piece, announce=False)
+    following = straights[1:] + straights[:1] if closed else straights[1:]
+    for previous, piece in zip(straights, following):
+        previous.anchors["out"] += piece.anchors["in"]
+    return straights
+
+
+def loop_with_siding(
+    layout: Layout, **kwargs
+) -> Tuple[pieces.LeftPoints, List[pieces.Curve], List[pieces.Straight]]:
+    """Adds a loop of sixteen curves to a layout, with a siding of three straights off
+    some points, returning the points, the curves and the siding"""
+    points = pieces.LeftPoints(layout=layout, **kwargs)
+    curves = [pieces.Curve(layout=layout) for _ in range(15)]
+    layout.add_piece(points, announce=False)
+    for piece in curves:
+        layout.add_piece(piece, announce=False)
+    loop = [points, *curves]
+    for i in range(len(loop)):
+        loop[i - 1].anchors["out"] += loop[i].anchors["in"]
+    siding = straight_line(layout, 3)
+    points.anchors["branch"] += siding[0].anchors["in"]
+    return points, curves, siding
+
+
+def make_train(
+    layout: Layout,
+    position: TrackPoint,
+    cars: Optional[List[Car]] = None,
+    magnet: bool = False,
+    **kwargs
+) -> Train:
+    """Adds a train to a layout, its front at a track point
+
+    Unless given other cars, it's a single car twenty studs long, with a magnet in the
+    middle if `magnet`."""
+    if cars is None:
+        cars = [
+            Car(length=20, bogey_offsets=[4, 16], magnet_offset=10)
+            if magnet
+            else Car(length=20, bogey_offsets=[4, 16])
+        ]
+    train = Train(cars=cars, position=position, layout=layout, **kwargs)
+    layout.add_train(train)
+    return train
@@ -0,0 +1,45 @@
+"""
+Ticks a layout from a UI's main loop
+
+Sensor events queued by controllers are only handled, and trains only moved, when the
+layout ticks, so something has to tick it. Without a UI, a TrackSimulator can do that;
+with one, call a Ticker from a timer on its main loop, e.g.
+`GLib.timeout_add(30, ticker)`.
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+from typing import Callable, Optional, TYPE_CHECKING
+
+from letsgo import signals
+
+if TYPE_CHECKING:
+    from letsgo.layout import Layout
+
+logger = logging.getLogger(__name__)
+
+
+class Ticker:
+    def __init__(self, layout: Layout, clock: Callable[[], float] = time.time):
+        self.layout = layout
+        self.clock = clock
+        """The time to tick with, on the same clock as controllers' sensor events"""
+        self.last_tick: Optional[float] = None
+        signals.tick.connect(layout.tick, sender=layout)
+
+    def __call__(self) -> bool:
+        """Sends a tick for the layout, returning whether to carry on ticking"""
+        if not self.layout.running.is_set():
+            # The layout's stopped, so the timer can be removed
+            return False
+        this_tick = self.clock()
+        time_elapsed = this_tick - self.last_tick if self.last_tick is not None else 0
+        self.last_tick = this_tick
+        try:
+            signals.tick.send(self.layout, time=this_tick, time_elapsed=time_elapsed)
+        except Exception:
+            # Don't stop ticking because of one bad tick
+            logger.exception("Tick failed")
+        return True
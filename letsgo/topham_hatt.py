@@ -2,13 +2,99 @@
 Sir Topham Hatt, teller of letsgo of where to go
 
 This module implements automated train control
+
+Trains claim pieces ahead of them, and slow to a stop short of pieces other trains have
+claimed. If trains end up waiting for each other in a circle, none of them will ever
+move again, so the dispatcher keeps a wait-for graph of which piece each train is
+waiting for, and which train has claimed each piece. As each train waits for at most one
+piece, and each piece is claimed by at most one train, a new deadlock can be found by
+following the chain from a train whose wait (or whose piece's claim) has changed, rather
+than searching the whole graph every tick.
+
+Optionally, the dispatcher can follow plans made by a cooperative planner (see
+`letsgo.planner`), which let trains share single track by timing them around each
+other. Trains are then held until each planned departure, points are set the way their
+plans go, and trains the planner couldn't plan for hold their positions.
 """
+from __future__ import annotations
+
+import logging
 import math
+from typing import Dict, List, Optional, Set, TYPE_CHECKING
 
+from letsgo import signals
 from letsgo.pieces.points import BasePoints
 
 from letsgo.layout import Layout
-from letsgo.track_point import EndOfTheLine
+from letsgo.track_point import EndOfTheLine, TrackPoint
+
+if TYPE_CHECKING:
+    from letsgo.pieces import Piece
+    from letsgo.planner import CooperativePlanner, Plan
+    from letsgo.track_graph import Segment
+    from letsgo.train import Train
+
+logger = logging.getLogger(__name__)
+
+
+class WaitForGraph:
+    """Which piece each train is waiting for, and so which trains it's waiting for"""
+
+    def __init__(self):
+        self.waiting_for: Dict[Train, Piece] = {}
+        self._waiting: Dict[Piece, Set[Train]] = {}
+        self._changed: Set[Train] = set()
+
+    def wait(self, train: Train, piece: Optional[Piece]):
+        """Records which piece a train is waiting for, if any"""
+        previous = self.waiting_for.get(train)
+        if previous is piece:
+            return
+        if previous is not None:
+            del self.waiting_for[train]
+            self._waiting[previous].discard(train)
+            if not self._waiting[previous]:
+                del self._waiting[previous]
+        if piece is not None:
+            self.waiting_for[train] = piece
+            self._waiting.setdefault(piece, set()).add(train)
+            self._changed.add(train)
+
+    def claim_changed(self, piece: Piece):
+        """Notes that a piece has been claimed or released"""
+        self._changed.update(self._waiting.get(piece, ()))
+
+    def remove_train(self, train: Train):
+        self.wait(train, None)
+        self._changed.discard(train)
+
+    def cycles(self) -> List[List[Train]]:
+        """Deadlocks formed by changes since the last check, each as the trains in it
+
+        Each train in a cycle is waiting for the next, and the last for the first.
+        """
+        found: List[List[Train]] = []
+        in_cycles: Set[Train] = set()
+        for train in self._changed:
+            if train in in_cycles:
+                continue
+            chain = [train]
+            while True:
+                piece = self.waiting_for.get(chain[-1])
+                holder = piece.claimed_by if piece is not None else None
+                if holder is None or holder is chain[-1]:
+                    break
+                if holder is train:
+                    found.append(chain)
+                    in_cycles.update(chain)
+                    break
+                if holder in chain:
+                    # A cycle that doesn't include this train, which one of its own
+                    # trains will have found if it's new
+                    break
+                chain.append(holder)
+        self._changed.clear()
+        return found
 
 
 class TophamHatt:
@@ -18,38 +104,239 @@ class TophamHatt:
         slow_speed: float = 0.1,
         stop_before_end_of_the_line: float = 16,
         slow_down_distance: float = 64,
+        planner: Optional[CooperativePlanner] = None,
     ):
         self.layout = layout
         self.slow_speed = slow_speed
         self.stop_before_end_of_the_line = stop_before_end_of_the_line
         self.slow_down_distance = slow_down_distance
+        self.planner = planner
+        """If given, trains follow its plans"""
+        self.wait_for = WaitForGraph()
+        self.backed_off: Dict[Train, float] = {}
+        """Trains held back to break a deadlock, and until when"""
+        self._time = 0.0
+        self._next_plan = -math.inf
+        signals.train_removed.connect(self.on_train_removed, layout)
+
+    def stopping_motor_speed(self, train, distance: float) -> float:
+        """The fastest motor speed from which a train can stop before a distance ahead
+
+        This allows for the train's braking distance, and for it to stop
+        `stop_before_end_of_the_line` short. Speed is taken to be proportional to
+        motor speed, so this errs on the side of caution if the train goes
+        proportionally faster at lower motor speeds.
+        """
+        top_speed = train.speed_estimation.predict(motor_speed=1)
+        if not top_speed:
+            return math.inf
+        return (
+            train.physics.stopping_speed(distance - self.stop_before_end_of_the_line)
+            / top_speed
+        )
+
+    back_off_time = 5.0
+    """How long, in seconds, to hold a train back to let others out of a deadlock"""
+
+    replan_interval = 5.0
+    """How often, in seconds, to have the planner plan again, if there is one"""
+
+    def priority(self, train: Train) -> float:
+        """Trains with lower priorities give way to break deadlocks"""
+        return train.meta.get("priority", 0)
 
     def tick(self, sender, time, time_elapsed):
         # print("Tick")
+        self._time = time
+        if self.planner is not None and time >= self._next_plan:
+            self.planner.plan(time)
+            self._next_plan = time + self.replan_interval
         for train in self.layout.trains.values():
             self.route_train(train)
+        for cycle in self.wait_for.cycles():
+            self.on_deadlock(cycle)
 
-    def route_train(self, train):
+    def on_train_removed(self, sender, train):
+        self.wait_for.remove_train(train)
+        self.backed_off.pop(train, None)
 
-        position, distance = train.position, 0
+    def claim(self, piece: Piece, train: Optional[Train]):
+        """Claims a piece for a train, or releases it"""
+        if piece.claimed_by is not train:
+            piece.claimed_by = train
+            self.wait_for.claim_changed(piece)
+
+    def release_ahead(self, train: Train, position: Optional[TrackPoint] = None):
+        """Releases the pieces a train has claimed ahead of its front, or of some other
+        position"""
+        try:
+            position, _ = (position or train.position).next_piece()
+            while position.piece and position.piece.claimed_by == train:
+                self.claim(position.piece, None)
+                position, _ = position.next_piece()
+        except EndOfTheLine:
+            pass
+
+    def on_deadlock(self, trains: List[Train]):
+        """Reports trains waiting for each other in a circle, and tries to get them
+        moving again by having the one with the lowest priority give way"""
+        logger.warning(
+            "Deadlock between trains %s", ", ".join(train.id for train in trains)
+        )
+        # If priorities are equal, the first train found gives way
+        victim = min(trains, key=self.priority)
+        if self.reroute(victim):
+            resolved = True
+        else:
+            self.back_off(victim)
+            # That only helps if the train waiting for it was waiting for a piece
+            # ahead of it, rather than one it's on
+            waiting = trains[trains.index(victim) - 1]
+            piece = self.wait_for.waiting_for.get(waiting)
+            resolved = piece is None or piece.claimed_by is not victim
+        signals.deadlock_detected.send(
+            self, trains=trains, train=victim, resolved=resolved
+        )
 
-        if train.speed == 0:
-            # Unreserve pieces we might have previously claimed when moving
-            position, _ = position.next_piece()
-            while position.piece.claimed_by == train:
-                position.piece.claimed_by = None
+    def reroute(self, train: Train) -> bool:
+        """Sets facing points ahead of a train the other way, if that avoids the piece
+        it's waiting for
+
+        Only points between the front of the train and the piece it's waiting for, and
+        which no train is on, are set. The train's claims the way they were set are
+        released.
+        """
+        waiting_for = self.wait_for.waiting_for.get(train)
+        if waiting_for is None:
+            return False
+        occupied = self.occupied_pieces()
+        position = train.position
+        seen_pieces = {position.piece}
+        while True:
+            try:
                 position, _ = position.next_piece()
+            except EndOfTheLine:
+                return False
+            piece = position.piece
+            if piece is None or piece is waiting_for or piece in seen_pieces:
+                return False
+            seen_pieces.add(piece)
+            if (
+                isinstance(piece, BasePoints)
+                and position.in_anchor == "in"
+                and piece.claimed_by in (None, train)
+                and piece not in occupied
+            ):
+                for state in ("out", "branch"):
+                    next_piece, _ = piece.anchors[state].next(piece)
+                    if state != piece.state and next_piece is not waiting_for:
+                        logger.info("Rerouting train %s through %s", train.id, state)
+                        abandoned = TrackPoint(piece, "in", piece.state)
+                        piece.state = state
+                        self.release_ahead(train, abandoned)
+                        self.wait_for.wait(train, None)
+                        return True
+
+    def occupied_pieces(self) -> Set[Piece]:
+        """The pieces any train is on"""
+        occupancy = self.layout.occupancy
+        occupied: Set[Piece] = set()
+        for train in self.layout.trains.values():
+            occupied.update(occupancy.pieces(train))
+        return occupied
+
+    def set_points(self, train: Train, segment: Segment) -> bool:
+        """Sets facing points for a train to go into a segment, if they need setting,
+        returning whether they're set that way"""
+        piece, in_anchor, out_anchor = segment.head
+        if not isinstance(piece, BasePoints) or in_anchor != "in":
+            return True
+        if piece.state == out_anchor:
+            return True
+        if piece.claimed_by not in (None, train) or piece in self.occupied_pieces():
+            return False
+        piece.state = out_anchor
+        return True
+
+    def follow_plan(self, train: Train, plan: Plan, claim_distance: float) -> float:
+        """Sets points ahead of a train the way its plan goes, returning the fastest
+        motor speed it can go at to wait for its next departure or to stop at its
+        destination
+
+        Points are only set as far ahead as the train claims pieces.
+        """
+        try:
+            segment, offset = self.layout.track_graph.locate(train.position)
+        except KeyError:
+            return math.inf
+        if segment not in plan.segments:
+            # It's gone off its plan, until the next is made
+            return math.inf
+        i = plan.segments.index(segment)
+        if self._time < plan.departures[i]:
+            return 0
+        assert self.planner is not None
+        speed = self.planner.speed(train)
+        # How far ahead the start of the next segment is
+        distance = segment.length - offset
+        for next_segment, departure in zip(
+            plan.segments[i + 1 :], plan.departures[i + 1 :]
+        ):
+            if distance - self.stop_before_end_of_the_line >= claim_distance:
+                return math.inf
+            # Departures only hold a train that would otherwise get there too soon
+            early = departure - self.planner.resolution > self._time + distance / speed
+            if early or not self.set_points(train, next_segment):
+                # Wait at the end of this segment
+                return self.stopping_motor_speed(
+                    train, distance + self.stop_before_end_of_the_line
+                )
+            distance += next_segment.length
+        # Stop at the destination, along the last segment
+        distance += plan.destination[1] - plan.segments[-1].length
+        return self.stopping_motor_speed(
+            train, distance + self.stop_before_end_of_the_line
+        )
+
+    def back_off(self, train: Train):
+        """Holds a train back for a while, releasing the pieces it's claimed ahead"""
+        self.backed_off[train] = self._time + self.back_off_time
+        self.release_ahead(train)
+        self.wait_for.wait(train, None)
+
+    def route_train(self, train):
 
-            position, distance = train.position, 0
+        position, distance = train.position, 0
 
         can_hide_behind_decision_point = False
 
         speed_limit = float("inf")
+        waiting_for = None
+
+        backed_off = self.backed_off.get(train)
+        if backed_off is not None and backed_off > self._time:
+            train.speed_limits[self] = 0
+            return
+        self.backed_off.pop(train, None)
+
+        # Claim pieces at least as far ahead as the train needs to stop, whether it's
+        # still going faster than it's been told to, or about to speed up
+        claim_distance = max(
+            self.slow_down_distance,
+            train.physics.braking_distance(max(train.speed, train.velocity)),
+        )
+
+        if self.planner is not None:
+            plan = self.planner.plans.get(train)
+            # Trains the planner couldn't plan for hold their positions
+            speed_limit = self.follow_plan(train, plan, claim_distance) if plan else 0
 
         # if train.meta.get('last_speed_limit') == 0:
         #     print("EE")
 
         seen_pieces = set()
+        reserving = True
+        last_reserved = position.piece
 
         while position.piece not in seen_pieces:
             seen_pieces.add(position.piece)
@@ -59,37 +346,28 @@ class TophamHatt:
             except EndOfTheLine as e:
                 speed_limit = min(
                     speed_limit,
-                    math.sqrt(
-                        max(
-                            0,
-                            (
-                                distance
-                                + e.remaining_distance
-                                - self.stop_before_end_of_the_line
-                            )
-                            / self.slow_down_distance,
-                        )
-                    ),
+                    self.stopping_motor_speed(train, distance + e.remaining_distance),
                 )
 
-            if (distance - self.stop_before_end_of_the_line) < self.slow_down_distance:
+            if (distance - self.stop_before_end_of_the_line) < claim_distance:
                 if position.piece.claimed_by == train:
                     pass
                 elif position.piece.claimed_by:
                     speed_limit = min(
-                        speed_limit,
-                        math.sqrt(
-                            max(
-                                0,
-                                (distance - self.stop_before_end_of_the_line)
-                                / self.slow_down_distance,
-                            )
-                        ),
+                        speed_limit, self.stopping_motor_speed(train, distance)
                     )
-                elif train.speed:
-                    position.piece.claimed_by = train
+                    waiting_for = waiting_for or position.piece
+                elif (train.speed or train.velocity) and waiting_for is None:
+                    # Including while braking, as it'll roll on a way yet
+                    self.claim(position.piece, train)
+            elif not reserving:
+                break
 
-            traversals = position.piece.traversals(position.anchor_name)
+            if not reserving:
+                continue
+
+            last_reserved = position.piece
+            traversals = position.piece.traversals(position.in_anchor)
             if len(position.piece.traversals(list(traversals)[0])) > 1:
                 can_hide_behind_decision_point = True
 
@@ -99,36 +377,40 @@ class TophamHatt:
             ):
                 position.piece.reservations[train] = {
                     "distance": distance,
-                    "anchor_name": position.anchor_name,
+                    "in_anchor": position.in_anchor,
                     "can_hide_behind_decision_point": can_hide_behind_decision_point,
                 }
 
-            # Only reserve as far as the next decision point
+            # Only reserve as far as the next decision point, but carry on claiming the
+            # way points are set, so that if the train ends up waiting beyond them,
+            # they can be set the other way
             if len(traversals) > 1:
-                break
+                reserving = False
+                continue
 
             # Check whether something the other way would have a choice to avoid us
             other_reservations = [
                 reservation
                 for other_train, reservation in position.piece.reservations.items()
                 if other_train != train
-                and reservation["anchor_name"] != position.anchor_name
+                and reservation["in_anchor"] != position.in_anchor
             ]
             if can_hide_behind_decision_point and any(
                 not reservation["can_hide_behind_decision_point"]
                 for reservation in other_reservations
             ):
                 speed_limit = min(
-                    speed_limit,
-                    math.sqrt(
-                        max(
-                            0,
-                            (distance - self.stop_before_end_of_the_line)
-                            / self.slow_down_distance,
-                        )
-                    ),
+                    speed_limit, self.stopping_motor_speed(train, distance)
                 )
 
+        self.wait_for.wait(train, waiting_for)
+
+        if train.speed == 0 and train.velocity == 0 and waiting_for is None:
+            # Unreserve pieces we might have previously claimed when moving, once we've
+            # actually stopped. Trains waiting for others keep theirs, so as not to lose
+            # their place, and so that if they're waiting for each other, it's noticed.
+            self.release_ahead(train)
+
         if speed_limit > 1:
             speed_limit = None
 
@@ -136,7 +418,7 @@ class TophamHatt:
         train.meta["last_speed_limit"] = speed_limit
         # print(speed_limit)
 
-        if isinstance(position.piece, BasePoints):
+        if isinstance(last_reserved, BasePoints):
 
             train.meta[
                 "annotation"
@@ -145,13 +427,16 @@ class TophamHatt:
                 train.meta["annotation"] += f" {speed_limit:.1f}"
 
         # Unreserve pieces we've passed through
-        rear_position, _ = train.rear_position.reversed().next_piece(
-            use_branch_decisions=True
-        )
-        while rear_position.piece.claimed_by == train:
-            rear_position.piece.claimed_by = None
-            del rear_position.piece.reservations[train]
-            rear_position, _ = rear_position.next_piece(use_branch_decisions=True)
+        try:
+            rear_position, _ = train.rear_position.reversed().next_piece(
+                use_branch_decisions=True
+            )
+            while rear_position.piece.claimed_by == train:
+                self.claim(rear_position.piece, None)
+                rear_position.piece.reservations.pop(train, None)
+                rear_position, _ = rear_position.next_piece(use_branch_decisions=True)
+        except EndOfTheLine:
+            pass
 
         return
 
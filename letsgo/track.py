@@ -4,7 +4,7 @@ import collections
 import math
 import uuid
 import weakref
-from typing import Dict, Optional, TYPE_CHECKING
+from typing import AbstractSet, Dict, Iterator, Optional, TYPE_CHECKING
 
 import cairo
 
@@ -13,6 +13,8 @@ if TYPE_CHECKING:
 
 
 class Position:
+    __slots__ = ("x", "y", "angle")
+
     def __init__(self, x: float, y: float, angle: float):
         self.x = x
         self.y = y
@@ -84,15 +86,34 @@ class Anchor(dict):
     `anchor_1 += anchor_2`.
     """
 
+    __slots__ = ("_id", "position", "_subsumes", "__weakref__")
+
     def __init__(self, initial: Dict[Piece, str], id=None, **kwargs):
         super().__init__(initial)
         # self.layout = layout
-        self.id = id or str(uuid.uuid4())
+        self._id: Optional[str] = id
         self.position: Optional[Position] = None
-        self.subsumes: weakref.WeakSet[Anchor] = weakref.WeakSet()
+        self._subsumes: Optional[weakref.WeakSet[Anchor]] = None
         # if self._position:
         #     signals.anchor_p
 
+    @property
+    def id(self) -> str:
+        """The anchor's identifier, generated on first use if not given explicitly"""
+        if self._id is None:
+            self._id = str(uuid.uuid4())
+        return self._id
+
+    @property
+    def subsumes(self) -> AbstractSet[Anchor]:
+        """Anchors that have been merged into this one"""
+        return self._subsumes or frozenset()
+
+    def pop_subsumed(self) -> Iterator[Anchor]:
+        """Yields each subsumed anchor, forgetting it"""
+        while self._subsumes:
+            yield self._subsumes.pop()
+
     def __setitem__(self, key: Piece, value: str):
         assert key in self or len(self) < 2
         super().__setitem__(key, value)
@@ -114,6 +135,7 @@ class Anchor(dict):
 
         other.position = None
         other_piece.layout.anchor_positioned(other)
+        other_piece.layout.topology_changed()
 
         if piece.placement_origin != other_piece.placement_origin:
             if other_piece.placement_origin:
@@ -156,6 +178,7 @@ class Anchor(dict):
             other_piece.anchors[other_anchor_name] = other_anchor
 
             piece.layout.anchors[other_anchor.id] = other_anchor
+            piece.layout.topology_changed()
 
             updated_pieces = (
                 other_piece.placement_origin.update_connected_subset_positions()
@@ -0,0 +1,343 @@
+"""
+A compiled, directed graph of a track layout
+
+Track is compiled into *segments*: maximal runs of piece traversals that can only be
+followed one way, i.e. which don't pass a point where track diverges or converges. A
+position on the track can then be expressed as a segment and an offset along it, and
+distances along a segment are a subtraction of prefix sums.
+
+The graph only depends on how pieces are connected, not on the state of points, which
+is read when searching between segments. A layout keeps a compiled graph up to date
+with its `topology_epoch` (see `Layout.track_graph`).
+"""
+
+from __future__ import annotations
+
+import heapq
+import itertools
+import math
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TYPE_CHECKING,
+)
+
+if TYPE_CHECKING:
+    from letsgo.pieces import Piece
+    from letsgo.track_point import TrackPoint
+
+Traversal = Tuple["Piece", str, str]
+"""A piece, and the anchors a train enters and leaves it by"""
+
+
+class Segment:
+    """A maximal run of traversals without divergence or convergence"""
+
+    __slots__ = (
+        "index",
+        "traversals",
+        "offsets",
+        "length",
+        "is_loop",
+        "successors",
+        "predecessors",
+        "reverse",
+        "__weakref__",
+    )
+
+    def __init__(self, index: int, traversals: List[Traversal], is_loop: bool):
+        self.index = index
+        self.traversals = traversals
+        self.is_loop = is_loop
+        self.offsets: List[float] = [
+            0.0,
+            *itertools.accumulate(
+                piece.traversals(in_anchor)[out_anchor][0]
+                for piece, in_anchor, out_anchor in traversals
+            ),
+        ]
+        """Prefix sums of traversal lengths, i.e. where each traversal starts"""
+        self.length = self.offsets[-1]
+        self.successors: List[Segment] = []
+        self.predecessors: List[Segment] = []
+        self.reverse: Optional[Segment] = None
+        """The same track, traversed the other way"""
+
+    @property
+    def head(self) -> Traversal:
+        return self.traversals[0]
+
+    @property
+    def tail(self) -> Traversal:
+        return self.traversals[-1]
+
+    @property
+    def available(self) -> bool:
+        """Whether the segment can currently be entered, given the state of points"""
+        piece, in_anchor, out_anchor = self.head
+        return piece.traversals(in_anchor)[out_anchor][1]
+
+    def traversal_at(self, offset: float) -> Tuple[Traversal, float]:
+        """Returns the traversal at an offset along this segment, and the offset into it"""
+        i = max(0, min(len(self.traversals) - 1, _bisect(self.offsets, offset) - 1))
+        return self.traversals[i], offset - self.offsets[i]
+
+    def __repr__(self):
+        return f"<Segment {self.index} {len(self.traversals)} traversals {self.length:.1f}>"
+
+
+def _bisect(offsets: List[float], offset: float) -> int:
+    lo, hi = 0, len(offsets)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if offset < offsets[mid]:
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+
+def _traversals(piece: Piece) -> Iterator[Traversal]:
+    for in_anchor in piece.anchor_names:
+        for out_anchor in piece.traversals(in_anchor):
+            yield piece, in_anchor, out_anchor
+
+
+def _next_traversals(traversal: Traversal) -> List[Traversal]:
+    piece, in_anchor, out_anchor = traversal
+    next_piece, next_in_anchor = piece.anchors[out_anchor].next(piece)
+    if not next_piece:
+        return []
+    return [
+        (next_piece, next_in_anchor, next_out_anchor)
+        for next_out_anchor in next_piece.traversals(next_in_anchor)
+    ]
+
+
+def _previous_traversals(traversal: Traversal) -> List[Traversal]:
+    piece, in_anchor, out_anchor = traversal
+    previous_piece, previous_out_anchor = piece.anchors[in_anchor].next(piece)
+    if not previous_piece:
+        return []
+    return [
+        (previous_piece, previous_in_anchor, previous_out_anchor)
+        for previous_in_anchor in previous_piece.anchor_names
+        if previous_out_anchor in previous_piece.traversals(previous_in_anchor)
+    ]
+
+
+class TrackGraph:
+    def __init__(self, pieces: Iterable[Piece], epoch: Optional[int] = None):
+        self.epoch = epoch
+        self.segments: List[Segment] = []
+        self._locations: Dict[Traversal, Tuple[Segment, int]] = {}
+
+        traversals = [t for piece in pieces for t in _traversals(piece)]
+        next_traversals = {t: _next_traversals(t) for t in traversals}
+        previous_traversals = {t: _previous_traversals(t) for t in traversals}
+
+        def links_forward(traversal: Traversal) -> Optional[Traversal]:
+            """The traversal that follows this one in the same segment, if any"""
+            following = next_traversals[traversal]
+            if (
+                len(following) == 1
+                and len(previous_traversals.get(following[0], ())) == 1
+            ):
+                return following[0]
+            return None
+
+        def is_head(traversal: Traversal) -> bool:
+            previous = previous_traversals[traversal]
+            return not (len(previous) == 1 and links_forward(previous[0]) == traversal)
+
+        seen: Set[Traversal] = set()
+        # Segments with a start, and then any loops that remain
+        for traversal in itertools.chain(
+            (t for t in traversals if is_head(t)), traversals
+        ):
+            if traversal in seen:
+                continue
+            chain: List[Traversal] = []
+            following: Optional[Traversal] = traversal
+            while following and following not in seen:
+                seen.add(following)
+                chain.append(following)
+                following = links_forward(following)
+            self._add_segment(chain, is_loop=following == traversal)
+
+        for segment in self.segments:
+            for following in next_traversals[segment.tail]:
+                successor, _ = self._locations[following]
+                segment.successors.append(successor)
+                successor.predecessors.append(segment)
+            piece, in_anchor, out_anchor = segment.tail
+            reverse = self._locations.get((piece, out_anchor, in_anchor))
+            if reverse:
+                segment.reverse = reverse[0]
+
+    @classmethod
+    def from_connected_pieces(cls, piece: Piece) -> TrackGraph:
+        """Compiles a graph of all pieces connected to the given piece"""
+        pieces, stack = {piece}, [piece]
+        while stack:
+            piece = stack.pop()
+            for anchor in piece.anchors.values():
+                next_piece, _ = anchor.next(piece)
+                if next_piece and next_piece not in pieces:
+                    pieces.add(next_piece)
+                    stack.append(next_piece)
+        return cls(pieces)
+
+    def _add_segment(self, traversals: List[Traversal], is_loop: bool):
+        segment = Segment(len(self.segments), traversals, is_loop)
+        self.segments.append(segment)
+        for i, traversal in enumerate(traversals):
+            self._locations[traversal] = segment, i
+
+    def locate(self, track_point: TrackPoint) -> Tuple[Segment, float]:
+        """Returns the segment containing a track point, and its offset along it"""
+        segment, i = self._locations[
+            track_point.piece, track_point.in_anchor, track_point.out_anchor
+        ]
+        return segment, segment.offsets[i] + track_point.offset
+
+    def distance(
+        self,
+        from_track_point: TrackPoint,
+        to_track_point: TrackPoint,
+        maximum_distance: float = math.inf,
+        follow_points_state: bool = True,
+    ) -> Optional[float]:
+        """Returns how far ahead one track point is of another, up to a maximum.
+
+        Both track points are directed, and the distance is measured in the direction
+        of `from_track_point`. If `follow_points_state` is True, only routes through
+        points as they are currently set are considered.
+        """
+        from_segment, from_offset = self.locate(from_track_point)
+        to_segment, to_offset = self.locate(to_track_point)
+        return self.segment_distance(
+            from_segment,
+            from_offset,
+            to_segment,
+            to_offset,
+            maximum_distance,
+            follow_points_state,
+        )
+
+    def segment_distance(
+        self,
+        from_segment: Segment,
+        from_offset: float,
+        to_segment: Segment,
+        to_offset: float,
+        maximum_distance: float = math.inf,
+        follow_points_state: bool = True,
+    ) -> Optional[float]:
+        # Fast path for positions along the same segment
+        if from_segment is to_segment:
+            if to_offset >= from_offset:
+                distance = to_offset - from_offset
+                return distance if distance <= maximum_distance else None
+            elif from_segment.is_loop:
+                distance = from_segment.length - from_offset + to_offset
+                return distance if distance <= maximum_distance else None
+
+        # Otherwise, a bounded Dijkstra search over segments
+        best: Dict[Segment, float] = {}
+        queue: List[Tuple[float, int, Segment]] = []
+        distance = from_segment.length - from_offset
+        for successor in from_segment.successors:
+            if not follow_points_state or successor.available:
+                heapq.heappush(queue, (distance, successor.index, successor))
+        while queue:
+            distance, _, segment = heapq.heappop(queue)
+            if distance > maximum_distance:
+                return None
+            if segment is to_segment:
+                distance += to_offset
+                return distance if distance <= maximum_distance else None
+            if segment in best:
+                continue
+            best[segment] = distance
+            distance += segment.length
+            for successor in segment.successors:
+                if successor not in best and (
+                    not follow_points_state or successor.available
+                ):
+                    heapq.heappush(queue, (distance, successor.index, successor))
+        return None
+
+    def distances_from(
+        self,
+        segment: Segment,
+        offset: float,
+        maximum_distance: float = math.inf,
+        follow_points_state: bool = True,
+    ) -> Dict[Segment, float]:
+        """Returns the distances to the start of every segment reachable from a point.
+
+        The segment the point is on is only included if it can be reached again.
+        """
+        distances: Dict[Segment, float] = {}
+        queue: List[Tuple[float, int, Segment]] = []
+        distance = segment.length - offset
+        for successor in segment.successors:
+            if not follow_points_state or successor.available:
+                heapq.heappush(queue, (distance, successor.index, successor))
+        while queue:
+            distance, _, segment = heapq.heappop(queue)
+            if distance > maximum_distance:
+                break
+            if segment in distances:
+                continue
+            distances[segment] = distance
+            distance += segment.length
+            for successor in segment.successors:
+                if successor not in distances and (
+                    not follow_points_state or successor.available
+                ):
+                    heapq.heappush(queue, (distance, successor.index, successor))
+        return distances
+
+    def signed_distance(
+        self,
+        track_point: TrackPoint,
+        other_track_point: TrackPoint,
+        maximum_distance: float = math.inf,
+        follow_points_state: bool = True,
+    ) -> Optional[float]:
+        """Searches both ahead of and behind a track point for another.
+
+        Returns a positive distance if the other track point is ahead, a negative
+        distance if it is behind (i.e. this one is ahead of it), or None if it is
+        further than `maximum_distance` either way. If both, the nearest wins.
+        """
+        segment, offset = self.locate(track_point)
+        other_segment, other_offset = self.locate(other_track_point)
+        ahead = self.segment_distance(
+            segment,
+            offset,
+            other_segment,
+            other_offset,
+            maximum_distance,
+            follow_points_state,
+        )
+        if ahead == 0:
+            return ahead
+        behind = self.segment_distance(
+            other_segment,
+            other_offset,
+            segment,
+            offset,
+            maximum_distance if ahead is None else ahead,
+            follow_points_state,
+        )
+        if behind is not None and (ahead is None or behind < ahead):
+            return -behind
+        return ahead
@@ -1,10 +1,13 @@
+from __future__ import annotations
+
 import enum
-from typing import Optional
+from typing import Any, List, Optional, Tuple
 
 from letsgo.pieces import Piece
 
 from . import track
 from .track import Position
+from .track_graph import TrackGraph
 
 _sentinel = object()
 
@@ -18,23 +21,89 @@ class EndOfTheLine(Exception):
         )
 
 
+class BranchDecisions:
+    """A persistent record of the way a track point came through pieces.
+
+    Each instance is immutable, and adding a decision returns a new instance that
+    shares the rest of the history with the old one, so track points can be copied
+    without copying their history. Only decisions that can't be inferred when
+    backtracking (i.e. where more than one way in leads to the same way out) need to
+    be recorded, and only the most recent `maximum_depth` decisions are kept.
+    """
+
+    __slots__ = ("key", "value", "parent", "depth")
+
+    maximum_depth = 64
+
+    def __init__(self, key=None, value=None, parent: Optional[BranchDecisions] = None):
+        self.key, self.value, self.parent = key, value, parent
+        self.depth: int = parent.depth + 1 if parent is not None else 0
+
+    def get(self, key, default=None):
+        node = self
+        # The empty root of every history has a depth of zero
+        while node.depth:
+            if node.key == key:
+                return node.value
+            node = node.parent  # type: ignore
+        return default
+
+    def __contains__(self, key):
+        return self.get(key, _sentinel) is not _sentinel
+
+    def __getitem__(self, key):
+        value = self.get(key, _sentinel)
+        if value is _sentinel:
+            raise KeyError(key)
+        return value
+
+    def __len__(self):
+        return self.depth
+
+    def with_decision(self, key, value) -> BranchDecisions:
+        if self.depth >= 2 * self.maximum_depth:
+            # Amortize trimming the oldest decisions by only doing it occasionally
+            decisions: List[Tuple[Any, Any]] = []
+            node = self
+            for _ in range(self.maximum_depth):
+                decisions.append((node.key, node.value))
+                node = node.parent  # type: ignore
+            trimmed = no_branch_decisions
+            for decision_key, decision_value in reversed(decisions):
+                trimmed = BranchDecisions(decision_key, decision_value, trimmed)
+            return BranchDecisions(key, value, parent=trimmed)
+        return BranchDecisions(key, value, parent=self)
+
+
+no_branch_decisions = BranchDecisions()
+
+
 class TrackPoint:
     """A single point on a track layout"""
 
+    __slots__ = (
+        "piece",
+        "in_anchor",
+        "out_anchor",
+        "offset",
+        "branch_decisions",
+        "train",
+    )
+
     def __init__(
         self,
         piece: Piece,
         in_anchor: str,
         out_anchor: str = None,
         offset: float = 0,
-        branch_decisions=None,
+        branch_decisions: BranchDecisions = no_branch_decisions,
         train=None,
     ):
         self.piece = piece
         self.in_anchor = in_anchor
         self.out_anchor = out_anchor or piece.available_traversal(in_anchor)[0]
         self.offset = offset
-        self.branch_decisions = branch_decisions or {}
+        self.branch_decisions = branch_decisions
         """Intended to be used for backtracking
 
         This is so we know which way we came through points when there were multiple
@@ -61,10 +130,17 @@ class TrackPoint:
         next_piece, next_in_anchor = self.piece.anchors[self.out_anchor].next(
             self.piece
         )
+        if not next_piece:
+            # The line ends this far beyond the start of this piece
+            raise EndOfTheLine(self.piece, self.out_anchor, anchor_distance)
+        next_out_anchor = None
+        if use_branch_decisions:
+            next_out_anchor, _ = self._get_traversal(next_piece, next_in_anchor, True)
         return (
             TrackPoint(
                 piece=next_piece,
                 in_anchor=next_in_anchor,
+                out_anchor=next_out_anchor,
                 offset=0,
                 train=self.train,
                 branch_decisions=self.branch_decisions,
@@ -73,20 +149,29 @@ class TrackPoint:
         )
 
     def _get_traversal(self, piece, anchor_name, use_branch_decisions):
-        if use_branch_decisions and (piece, anchor_name) in self.branch_decisions:
-            return self.branch_decisions[(piece, anchor_name)]
+        if use_branch_decisions:
+            # Backtracking, so look up which way we came, but don't record anything
+            if (piece, anchor_name) in self.branch_decisions:
+                return self.branch_decisions[(piece, anchor_name)]
+            return piece.available_traversal(anchor_name)
         else:
             out_anchor_name, anchor_distance = piece.available_traversal(anchor_name)
-            self.branch_decisions[(piece, out_anchor_name)] = (
-                anchor_name,
-                anchor_distance,
-            )
+            # Coming back this way would otherwise be ambiguous
+            if len(piece.traversals(out_anchor_name)) > 1:
+                self.branch_decisions = self.branch_decisions.with_decision(
+                    (piece, out_anchor_name), (anchor_name, anchor_distance)
+                )
             return out_anchor_name, anchor_distance
 
     def _add(self, piece, in_anchor, out_anchor, offset, use_branch_decisions=False):
-        out_anchor_name, anchor_distance = self._get_traversal(
-            piece, in_anchor, use_branch_decisions
-        )
+        if out_anchor:
+            # We already know which way we're going through the first piece
+            out_anchor_name = out_anchor
+            anchor_distance = piece.traversals(in_anchor)[out_anchor][0]
+        else:
+            out_anchor_name, anchor_distance = self._get_traversal(
+                piece, in_anchor, use_branch_decisions
+            )
         while offset > anchor_distance:
             next_piece, in_anchor = piece.anchors[out_anchor_name].next(piece)
             offset -= anchor_distance
@@ -97,7 +182,7 @@ class TrackPoint:
                 out_anchor_name, anchor_distance = self._get_traversal(
                     piece, in_anchor, use_branch_decisions
                 )
-        return piece, in_anchor, None, offset
+        return piece, in_anchor, out_anchor_name, offset
 
     def copy(self, train=_sentinel):
         return type(self)(
@@ -110,50 +195,52 @@ class TrackPoint:
         )
 
     def reversed(self):
-        anchor_name, anchor_distance = self._get_traversal(
-            self.piece, self.in_anchor, True
-        )
+        """Returns the same point on the track, facing the other way"""
+        anchor_distance = self.piece.traversals(self.in_anchor)[self.out_anchor][0]
         return TrackPoint(
             piece=self.piece,
-            anchor_name=anchor_name,
-            offset=anchor_distance,
+            in_anchor=self.out_anchor,
+            out_anchor=self.in_anchor,
+            offset=anchor_distance - self.offset,
             train=self.train,
-            branch_decisions=self.branch_decisions.copy(),
+            branch_decisions=self.branch_decisions,
         )
 
     def __add__(self, distance):
-        return TrackPoint(
-            *self._add(
-                self.piece, self.in_anchor, self.out_anchor, self.offset + distance
-            ),
-            branch_decisions=self.branch_decisions.copy(),
-        )
+        track_point = self.copy(train=None)
+        track_point += distance
+        return track_point
 
     def __iadd__(self, distance):
+        if distance < 0:
+            return self.__isub__(-distance)
         self.piece, self.in_anchor, self.out_anchor, self.offset = self._add(
             self.piece, self.in_anchor, self.out_anchor, self.offset + distance
         )
         return self
 
-    def _sub(self, piece, in_anchor, offset):
-        in_anchor, anchor_distance = self._get_traversal(piece, in_anchor, True)
+    def _sub(self, distance):
+        """Walks backwards, reversing the way we came through any points"""
+        anchor_distance = self.piece.traversals(self.in_anchor)[self.out_anchor][0]
         piece, in_anchor, out_anchor, offset = self._add(
-            piece, in_anchor, anchor_distance + offset, True
+            self.piece,
+            self.out_anchor,
+            self.in_anchor,
+            anchor_distance - self.offset + distance,
+            use_branch_decisions=True,
         )
-        anchor_name, anchor_distance = self._get_traversal(piece, in_anchor, True)
-        return piece, in_anchor, None, anchor_distance - offset
+        anchor_distance = piece.traversals(in_anchor)[out_anchor][0]
+        return piece, out_anchor, in_anchor, anchor_distance - offset
 
     def __sub__(self, distance):
-        return TrackPoint(
-            *self._sub(self.piece, self.in_anchor, distance - self.offset),
-            branch_decisions=self.branch_decisions.copy(),
-            train=self.train,
-        )
+        track_point = self.copy(train=None)
+        track_point -= distance
+        return track_point
 
     def __isub__(self, distance):
-        self.piece, self.in_anchor, self.out_anchor, self.offset = self._sub(
-            self.piece, self.in_anchor, distance - self.offset
-        )
+        if distance < 0:
+            return self.__iadd__(-distance)
+        self.piece, self.in_anchor, self.out_anchor, self.offset = self._sub(distance)
         return self
 
     def __str__(self):
@@ -161,17 +248,25 @@ class TrackPoint:
             f"TrackPoint({self.piece} {self.in_anchor} {self.out_anchor} {self.offset})"
         )
 
-    def distance_to(self, other, maximum_distance=1000):
-        distance = 0
-        position = self.copy()
-        while (
-            not (
-                position.piece == other.piece
-                and position.anchor_name == other.anchor_name
-            )
-            and distance < maximum_distance
-        ):
-            position, distance = position.next_piece(distance)
-        distance += other.offset - position.offset
-        if distance < maximum_distance:
-            return distance
+    def _track_graph(self) -> TrackGraph:
+        layout = getattr(self.piece, "layout", None)
+        if layout is not None and layout.pieces.get(self.piece.id) is self.piece:
+            return layout.track_graph
+        # Pieces in a PieceStore share one, as they're viewed afresh each time
+        store = getattr(self.piece, "store", None)
+        if store is not None:
+            return store.track_graph
+        # Not part of a layout, so compile just the track we're connected to
+        return TrackGraph.from_connected_pieces(self.piece)
+
+    def distance_to(
+        self, other: TrackPoint, maximum_distance: float = 1000
+    ) -> Optional[float]:
+        """Returns how far ahead `other` is, or None if it's not within the maximum"""
+        return self._track_graph().distance(self, other, maximum_distance)
+
+    def signed_distance_to(
+        self, other: TrackPoint, maximum_distance: float = 1000
+    ) -> Optional[float]:
+        """Like `distance_to`, but also looks behind, returning a negative distance"""
+        return self._track_graph().signed_distance(self, other, maximum_distance)
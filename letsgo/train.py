@@ -1,13 +1,18 @@
 import uuid
-from typing import List
+from typing import List, Optional, Tuple, TYPE_CHECKING
 
+from letsgo.car_positions import CarPositions
 from letsgo.control import Controller
+from letsgo.physics import DEFAULT_MASS_PER_STUD, TrainPhysics
 from letsgo.registry_meta import WithRegistry
 from letsgo.routeing import Itinerary
 from letsgo.speed_estimation import SpeedEstimation
 from letsgo.track_point import TrackPoint
 from . import signals
 
+if TYPE_CHECKING:
+    from letsgo.kinematics import KinematicsEngine
+
 
 class TrainNotOnTrack(Exception):
     pass
@@ -36,6 +41,8 @@ class SpeedLimits(dict):
 
 
 class Car:
+    __slots__ = ("length", "bogey_offsets", "nose", "tail", "magnet_offset", "mass")
+
     def __init__(
         self,
         length: float,
@@ -43,11 +50,14 @@ class Car:
         nose="vestibule",
         tail="vestibule",
         magnet_offset: float = None,
+        mass: Optional[float] = None,
     ):
         self.length = length
         self.bogey_offsets = bogey_offsets
         self.nose, self.tail = nose, tail
         self.magnet_offset = magnet_offset
+        self.mass = length * DEFAULT_MASS_PER_STUD if mass is None else mass
+        """In grams"""
 
     def serialize(self):
         return {
@@ -55,6 +65,7 @@ class Car:
             "bogey_offsets": self.bogey_offsets,
             "nose": self.nose,
             "tail": self.tail,
+            "mass": self.mass,
         }
 
 
@@ -73,8 +84,12 @@ class Train(WithRegistry):
         **kwargs
     ):
         super().__init__(**kwargs)
+        self.kinematics: Optional[KinematicsEngine] = None
+        """The engine moving this train, if it isn't moving itself"""
         self.cars = cars
         self.length = sum(car.length for car in cars) + 2 * (len(cars) - 1)
+        self._odometer = 0.0
+        self.car_positions = CarPositions(self)
         self.position = position
         self.meta = meta or {}
         self._name = name
@@ -99,6 +114,7 @@ class Train(WithRegistry):
         self.last_spotted_time = None
 
         self._speed_estimation = SpeedEstimation(self)
+        self.physics = TrainPhysics(self)
 
     def serialize(self):
         data = {
@@ -197,28 +213,84 @@ class Train(WithRegistry):
             self._name = value
             signals.train_name_changed.send(self, name=value)
 
+    @property
+    def speed_estimation(self) -> SpeedEstimation:
+        return self._speed_estimation
+
+    @property
+    def mass(self) -> float:
+        return sum(car.mass for car in self.cars)
+
     @property
     def speed(self):
-        return self._speed_estimation.predict()  # studs per second
+        """The speed the motor will take the train up (or down) to, in studs per second"""
+        if self.layout:
+            return self.layout.fleet.speed(self)
+        return self._speed_estimation.predict()
+
+    @property
+    def velocity(self) -> float:
+        """The speed the train is actually going, in studs per second"""
+        if self.kinematics is not None:
+            return self.kinematics.velocity_of(self)
+        return self.physics.velocity
 
     def tick(self, time, time_elapsed):
-        self.move(self.speed * time_elapsed)
+        self.move(self.physics.advance(self.speed, time_elapsed))
 
     @property
     def position(self):
+        if self.kinematics is not None:
+            self.kinematics.materialise(self)
         return self._position
 
     @position.setter
     def position(self, value):
         if value:
             self._position = value.copy(train=self)
-            self.rear_position = value.copy(train=self) - self.length
+            self._rear_position = value.copy(train=self) - self.length
         else:
-            self._position, self.rear_position = None, None
+            self._position, self._rear_position = None, None
+        self.car_positions.invalidate()
+        signals.train_positioned.send(self, position=self._position)
+
+    @property
+    def rear_position(self):
+        if self.kinematics is not None:
+            self.kinematics.materialise(self)
+        return self._rear_position
 
     def move(self, distance):
         if not self.position:
             raise TrainNotOnTrack
-        self.position += distance
-        self.rear_position += distance
-        # print(self, "Moving", distance, self.speed)
+        if self.kinematics is not None:
+            self.kinematics.move(self, distance)
+            return
+        self._position += distance
+        self._rear_position += distance
+        self._odometer += distance
+        signals.train_moved.send(self, distance=distance)
+
+    @property
+    def odometer(self) -> float:
+        """How far the train has moved, in studs, with moving backwards taking away"""
+        if self.kinematics is not None:
+            return self.kinematics.odometer_of(self)
+        return self._odometer
+
+    def car_offsets(self) -> List[float]:
+        """Returns how far the front of each car is behind the front of the train"""
+        offsets, car_offset = [], 0.0
+        for car in self.cars:
+            offsets.append(car_offset)
+            # The 1 is the gap between cars
+            car_offset += car.length + 1
+        return offsets
+
+    def magnet_offsets(self) -> List[Tuple[int, float]]:
+        """Returns the index of each car with a magnet, and how far it is behind the front"""
+        return [
+            (i, car_offset + car.magnet_offset)
+            for i, (car, car_offset) in enumerate(zip(self.cars, self.car_offsets()))
+            if car.magnet_offset is not None
+        ]